@@ -0,0 +1,264 @@
+"""
+Ingestion throughput benchmark.
+
+Generates synthetic meter files (see generate_energy_csv.py), pushes
+them through the real ingestion service functions and writes rows/s,
+peak RSS and per-stage timings as JSON so results can be diffed
+between releases.
+
+    python -m benchmarks.ingestion --sizes 10k,1m --output bench.json
+    python -m benchmarks.ingestion --sizes 10m --analytics run
+
+Paths:
+  stream    ingest_csv_stream (POST /ingest/csv/stream): chunked COPY
+  file      ingest_csv_file (POST /ingest/csv): whole-file read, one batch
+
+Both go through fingerprinting, validation, rejects, the COPY or
+staging merge, batch keys, the audit log and the analytics enqueue, so
+a regression anywhere in the service shows up here. Stage timings are
+the service's own `stage_seconds`.
+
+Runs against the engine from db.session (point it at a scratch
+database). Every case gets its own file whose device and department
+ids carry a unique BENCH prefix, so cases never collide with each
+other or with real meters. Everything a case wrote, including derived
+analytics rows for its ids, is deleted afterwards unless --keep is
+given.
+
+Each case runs in a fresh process so peak RSS is per case.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+
+SIZES = {
+    "10k": 10_000,
+    "1m": 1_000_000,
+    "10m": 10_000_000,
+}
+
+PATHS = ("stream", "file")
+STAGES = ("fingerprint", "read", "validate", "write", "finalize", "enqueue", "analytics")
+
+# How often to poll the analytics job with --analytics run
+JOB_POLL_SECONDS = 0.2
+
+# Tables the cleanup deletes from by batch id rather than by device id
+BATCH_TABLES = ("ingestion_rejects",)
+
+# Deleted last: energy_events references them
+DIMENSION_TABLES = ("devices", "departments")
+
+
+def _data_file(n_rows: int, data_dir: str, id_prefix: str) -> str:
+    from generate_energy_csv import write_energy_csv
+
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, f"energy_{n_rows}_{id_prefix.strip('-').lower()}.csv")
+    return write_energy_csv(path, n_rows, id_prefix=id_prefix)
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return round(peak / divisor, 1)
+
+
+def _wait_for_job(job_id: str) -> dict:
+    from services.jobs.queue import analytics_queue
+
+    while True:
+        job = analytics_queue.get(job_id)
+        if job is None or job["status"] in ("succeeded", "failed"):
+            return job
+        time.sleep(JOB_POLL_SECONDS)
+
+
+def _run_case(path: str, ingest_path: str, analytics: str,
+              chunk_size: int, on_conflict: str) -> dict:
+    from starlette.datastructures import UploadFile
+    from services.ingestion.service import ingest_csv_file, ingest_csv_stream
+    from services.jobs.queue import analytics_queue
+
+    if analytics == "skip":
+        # The enqueue is still timed; the run never starts
+        analytics_queue.pause()
+
+    with open(path, "rb") as fileobj:
+        upload = UploadFile(file=fileobj, filename=os.path.basename(path))
+
+        started = time.perf_counter()
+        if ingest_path == "stream":
+            result = ingest_csv_stream(upload, chunk_size=chunk_size, on_conflict=on_conflict)
+        else:
+            result = ingest_csv_file(upload, on_conflict=on_conflict)
+        ingest_seconds = time.perf_counter() - started
+
+    stages = dict(result.get("stage_seconds", {}))
+    job = None
+    if analytics == "run" and result.get("analytics_job_id"):
+        analytics_started = time.perf_counter()
+        job = _wait_for_job(result["analytics_job_id"])
+        stages["analytics"] = round(time.perf_counter() - analytics_started, 4)
+
+    received = result.get("records_received", result["records_ingested"])
+
+    return {
+        "path": ingest_path,
+        "batch_id": result.get("batch_id"),
+        "fingerprint": result.get("fingerprint"),
+        "rows": result["records_ingested"],
+        "rejected": result.get("records_rejected", 0),
+        "total_seconds": round(ingest_seconds, 3),
+        "rows_per_second": round(received / ingest_seconds, 1) if ingest_seconds > 0 else None,
+        "peak_rss_mb": _peak_rss_mb(),
+        "stages": {stage: stages.get(stage) for stage in STAGES},
+        "analytics_status": job["status"] if job else None,
+        "analytics_stage_timings": job["stage_timings"] if job else None,
+    }
+
+
+def _cleanup(id_prefix: str, result: dict):
+    """
+    Delete everything a case wrote: rows of its BENCH-prefixed devices
+    and departments in every table that has those columns (raw events,
+    batch keys, derived analytics, dimensions), plus its rejects, audit
+    entry and ingestion_files fingerprint.
+    """
+    from sqlalchemy import text
+    from db.session import engine
+
+    params = {"prefix": id_prefix, "n": len(id_prefix)}
+
+    with engine.begin() as conn:
+        columns = conn.execute(text("""
+            SELECT c.table_name, c.column_name
+            FROM information_schema.columns c
+            JOIN information_schema.tables t
+              ON t.table_schema = c.table_schema
+             AND t.table_name = c.table_name
+            WHERE c.table_schema = current_schema()
+              AND t.table_type = 'BASE TABLE'
+              AND c.column_name IN ('device_id', 'department_id')
+        """)).fetchall()
+
+        tables = {}
+        for table, column in columns:
+            # device_id where there is one, it's the narrower filter
+            if tables.get(table) != "device_id":
+                tables[table] = column
+
+        ordered = sorted(tables.items(), key=lambda item: item[0] in DIMENSION_TABLES)
+        for table, column in ordered:
+            conn.execute(
+                text(f"DELETE FROM {table} WHERE LEFT({column}, :n) = :prefix"),
+                params,
+            )
+
+        if result.get("batch_id"):
+            for table in BATCH_TABLES:
+                conn.execute(
+                    text(f"DELETE FROM {table} WHERE ingestion_batch_id = :batch_id"),
+                    {"batch_id": result["batch_id"]},
+                )
+            conn.execute(
+                text("DELETE FROM audit_logs WHERE payload->>'batch_id' = :batch_id"),
+                {"batch_id": result["batch_id"]},
+            )
+
+        if result.get("fingerprint"):
+            conn.execute(
+                text("DELETE FROM ingestion_files WHERE fingerprint = :fingerprint"),
+                {"fingerprint": result["fingerprint"]},
+            )
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"],
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ingestion throughput benchmark")
+    parser.add_argument("--sizes", default="10k,1m",
+                        help=f"comma separated, from {', '.join(SIZES)}")
+    parser.add_argument("--paths", default=",".join(PATHS),
+                        help="stream (chunked COPY) and/or file (whole-file /ingest/csv)")
+    parser.add_argument("--analytics", choices=("skip", "run"), default="skip",
+                        help="skip: hold the queued job; run: wait for it and time it")
+    parser.add_argument("--on-conflict", choices=("error", "skip", "update"), default="skip")
+    parser.add_argument("--chunk-size", type=int, default=50_000)
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "envision_bench"))
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--keep", action="store_true", help="keep benchmark rows in postgres")
+    args = parser.parse_args(argv)
+
+    sizes = [s.strip().lower() for s in args.sizes.split(",") if s.strip()]
+    paths = [p.strip() for p in args.paths.split(",") if p.strip()]
+
+    results = []
+    for size in sizes:
+        n_rows = SIZES[size]
+
+        for ingest_path in paths:
+            id_prefix = f"BENCH-{uuid.uuid4().hex[:8]}-"
+            data_file = _data_file(n_rows, args.data_dir, id_prefix)
+
+            result = {}
+            try:
+                # Fresh process per case so peak RSS isn't inherited
+                with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+                    result = pool.submit(
+                        _run_case, data_file, ingest_path, args.analytics,
+                        args.chunk_size, args.on_conflict,
+                    ).result()
+            finally:
+                os.remove(data_file)
+                # Also after a failed case
+                if not args.keep:
+                    _cleanup(id_prefix, result)
+
+            result["size"] = size
+            result["id_prefix"] = id_prefix
+            results.append(result)
+            print(
+                f"{size:>4} {ingest_path:<7} {result['rows_per_second']:>12} rows/s "
+                f"peak {result['peak_rss_mb']} MB"
+            )
+
+    report = {
+        "benchmark": "ingestion",
+        "generated_at": datetime.utcnow().isoformat(),
+        "git_commit": _git_commit(),
+        "python": platform.python_version(),
+        "analytics": args.analytics,
+        "on_conflict": args.on_conflict,
+        "chunk_size": args.chunk_size,
+        "results": results,
+    }
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,9 @@
-from sqlalchemy import Column, Integer, String, Float, Date
+from datetime import datetime
+
+from sqlalchemy import (
+    Column, Integer, BigInteger, String, Float, Date, DateTime, Boolean, Index
+)
+from sqlalchemy.dialects.postgresql import JSONB
 from db.models import Base
 
 class DailyEnergySummary(Base):
@@ -8,7 +13,138 @@ class DailyEnergySummary(Base):
     date = Column(Date, nullable=False)
     department_id = Column(String, nullable=False)
     device_id = Column(String, nullable=False)
+    # departments.id / devices.id; no FK, since shadow rebuilds don't
+    # carry foreign keys over
+    department_key = Column(Integer, nullable=False)
+    device_key = Column(Integer, nullable=False)
 
     total_kwh = Column(Float, nullable=False)
     avg_kwh = Column(Float, nullable=False)
     peak_kwh = Column(Float, nullable=False)
+
+    # Mergeable quantile sketch of the day's readings: {bucket: count},
+    # see services.analytics.sketch
+    kwh_sketch = Column(JSONB)
+
+    __table_args__ = (
+        # Upsert target for incremental refresh
+        Index(
+            "uq_daily_energy_summary_keys",
+            "date",
+            "department_key",
+            "device_key",
+            unique=True,
+        ),
+    )
+
+
+class AlignedEnergyReading(Base):
+    """
+    energy_events resampled onto a fixed interval grid per device.
+    quality: observed / interpolated / gap (kwh NULL).
+    """
+    __tablename__ = "energy_events_aligned"
+
+    id = Column(Integer, primary_key=True)
+    interval_minutes = Column(Integer, nullable=False)
+    slot_start = Column(DateTime, nullable=False)
+    department_id = Column(String, nullable=False)
+    device_id = Column(String, nullable=False)
+
+    kwh = Column(Float)
+    quality = Column(String, nullable=False)
+
+    __table_args__ = (
+        Index(
+            "uq_energy_events_aligned_slot",
+            "interval_minutes",
+            "device_id",
+            "slot_start",
+            unique=True,
+        ),
+    )
+
+
+class PipelineWatermark(Base):
+    """
+    Progress marker per analytics stage: the highest input position the
+    stage has fully processed (a created_at timestamp and/or a row id).
+    """
+    __tablename__ = "pipeline_watermarks"
+
+    stage = Column(String, primary_key=True)
+    watermark_ts = Column(DateTime)
+    watermark_id = Column(BigInteger)
+    updated_at = Column(DateTime, nullable=False)
+
+
+class DailySummaryChange(Base):
+    """
+    One row per daily_energy_summary total written by an incremental
+    refresh (old_total_kwh NULL for a new day, new_total_kwh NULL for a
+    day whose readings all moved away). Downstream stages read it
+    past their watermark_id to update in proportion to what changed.
+    """
+    __tablename__ = "daily_summary_changes"
+
+    id = Column(BigInteger, primary_key=True)
+    date = Column(Date, nullable=False)
+    department_id = Column(String, nullable=False)
+    device_id = Column(String, nullable=False)
+    department_key = Column(Integer)
+    device_key = Column(Integer)
+
+    old_total_kwh = Column(Float)
+    new_total_kwh = Column(Float)
+    changed_at = Column(DateTime, nullable=False)
+
+
+class PipelineStageRun(Base):
+    """
+    Last run of each pipeline stage. input_signature identifies the input
+    state the stage last ran against; output_version is bumped on every
+    successful run and feeds the signatures of downstream stages.
+    """
+    __tablename__ = "pipeline_stage_runs"
+
+    stage = Column(String, primary_key=True)
+    input_signature = Column(String)
+    output_version = Column(Integer, nullable=False, default=0)
+    status = Column(String, nullable=False)
+    error = Column(String)
+    duration_seconds = Column(Float)
+    last_run_at = Column(DateTime, nullable=False)
+
+
+class DeviceSegment(Base):
+    """
+    Stretch of a device's daily_energy_summary series with a stable
+    consumption level, between detected change points. The newest
+    segment of each device is open (is_open) and may still extend or
+    split as days arrive.
+    """
+    __tablename__ = "device_segments"
+
+    id = Column(Integer, primary_key=True)
+    department_id = Column(String, nullable=False)
+    device_id = Column(String, nullable=False)
+    start_date = Column(Date, nullable=False)
+    end_date = Column(Date, nullable=False)
+
+    day_count = Column(Integer, nullable=False)
+    mean_kwh = Column(Float, nullable=False)
+    stddev_kwh = Column(Float)
+    # Level change from the previous segment (NULL for the first)
+    shift_kwh = Column(Float)
+    is_open = Column(Boolean, nullable=False, default=False)
+    detected_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index(
+            "uq_device_segments_start",
+            "device_id",
+            "department_id",
+            "start_date",
+            unique=True,
+        ),
+    )
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, Index
 from datetime import datetime
 from db.models import Base
 
@@ -8,6 +8,153 @@ class BaselineMetric(Base):
     id = Column(Integer, primary_key=True)
     department_id = Column(String, nullable=False)
     device_id = Column(String, nullable=False)
+    department_key = Column(Integer, nullable=False)
+    device_key = Column(Integer, nullable=False)
 
     baseline_kwh = Column(Float, nullable=False)
     last_updated = Column(DateTime, default=datetime.utcnow)
+
+    # Running aggregates over daily totals, so the baseline can be
+    # updated from changed days alone
+    stddev_kwh = Column(Float)
+    sum_kwh = Column(Float)
+    sum_sq_kwh = Column(Float)
+    day_count = Column(Integer)
+
+    __table_args__ = (
+        Index(
+            "uq_baseline_metrics_keys",
+            "department_key",
+            "device_key",
+            unique=True,
+        ),
+    )
+
+
+class BaselineWindow(Base):
+    """
+    Trailing-window baseline: the last `window_days` days up to the
+    device's latest summarised day (window_end).
+    """
+    __tablename__ = "baseline_windows"
+
+    id = Column(Integer, primary_key=True)
+    department_id = Column(String, nullable=False)
+    device_id = Column(String, nullable=False)
+    department_key = Column(Integer, nullable=False)
+    device_key = Column(Integer, nullable=False)
+    window_days = Column(Integer, nullable=False)
+    window_end = Column(Date, nullable=False)
+
+    baseline_kwh = Column(Float)
+    stddev_kwh = Column(Float)
+    sum_kwh = Column(Float, nullable=False)
+    sum_sq_kwh = Column(Float, nullable=False)
+    day_count = Column(Integer, nullable=False)
+    last_updated = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index(
+            "uq_baseline_windows_keys",
+            "department_key",
+            "device_key",
+            "window_days",
+            unique=True,
+        ),
+    )
+
+
+class DeviationBaseline(Base):
+    """
+    Baseline each device's energy_deviations rows were last computed
+    against; incremental deviation detection recomputes a device's whole
+    history once its live baseline drifts past a tolerance from this.
+    """
+    __tablename__ = "deviation_baselines"
+
+    department_id = Column(String, primary_key=True)
+    device_id = Column(String, primary_key=True)
+    department_key = Column(Integer, nullable=False)
+    device_key = Column(Integer, nullable=False)
+
+    baseline_kwh = Column(Float, nullable=False)
+    applied_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index(
+            "uq_deviation_baselines_keys",
+            "department_key",
+            "device_key",
+            unique=True,
+        ),
+    )
+
+
+class BaselineProfile(Base):
+    """
+    Per-device hourly baseline by time of week, so an hourly reading is
+    compared with the same hour of the same kind of day. `profile` is
+    "hour_of_week" (slot 0-167, Monday 00:00 = 0) or "day_type"
+    (slot 0-47: hour of day, +24 on weekends).
+    """
+    __tablename__ = "baseline_profiles"
+
+    id = Column(Integer, primary_key=True)
+    department_id = Column(String, nullable=False)
+    device_id = Column(String, nullable=False)
+    profile = Column(String, nullable=False)
+    slot = Column(Integer, nullable=False)
+
+    baseline_kwh = Column(Float, nullable=False)
+    stddev_kwh = Column(Float)
+    sample_count = Column(Integer, nullable=False)
+    last_updated = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index(
+            "uq_baseline_profiles_slot",
+            "device_id",
+            "department_id",
+            "profile",
+            "slot",
+            unique=True,
+        ),
+    )
+
+
+class DeviceRollingStat(Base):
+    """
+    Each device-day scored against the device's own trailing window of
+    daily totals (the `window_days` calendar days before it): mean /
+    stddev, median / MAD and EWMA, with the resulting z-score and robust
+    (MAD) score.
+    """
+    __tablename__ = "device_rolling_stats"
+
+    id = Column(Integer, primary_key=True)
+    date = Column(Date, nullable=False)
+    department_id = Column(String, nullable=False)
+    device_id = Column(String, nullable=False)
+    window_days = Column(Integer, nullable=False)
+
+    actual_kwh = Column(Float, nullable=False)
+    mean_kwh = Column(Float)
+    stddev_kwh = Column(Float)
+    median_kwh = Column(Float)
+    mad_kwh = Column(Float)
+    ewma_kwh = Column(Float)
+    z_score = Column(Float)
+    robust_score = Column(Float)
+
+    __table_args__ = (
+        Index(
+            "uq_device_rolling_stats_day",
+            "device_id",
+            "department_id",
+            "window_days",
+            "date",
+            unique=True,
+        ),
+        # Dashboard reads: one day (or range) across all devices
+        Index("ix_device_rolling_stats_date", "window_days", "date"),
+    )
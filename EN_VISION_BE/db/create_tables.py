@@ -1,9 +1,20 @@
 from db.models import Base
 from db.session import engine
 
-from db.models import EnergyEvent, AuditLog
-from db.analytics_models import DailyEnergySummary
-from db.baseline_models import BaselineMetric
+from db.models import (
+    Department, Device, EnergyEvent, AuditLog, IngestionFile, IngestionReject, IngestionBatchKey
+)
+from db.analytics_models import (
+    DailyEnergySummary, AlignedEnergyReading, PipelineWatermark,
+    DailySummaryChange, PipelineStageRun, DeviceSegment
+)
+from db.baseline_models import (
+    BaselineMetric, BaselineWindow, DeviationBaseline, BaselineProfile,
+    DeviceRollingStat
+)
+from db.rollup_models import (
+    EnergyAggHourly, EnergyAggDaily, EnergyAggWeekly, EnergyAggMonthly
+)
 
 def main():
     print("Creating database tables...")
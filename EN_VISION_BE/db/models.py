@@ -1,5 +1,5 @@
 from sqlalchemy import (
-    Column, Integer, String, Float, DateTime, Boolean, JSON, ForeignKey
+    Column, Integer, String, Float, Date, DateTime, Boolean, JSON, ForeignKey, Index, text
 )
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
@@ -7,6 +7,32 @@ from datetime import datetime
 Base = declarative_base()
 
 
+class Department(Base):
+    """
+    Department dimension: integer surrogate key (department_key on the
+    fact tables) for every department_id ingestion has committed rows
+    for. The API keeps taking and returning the string id.
+    """
+    __tablename__ = "departments"
+
+    id = Column(Integer, primary_key=True)
+    department_id = Column(String, nullable=False, unique=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class Device(Base):
+    """
+    Device dimension: integer surrogate key (device_key on the fact
+    tables) for every device_id ingestion has committed rows for.
+    Strict-device validation reads it as the registry of known devices.
+    """
+    __tablename__ = "devices"
+
+    id = Column(Integer, primary_key=True)
+    device_id = Column(String, nullable=False, unique=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
 class EnergyEvent(Base):
     __tablename__ = "energy_events"
 
@@ -16,9 +42,44 @@ class EnergyEvent(Base):
     department_id = Column(String, nullable=False)
     kwh = Column(Float, nullable=False)
 
+    # Surrogate keys, resolved at ingestion (services.ingestion.dimensions);
+    # analytics groups and joins on these, the string ids stay for readers
+    device_key = Column(Integer, ForeignKey("devices.id"), nullable=False)
+    department_key = Column(Integer, ForeignKey("departments.id"), nullable=False)
+
     source_type = Column(String)  # iot / csv / api
-    ingestion_batch_id = Column(String)
-    created_at = Column(DateTime, default=datetime.utcnow)
+    ingestion_batch_id = Column(String, index=True)
+    # Incremental analytics scan on this, so writers that bypass the ORM
+    # default (COPY, raw INSERTs) must still get it; UTC like utcnow()
+    created_at = Column(
+        DateTime,
+        default=datetime.utcnow,
+        server_default=text("timezone('utc', now())"),
+        nullable=False,
+        index=True,
+    )
+
+    __table_args__ = (
+        # Row identity for dedup ingestion (ON CONFLICT target)
+        Index(
+            "uq_energy_events_timestamp_device",
+            "timestamp",
+            "device_id",
+            unique=True,
+        ),
+        # Per-device time-window reads by string id (rollups, resampling)
+        Index(
+            "ix_energy_events_device_timestamp",
+            "device_id",
+            "timestamp",
+        ),
+        # Per-device time-window reads by key (targeted recompute)
+        Index(
+            "ix_energy_events_device_key_timestamp",
+            "device_key",
+            "timestamp",
+        ),
+    )
 
 
 class AuditLog(Base):
@@ -31,3 +92,34 @@ class AuditLog(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
 
 
+class IngestionFile(Base):
+    __tablename__ = "ingestion_files"
+
+    fingerprint = Column(String, primary_key=True)  # sha256 of upload bytes
+    file_name = Column(String)
+    batch_id = Column(String, nullable=False)
+    rows_ingested = Column(Integer)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class IngestionReject(Base):
+    __tablename__ = "ingestion_rejects"
+
+    id = Column(Integer, primary_key=True)
+    ingestion_batch_id = Column(String, nullable=False, index=True)
+    row_number = Column(Integer)
+    reason = Column(String, nullable=False)
+    raw_record = Column(JSON)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class IngestionBatchKey(Base):
+    __tablename__ = "ingestion_batch_keys"
+
+    id = Column(Integer, primary_key=True)
+    ingestion_batch_id = Column(String, nullable=False, index=True)
+    date = Column(Date, nullable=False)
+    device_id = Column(String, nullable=False)
+    department_id = Column(String, nullable=False)
+    device_key = Column(Integer)
+    department_key = Column(Integer)
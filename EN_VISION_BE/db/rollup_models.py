@@ -0,0 +1,90 @@
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, Index
+from db.models import Base
+
+
+class EnergyAggHourly(Base):
+    """
+    Hourly rollup per meter (meter_id = device_id), built from energy_events.
+    """
+    __tablename__ = "energy_agg_hourly"
+
+    id = Column(Integer, primary_key=True)
+    hour = Column(DateTime, nullable=False)
+    meter_id = Column(String, nullable=False)
+    department_id = Column(String, nullable=False)
+
+    consumption_kwh = Column(Float, nullable=False)
+    cost = Column(Float, nullable=False)
+    emissions_kg = Column(Float, nullable=False)
+    peak_power_kw = Column(Float, nullable=False)
+    reading_count = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index("uq_energy_agg_hourly_meter", "hour", "meter_id", unique=True),
+    )
+
+
+class EnergyAggDaily(Base):
+    """
+    Site-wide daily rollup, built from energy_agg_hourly.
+    """
+    __tablename__ = "energy_agg_daily"
+
+    id = Column(Integer, primary_key=True)
+    date = Column(Date, nullable=False)
+
+    total_kwh = Column(Float, nullable=False)
+    total_cost = Column(Float, nullable=False)
+    total_emissions = Column(Float, nullable=False)
+    avg_power = Column(Float)
+    peak_power = Column(Float)
+    baseline_kwh = Column(Float)
+    hours_covered = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index("uq_energy_agg_daily_date", "date", unique=True),
+    )
+
+
+class EnergyAggWeekly(Base):
+    """
+    Site-wide weekly rollup (ISO weeks, Monday start), built from energy_agg_daily.
+    """
+    __tablename__ = "energy_agg_weekly"
+
+    id = Column(Integer, primary_key=True)
+    week_start = Column(Date, nullable=False)
+
+    total_kwh = Column(Float, nullable=False)
+    total_cost = Column(Float, nullable=False)
+    total_emissions = Column(Float, nullable=False)
+    avg_power = Column(Float)
+    peak_power = Column(Float)
+    baseline_kwh = Column(Float)
+    hours_covered = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index("uq_energy_agg_weekly_week", "week_start", unique=True),
+    )
+
+
+class EnergyAggMonthly(Base):
+    """
+    Site-wide monthly rollup, built from energy_agg_daily.
+    """
+    __tablename__ = "energy_agg_monthly"
+
+    id = Column(Integer, primary_key=True)
+    month_start = Column(Date, nullable=False)
+
+    total_kwh = Column(Float, nullable=False)
+    total_cost = Column(Float, nullable=False)
+    total_emissions = Column(Float, nullable=False)
+    avg_power = Column(Float)
+    peak_power = Column(Float)
+    baseline_kwh = Column(Float)
+    hours_covered = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index("uq_energy_agg_monthly_month", "month_start", unique=True),
+    )
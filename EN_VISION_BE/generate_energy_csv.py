@@ -1,4 +1,5 @@
 import csv
+import math
 import random
 from datetime import datetime, timedelta
 
@@ -16,21 +17,42 @@ DEVICES = {
 
 SOURCE_TYPE = "sensor"  # consistent, realistic source
 
-
-def generate_energy_events():
-    now = datetime.now()
-    start_time = now - timedelta(days=DAYS)
-
-    rows = []
+HEADER = [
+    "timestamp",
+    "device_id",
+    "department_id",
+    "kwh",
+    "source_type"
+]
+
+
+def scaled_devices(n_devices):
+    """
+    Spread `n_devices` synthetic meters across DEPARTMENTS
+    (used to build large benchmark files).
+    """
+    devices = {dept: [] for dept in DEPARTMENTS}
+    for i in range(n_devices):
+        dept = DEPARTMENTS[i % len(DEPARTMENTS)]
+        devices[dept].append(f"DEV_{i + 1:02d}")
+    return devices
+
+
+def generate_rows(start_time, end_time, devices=DEVICES):
+    """
+    Yield raw readings in chronological order, one per device per
+    30-minute interval. Rows are streamed, so file size is unbounded.
+    """
     current = start_time
 
-    while current < now:
+    while current < end_time:
         hour = current.hour
         weekday = current.weekday()
         is_weekend = weekday >= 5
+        stamp = current.strftime("%Y-%m-%d %H:%M:%S")
 
         for dept in DEPARTMENTS:
-            for device in DEVICES[dept]:
+            for device in devices[dept]:
 
                 # Base kWh per 30-min interval
                 base = {
@@ -56,28 +78,56 @@ def generate_energy_events():
                 if random.random() < 0.002:
                     base *= random.uniform(2.0, 3.5)
 
-                rows.append([
-                    current.strftime("%Y-%m-%d %H:%M:%S"),
+                yield [
+                    stamp,
                     device,
                     dept,
                     round(base, 3),
                     SOURCE_TYPE
-                ])
+                ]
 
         current += timedelta(minutes=30)
 
-    # Sort chronologically (important for ingestion + analytics)
-    rows.sort(key=lambda r: r[0])
+
+def write_energy_csv(path, n_rows, n_devices=100, end_time=None, id_prefix=""):
+    """
+    Write a file of exactly `n_rows` readings for `n_devices` meters,
+    ending at `end_time` (defaults to a fixed date so files are
+    reproducible in size and shape). `id_prefix` is put in front of
+    every device and department id, keeping synthetic meters apart
+    from real ones.
+    """
+    devices = scaled_devices(n_devices)
+    intervals = math.ceil(n_rows / n_devices)
+
+    end_time = end_time or datetime(2025, 1, 1)
+    start_time = end_time - timedelta(minutes=30 * intervals)
+
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(HEADER)
+
+        for i, row in enumerate(generate_rows(start_time, end_time, devices)):
+            if i >= n_rows:
+                break
+            if id_prefix:
+                row[1] = id_prefix + row[1]
+                row[2] = id_prefix + row[2]
+            writer.writerow(row)
+
+    return path
+
+
+def generate_energy_events():
+    now = datetime.now()
+    start_time = now - timedelta(days=DAYS)
+
+    # generate_rows yields chronologically (important for ingestion + analytics)
+    rows = list(generate_rows(start_time, now))
 
     with open(OUTPUT_FILE, "w", newline="") as f:
         writer = csv.writer(f)
-        writer.writerow([
-            "timestamp",
-            "device_id",
-            "department_id",
-            "kwh",
-            "source_type"
-        ])
+        writer.writerow(HEADER)
         writer.writerows(rows)
 
     print(f"✅ Generated {len(rows)} raw energy events → {OUTPUT_FILE}")
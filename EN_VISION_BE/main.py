@@ -2,13 +2,20 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from services.dashboard.router import router as dashboard_router
+from services.analytics.router import router as analytics_router
 from services.ingestion.ingest import router as ingestion_router
+from services.ingestion.buffer import reading_buffer
+from services.ingestion.admission import AdmissionMiddleware
 
 app = FastAPI(
     title="En-Vision API",
     version="1.0.0"
 )
 
+# Upload admission control, before the body is read (inside CORS so
+# 413/429 responses still carry CORS headers)
+app.add_middleware(AdmissionMiddleware)
+
 # CORS (important for frontend)
 app.add_middleware(
     CORSMiddleware,
@@ -27,6 +34,12 @@ app.add_middleware(
 # ✅ ONLY TOP LEVEL ROUTERS
 app.include_router(dashboard_router)
 app.include_router(ingestion_router)
+app.include_router(analytics_router, prefix="/analytics", tags=["Analytics"])
+
+@app.on_event("shutdown")
+def flush_stream_buffer():
+    # Don't drop buffered IoT readings on restart
+    reading_buffer.drain()
 
 @app.get("/")
 def root():
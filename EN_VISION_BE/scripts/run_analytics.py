@@ -1,8 +1,13 @@
+import sys
+
 from db.session import SessionLocal
 from services.analytics_service import compute_daily_energy_summary
 
+# python -m scripts.run_analytics [--incremental]
+incremental = "--incremental" in sys.argv[1:]
+
 db = SessionLocal()
-compute_daily_energy_summary(db)
+compute_daily_energy_summary(db, incremental=incremental)
 db.close()
 
 print("Daily energy aggregation completed.")
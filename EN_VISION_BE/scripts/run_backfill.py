@@ -0,0 +1,169 @@
+"""
+Bulk backfill of historical CSVs (plain, .gz or .zst).
+
+    python -m scripts.run_backfill /data/site-a/
+    python -m scripts.run_backfill "/data/site-a/2023-*.csv.gz" --workers 8
+
+Files are COPYed in parallel by a process pool with analytics deferred,
+then the summary/baseline/deviation/anomaly pipeline runs once.
+
+Resumable: every loaded file is fingerprinted into ingestion_files in
+the same transaction as its rows, so after a crash rerunning the same
+command skips everything already committed and picks up the rest.
+
+Workers merging files that overlap in time contend for the same
+(timestamp, device_id) index entries and can deadlock. A file whose
+transaction is aborted that way (deadlock, serialization failure, lock
+timeout) has nothing committed, so it is retried with backoff; files
+still failing for that reason get a last, serial pass after the pool.
+"""
+import argparse
+import glob
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+
+CSV_PATTERNS = ("*.csv", "*.csv.gz", "*.csv.zst")
+
+# deadlock_detected, serialization_failure, lock_not_available
+RETRYABLE_SQLSTATES = {"40P01", "40001", "55P03"}
+MAX_ATTEMPTS = 4
+RETRY_BACKOFF_SECONDS = 0.5
+
+
+def _expand(sources):
+    files = set()
+    for source in sources:
+        if os.path.isdir(source):
+            for pattern in CSV_PATTERNS:
+                files.update(glob.glob(os.path.join(source, "**", pattern), recursive=True))
+        else:
+            files.update(glob.glob(source, recursive=True))
+    return sorted(files)
+
+
+def _is_retryable(error) -> bool:
+    return getattr(getattr(error, "orig", None), "pgcode", None) in RETRYABLE_SQLSTATES
+
+
+def _ingest_one(path, on_conflict, strict_devices, attempts=MAX_ATTEMPTS):
+    """
+    Load one file. Returns (path, result, error, retryable): `retryable`
+    marks a failure that was only a lock conflict with another worker.
+    """
+    from services.ingestion.service import ingest_csv_path
+
+    for attempt in range(1, attempts + 1):
+        try:
+            result = ingest_csv_path(
+                path,
+                on_conflict=on_conflict,
+                strict_devices=strict_devices,
+                trigger_analytics=False,
+            )
+            return path, result, None, False
+        except Exception as e:
+            if not _is_retryable(e):
+                return path, None, str(e), False
+            if attempt == attempts:
+                return path, None, str(e), True
+
+            # Jitter so the workers that deadlocked don't collide again
+            time.sleep(RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1) * random.uniform(1, 2))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Parallel CSV backfill")
+    parser.add_argument("sources", nargs="+", help="directories and/or glob patterns")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--on-conflict", choices=("error", "skip", "update"), default="skip")
+    parser.add_argument("--strict-devices", action="store_true")
+    parser.add_argument("--skip-analytics", action="store_true",
+                        help="load only; run the pipeline later")
+    args = parser.parse_args(argv)
+
+    files = _expand(args.sources)
+    total = len(files)
+    if not total:
+        print("No files matched.")
+        return 1
+
+    print(f"Backfilling {total} files with {args.workers} workers...")
+
+    done = loaded = skipped = failed = 0
+    rows = rejected = 0
+    contended = []
+    started = time.perf_counter()
+
+    def report(path, result, error):
+        nonlocal done, loaded, skipped, failed, rows, rejected
+        done += 1
+
+        if error:
+            failed += 1
+            status = f"FAILED ({error})"
+        elif result["status"] == "skipped":
+            skipped += 1
+            status = "already ingested"
+        else:
+            loaded += 1
+            rows += result["records_ingested"]
+            rejected += result["records_rejected"]
+            status = f"{result['records_ingested']} rows"
+
+        elapsed = time.perf_counter() - started
+        rate = rows / elapsed if elapsed > 0 else 0
+        eta = (elapsed / done) * (total - done)
+        print(
+            f"[{done}/{total}] {os.path.basename(path)}: {status} | "
+            f"{rows} rows, {rate:,.0f} rows/s, ETA {eta:,.0f}s"
+        )
+
+    # spawn: each worker builds its own engine/pool instead of inheriting sockets
+    with ProcessPoolExecutor(max_workers=args.workers, mp_context=get_context("spawn")) as pool:
+        futures = [
+            pool.submit(_ingest_one, path, args.on_conflict, args.strict_devices)
+            for path in files
+        ]
+
+        for future in as_completed(futures):
+            path, result, error, retryable = future.result()
+            if retryable:
+                contended.append(path)
+                print(f"{os.path.basename(path)}: lock conflicts, retrying after the pool")
+                continue
+            report(path, result, error)
+
+    # Nothing else is writing now, so these can't deadlock again
+    for path in sorted(contended):
+        path, result, error, _ = _ingest_one(path, args.on_conflict, args.strict_devices)
+        report(path, result, error)
+
+    print(
+        f"Loaded {loaded} files ({rows} rows, {rejected} rejected), "
+        f"skipped {skipped}, failed {failed} in {time.perf_counter() - started:,.1f}s"
+    )
+
+    if failed:
+        print("Some files failed; fix them and rerun (completed files are skipped).")
+
+    # Also runs when everything was skipped: a crashed earlier run may
+    # have committed its files but never reached this step
+    if args.skip_analytics:
+        return 1 if failed else 0
+
+    from services.analytics.pipeline import run_analytics_pipeline
+
+    print("Running analytics pipeline once for the whole backfill...")
+    timings = run_analytics_pipeline(
+        on_stage_complete=lambda name, seconds: print(f"  {name}: {seconds}s")
+    )
+    print(f"Analytics completed in {sum(timings.values()):.1f}s")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,8 +1,13 @@
+import sys
+
 from db.session import SessionLocal
 from services.baseline_service import compute_baselines
 
+# python -m scripts.run_baselines [--incremental]
+incremental = "--incremental" in sys.argv[1:]
+
 db = SessionLocal()
-compute_baselines(db)
+compute_baselines(db, incremental=incremental)
 db.close()
 
 print("Baseline metrics computed.")
@@ -0,0 +1,16 @@
+from db.session import engine
+from services.ingestion.dimensions import sync_dimensions
+
+# python -m scripts.run_dimension_sync
+# Upgrade step, run once before the first pipeline run after upgrading
+# (safe to rerun): adds device_key / department_key to the fact tables,
+# registers every device/department seen so far, fills the keys and
+# moves the unique indexes onto them. Ingestion fails until it has run.
+# Also needed on a new database after db.create_tables, for the analytics
+# tables created outside the ORM (energy_deviations, energy_anomalies,
+# energy_forecasts).
+with engine.begin() as conn:
+    keyed = sync_dimensions(conn)
+
+for table, rows in keyed.items():
+    print(f"{table}: {rows} rows keyed")
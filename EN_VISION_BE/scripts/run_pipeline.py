@@ -0,0 +1,67 @@
+"""
+Run the analytics DAG, or part of it.
+
+    python -m scripts.run_pipeline                       # every default stage
+    python -m scripts.run_pipeline baseline --downstream  # baseline and what depends on it
+    python -m scripts.run_pipeline carbon --upstream      # carbon and what it needs
+    python -m scripts.run_pipeline forecast_lstm carbon --force
+    python -m scripts.run_pipeline --full                 # rebuild instead of incremental
+    python -m scripts.run_pipeline --fused                # summary/baseline/deviation in one pass
+    python -m scripts.run_pipeline --list
+"""
+import argparse
+import logging
+
+from services.analytics.pipeline import (
+    MAX_PARALLEL_STAGES,
+    PIPELINE,
+    run_pipeline,
+    select_stages,
+)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the analytics pipeline DAG")
+    parser.add_argument("stages", nargs="*", help="stages to run (default: all default stages)")
+    parser.add_argument("--upstream", action="store_true", help="also run the stages' dependencies")
+    parser.add_argument("--downstream", action="store_true", help="also run the stages' dependents")
+    parser.add_argument("--full", action="store_true", help="full rebuild instead of incremental")
+    parser.add_argument("--force", action="store_true", help="run even if inputs are unchanged")
+    parser.add_argument("--fused", action="store_true", help="run covered stages as their fused stage")
+    parser.add_argument("--workers", type=int, default=MAX_PARALLEL_STAGES)
+    parser.add_argument("--list", action="store_true", help="show the DAG and exit")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for stage in PIPELINE:
+            flag = "" if stage.default else "  (on request)"
+            print(f"{stage.name:<26} <- {', '.join(stage.inputs)}{flag}")
+        return 0
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    try:
+        stages = select_stages(args.stages, upstream=args.upstream, downstream=args.downstream)
+    except ValueError as e:
+        parser.error(str(e))
+
+    results = run_pipeline(
+        stages=stages,
+        full=args.full,
+        force=args.force,
+        max_workers=args.workers,
+        fused=args.fused,
+    )
+
+    for name, result in results.items():
+        line = f"{name:<26} {result['status']:<10} {result['seconds']:>8.2f}s"
+        if result.get("error"):
+            line += f"  {result['error']}"
+        print(line)
+
+    failed = any(result["status"] in ("failed", "blocked") for result in results.values())
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,41 @@
+"""
+Rebuild energy_events_aligned on one grid interval.
+
+    python -m scripts.run_resample        # 30-minute grid
+    python -m scripts.run_resample 60
+
+Only grids at or above the meters' reading interval are supported
+(30 and 60 minutes): readings are interval energy and are not split
+across finer slots, so there is no 15-minute grid.
+"""
+import argparse
+
+from services.analytics.resample import SUPPORTED_INTERVALS, run_interval_resample
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Align readings onto a dense per-device grid")
+    parser.add_argument(
+        "interval",
+        nargs="?",
+        type=int,
+        default=30,
+        choices=SUPPORTED_INTERVALS,
+        help="grid interval in minutes (no 15: readings are 30-minute energy)",
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        result = run_interval_resample(args.interval)
+    except ValueError as e:
+        parser.error(str(e))
+
+    print(
+        f"Aligned {result['rows']} slots on a {args.interval}-minute grid "
+        f"({result['interpolated']} interpolated, {result['gaps']} gaps)."
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,8 @@
+import sys
+
+from services.analytics.rollups import run_rollups
+
+# python -m scripts.run_rollups [--incremental]
+result = run_rollups(incremental="--incremental" in sys.argv[1:])
+
+print(result["message"])
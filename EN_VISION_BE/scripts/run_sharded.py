@@ -0,0 +1,42 @@
+"""
+Full analytics rebuild split into hash shards that run in parallel.
+
+    python -m scripts.run_sharded                       # one shard per core
+    python -m scripts.run_sharded --shards 16 --workers 8
+    python -m scripts.run_sharded --by department --no-anomalies
+"""
+import argparse
+import logging
+
+from services.analytics.sharded import DEFAULT_SHARDS, SHARD_KEYS, run_sharded_refresh
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sharded analytics rebuild")
+    parser.add_argument("--shards", type=int, default=DEFAULT_SHARDS)
+    parser.add_argument("--by", choices=SHARD_KEYS, default="device")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--no-anomalies", action="store_true", help="skip Isolation Forest")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+
+    progress = run_sharded_refresh(
+        shards=args.shards,
+        by=args.by,
+        workers=args.workers,
+        anomalies=not args.no_anomalies,
+        on_shard_complete=lambda stage, shard, seconds: print(
+            f"{stage:<14} shard {shard:>3} {seconds:>8.2f}s"
+        ),
+    )
+
+    for stage, shards in progress.items():
+        if shards:
+            print(f"{stage:<14} slowest shard {max(shards.values()):.2f}s")
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
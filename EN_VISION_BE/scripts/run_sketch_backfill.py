@@ -0,0 +1,11 @@
+from services.analytics.daily_summary import backfill_sketches
+
+# python -m scripts.run_sketch_backfill
+# One-off after upgrading: builds kwh_sketch for daily_energy_summary
+# rows written before sketches existed, so /analytics/percentiles covers them.
+# Safe to stop and rerun; filled months are not read again.
+filled = backfill_sketches(
+    on_progress=lambda start, end, rows: print(f"{start} - {end}: {rows} rows")
+)
+
+print(f"Sketches filled for {filled} summary rows.")
@@ -1,32 +1,426 @@
 from sqlalchemy import text
 from db.session import engine
+from services.analytics.watermarks import get_watermark, set_watermark
+from services.analytics.shadow import shadow_rebuild
+from services.ingestion.dimensions import id_joins
 
-def run_baseline_metrics():
+STAGE = "baseline"
+
+# Trailing-window baselines kept alongside the all-time one
+TRAILING_WINDOWS = (28,)
+
+CHANGES_TABLE = "summary_changes"
+
+
+def stddev_sql(sum_kwh, sum_sq_kwh, day_count):
+    # Sample stddev from running sums; GREATEST absorbs float round-off
+    return f"""
+        CASE WHEN {day_count} > 1 THEN
+            SQRT(GREATEST(
+                ({sum_sq_kwh} - {sum_kwh} * {sum_kwh} / {day_count})
+                    / ({day_count} - 1),
+                0
+            ))
+        END
+    """
+
+
+WINDOW_BUILD = f"""
+    INSERT INTO baseline_windows (
+        department_id,
+        device_id,
+        department_key,
+        device_key,
+        window_days,
+        window_end,
+        sum_kwh,
+        sum_sq_kwh,
+        day_count,
+        baseline_kwh,
+        stddev_kwh,
+        last_updated
+    )
+    SELECT
+        dp.department_id,
+        dv.device_id,
+        w.department_key,
+        w.device_key,
+        :days,
+        w.window_end,
+        w.sum_kwh,
+        w.sum_sq_kwh,
+        w.day_count,
+        w.baseline_kwh,
+        w.stddev_kwh,
+        CURRENT_TIMESTAMP
+    FROM (
+        SELECT
+            d.department_key,
+            d.device_key,
+            e.window_end,
+            SUM(d.total_kwh) AS sum_kwh,
+            SUM(d.total_kwh * d.total_kwh) AS sum_sq_kwh,
+            COUNT(*) AS day_count,
+            AVG(d.total_kwh) AS baseline_kwh,
+            STDDEV_SAMP(d.total_kwh) AS stddev_kwh
+        FROM (
+            SELECT department_key, device_key, MAX(date) AS window_end
+            FROM daily_energy_summary
+            {{device_filter}}
+            GROUP BY department_key, device_key
+        ) e
+        JOIN daily_energy_summary d
+          ON d.department_key = e.department_key
+         AND d.device_key = e.device_key
+         AND d.date > e.window_end - :days
+         AND d.date <= e.window_end
+        GROUP BY
+            d.department_key,
+            d.device_key,
+            e.window_end
+    ) w
+    {id_joins("w")}
+"""
+
+
+# All-time baseline per device; `where` narrows the days read
+BASELINE_INSERT = f"""
+    INSERT INTO {{table}} (
+        department_id,
+        device_id,
+        department_key,
+        device_key,
+        baseline_kwh,
+        stddev_kwh,
+        sum_kwh,
+        sum_sq_kwh,
+        day_count,
+        last_updated
+    )
+    SELECT
+        dp.department_id,
+        dv.device_id,
+        b.department_key,
+        b.device_key,
+        b.baseline_kwh,
+        b.stddev_kwh,
+        b.sum_kwh,
+        b.sum_sq_kwh,
+        b.day_count,
+        CURRENT_TIMESTAMP AS last_updated
+    FROM (
+        SELECT
+            department_key,
+            device_key,
+            AVG(total_kwh) AS baseline_kwh,
+            STDDEV_SAMP(total_kwh) AS stddev_kwh,
+            SUM(total_kwh) AS sum_kwh,
+            SUM(total_kwh * total_kwh) AS sum_sq_kwh,
+            COUNT(*) AS day_count
+        FROM daily_energy_summary
+        {{where}}
+        GROUP BY
+            department_key,
+            device_key
+    ) b
+    {id_joins("b")}
+"""
+
+
+def run_baseline_metrics(batch_ids=None, incremental=False, windows=TRAILING_WINDOWS):
     """
     Generate baseline energy usage per device & department.
-    Baseline is defined as average daily kWh.
+    Baseline is defined as average daily kWh; running sum, sum of squares
+    and count are stored with it. With `batch_ids` or `incremental`, the
+    daily totals changed since the last run are folded into those sums
+    (O(changed days)) instead of rescanning daily_energy_summary.
+    `windows` lists trailing-window lengths (days) maintained the same way.
     """
 
-    delete_query = text("DELETE FROM baseline_metrics;")
+    if batch_ids or incremental:
+        return _apply_summary_changes(windows)
+
+    with engine.begin() as conn:
+        rebuild_baselines(conn, windows)
+
+    return {
+        "status": "success",
+        "message": "baseline_metrics rebuilt"
+    }
+
+
+def rebuild_baselines(conn, windows=TRAILING_WINDOWS):
+    """
+    Recompute baseline_metrics and baseline_windows from the whole of
+    daily_energy_summary and move the stage watermark to the end of the
+    change log. baseline_metrics is rebuilt in a shadow table and swapped
+    in, since dashboards read it.
+    """
+
+    high_water = max_change_id(conn)
+
+    with shadow_rebuild(conn, "baseline_metrics") as shadow:
+        conn.execute(text(
+            BASELINE_INSERT.format(table=shadow["baseline_metrics"], where="")
+        ))
+
+    conn.execute(text("DELETE FROM baseline_windows;"))
+    for days in windows:
+        conn.execute(
+            text(WINDOW_BUILD.format(device_filter="")),
+            {"days": days},
+        )
+
+    set_watermark(conn, STAGE, watermark_id=high_water)
+
+
+def max_change_id(conn):
+    return conn.execute(
+        text("SELECT COALESCE(MAX(id), 0) FROM daily_summary_changes")
+    ).scalar()
+
+
+def _apply_summary_changes(windows):
+    with engine.connect() as conn:
+        _, since = get_watermark(conn, STAGE)
+
+    if since is None:
+        # No running sums to update yet
+        return run_baseline_metrics(windows=windows)
 
-    insert_query = text("""
+    with engine.begin() as conn:
+        high_water = max_change_id(conn)
+        if high_water <= since:
+            return {
+                "status": "success",
+                "message": "baseline_metrics already up to date"
+            }
+
+        load_summary_changes(conn, since, high_water)
+
+        devices = _update_running_baselines(conn)
+
+        for days in windows:
+            update_trailing_windows(conn, days)
+
+        set_watermark(conn, STAGE, watermark_id=high_water)
+
+    return {
+        "status": "success",
+        "message": f"baseline_metrics updated for {devices} devices"
+    }
+
+
+def load_summary_changes(conn, since, until):
+    """
+    Per-day deltas for change-log ids in (since, until], in a temp table.
+    Chained changes to the same day telescope: a day's first appearance
+    adds to the count and its removal (new total NULL) takes it away.
+    """
+    conn.execute(text(f"""
+        CREATE TEMP TABLE {CHANGES_TABLE} ON COMMIT DROP AS
+        SELECT
+            date,
+            department_key,
+            device_key,
+            COALESCE(new_total_kwh, 0) - COALESCE(old_total_kwh, 0) AS d_sum,
+            COALESCE(new_total_kwh * new_total_kwh, 0)
+                - COALESCE(old_total_kwh * old_total_kwh, 0) AS d_sq,
+            CASE
+                WHEN old_total_kwh IS NULL THEN 1
+                WHEN new_total_kwh IS NULL THEN -1
+                ELSE 0
+            END AS d_count
+        FROM daily_summary_changes
+        WHERE id > :since
+          AND id <= :until
+    """), {"since": since, "until": until})
+
+
+def _update_running_baselines(conn) -> int:
+    conn.execute(text(f"""
         INSERT INTO baseline_metrics (
             department_id,
             device_id,
+            department_key,
+            device_key,
             baseline_kwh,
+            sum_kwh,
+            sum_sq_kwh,
+            day_count,
             last_updated
         )
         SELECT
-            department_id,
-            device_id,
-            AVG(total_kwh) AS baseline_kwh,
-            CURRENT_TIMESTAMP AS last_updated
-        FROM daily_energy_summary
-        GROUP BY
-            department_id,
-            device_id;
-    """)
+            dp.department_id,
+            dv.device_id,
+            c.department_key,
+            c.device_key,
+            -- Placeholder for NOT NULL; recomputed from the sums below
+            COALESCE(c.d_sum / NULLIF(c.d_count, 0), 0),
+            c.d_sum,
+            c.d_sq,
+            c.d_count,
+            CURRENT_TIMESTAMP
+        FROM (
+            SELECT
+                department_key,
+                device_key,
+                SUM(d_sum) AS d_sum,
+                SUM(d_sq) AS d_sq,
+                SUM(d_count) AS d_count
+            FROM {CHANGES_TABLE}
+            GROUP BY
+                department_key,
+                device_key
+        ) c
+        {id_joins("c")}
+        ON CONFLICT (department_key, device_key) DO UPDATE SET
+            sum_kwh = baseline_metrics.sum_kwh + EXCLUDED.sum_kwh,
+            sum_sq_kwh = baseline_metrics.sum_sq_kwh + EXCLUDED.sum_sq_kwh,
+            day_count = baseline_metrics.day_count + EXCLUDED.day_count,
+            last_updated = EXCLUDED.last_updated
+    """))
 
-    with engine.begin() as conn:
-        conn.execute(delete_query)
-        conn.execute(insert_query)
+    # Devices left with no days (all moved to another department)
+    conn.execute(text(f"""
+        DELETE FROM baseline_metrics b
+        USING (
+            SELECT DISTINCT department_key, device_key
+            FROM {CHANGES_TABLE}
+        ) c
+        WHERE b.department_key = c.department_key
+          AND b.device_key = c.device_key
+          AND b.day_count <= 0
+    """))
+
+    result = conn.execute(text(f"""
+        UPDATE baseline_metrics b
+        SET
+            baseline_kwh = b.sum_kwh / b.day_count,
+            stddev_kwh = {stddev_sql("b.sum_kwh", "b.sum_sq_kwh", "b.day_count")}
+        FROM (
+            SELECT DISTINCT department_key, device_key
+            FROM {CHANGES_TABLE}
+        ) c
+        WHERE b.department_key = c.department_key
+          AND b.device_key = c.device_key
+    """))
+
+    return result.rowcount
+
+
+def update_trailing_windows(conn, days: int):
+    """
+    Slide each affected device's window to its newest changed day:
+    apply deltas for days already inside the old window, subtract the
+    days that fall out and add the days that come in. Cost is the
+    changed days plus the days the window moved by.
+    """
+
+    conn.execute(text(f"""
+        WITH bounds AS (
+            SELECT
+                w.id,
+                w.department_key,
+                w.device_key,
+                w.window_end AS old_end,
+                GREATEST(w.window_end, c.max_date) AS new_end
+            FROM (
+                SELECT department_key, device_key, MAX(date) AS max_date
+                FROM {CHANGES_TABLE}
+                GROUP BY department_key, device_key
+            ) c
+            JOIN baseline_windows w
+              ON w.department_key = c.department_key
+             AND w.device_key = c.device_key
+             AND w.window_days = :days
+        ),
+        changed AS (
+            SELECT
+                b.id,
+                SUM(c.d_sum) AS d_sum,
+                SUM(c.d_sq) AS d_sq,
+                SUM(c.d_count) AS d_count
+            FROM bounds b
+            JOIN {CHANGES_TABLE} c
+              ON c.department_key = b.department_key
+             AND c.device_key = b.device_key
+             AND c.date > b.old_end - :days
+             AND c.date <= b.old_end
+            GROUP BY b.id
+        ),
+        expired AS (
+            SELECT
+                b.id,
+                SUM(d.total_kwh) AS d_sum,
+                SUM(d.total_kwh * d.total_kwh) AS d_sq,
+                COUNT(*) AS d_count
+            FROM bounds b
+            JOIN daily_energy_summary d
+              ON d.department_key = b.department_key
+             AND d.device_key = b.device_key
+             AND d.date > b.old_end - :days
+             AND d.date <= LEAST(b.old_end, b.new_end - :days)
+            GROUP BY b.id
+        ),
+        entered AS (
+            SELECT
+                b.id,
+                SUM(d.total_kwh) AS d_sum,
+                SUM(d.total_kwh * d.total_kwh) AS d_sq,
+                COUNT(*) AS d_count
+            FROM bounds b
+            JOIN daily_energy_summary d
+              ON d.department_key = b.department_key
+             AND d.device_key = b.device_key
+             AND d.date > GREATEST(b.old_end, b.new_end - :days)
+             AND d.date <= b.new_end
+            GROUP BY b.id
+        ),
+        totals AS (
+            SELECT
+                b.id,
+                b.new_end,
+                w.sum_kwh + COALESCE(c.d_sum, 0)
+                    - COALESCE(x.d_sum, 0) + COALESCE(n.d_sum, 0) AS sum_kwh,
+                w.sum_sq_kwh + COALESCE(c.d_sq, 0)
+                    - COALESCE(x.d_sq, 0) + COALESCE(n.d_sq, 0) AS sum_sq_kwh,
+                w.day_count + COALESCE(c.d_count, 0)
+                    - COALESCE(x.d_count, 0) + COALESCE(n.d_count, 0) AS day_count
+            FROM bounds b
+            JOIN baseline_windows w ON w.id = b.id
+            LEFT JOIN changed c ON c.id = b.id
+            LEFT JOIN expired x ON x.id = b.id
+            LEFT JOIN entered n ON n.id = b.id
+        )
+        UPDATE baseline_windows w
+        SET
+            window_end = t.new_end,
+            sum_kwh = t.sum_kwh,
+            sum_sq_kwh = t.sum_sq_kwh,
+            day_count = t.day_count,
+            baseline_kwh = t.sum_kwh / NULLIF(t.day_count, 0),
+            stddev_kwh = {stddev_sql("t.sum_kwh", "t.sum_sq_kwh", "t.day_count")},
+            last_updated = CURRENT_TIMESTAMP
+        FROM totals t
+        WHERE w.id = t.id
+    """), {"days": days})
+
+    # Devices seen for the first time: build their window directly
+    device_filter = f"""
+        WHERE (department_key, device_key) IN (
+            SELECT department_key, device_key FROM {CHANGES_TABLE}
+        )
+        AND NOT EXISTS (
+            SELECT 1
+            FROM baseline_windows w
+            WHERE w.department_key = daily_energy_summary.department_key
+              AND w.device_key = daily_energy_summary.device_key
+              AND w.window_days = :days
+        )
+    """
+
+    conn.execute(
+        text(WINDOW_BUILD.format(device_filter=device_filter)),
+        {"days": days},
+    )
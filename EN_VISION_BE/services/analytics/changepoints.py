@@ -0,0 +1,293 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from db.session import engine
+from services.analytics.watermarks import get_watermark, set_watermark
+from services.analytics.shadow import shadow_rebuild
+
+STAGE = "change_points"
+
+# Shortest level the detector will report, in days
+MIN_SEGMENT_DAYS = 7
+
+# A split must cut the squared error by more than
+# PENALTY * noise variance * log(days) (a BIC-style penalty)
+PENALTY = 3.0
+
+# Below this many devices a process pool costs more than it saves
+PARALLEL_MIN_DEVICES = 200
+
+MAX_WORKERS = os.cpu_count() or 4
+
+TAILS_TABLE = "change_point_tails"
+
+KEYS = ["department_id", "device_id"]
+
+SEGMENT_INSERT = """
+    INSERT INTO {table} (
+        department_id,
+        device_id,
+        start_date,
+        end_date,
+        day_count,
+        mean_kwh,
+        stddev_kwh,
+        shift_kwh,
+        is_open,
+        detected_at
+    )
+    VALUES (
+        :department_id,
+        :device_id,
+        :start_date,
+        :end_date,
+        :day_count,
+        :mean_kwh,
+        :stddev_kwh,
+        :shift_kwh,
+        :is_open,
+        CURRENT_TIMESTAMP
+    )
+"""
+
+
+def run_change_point_detection(batch_ids=None, incremental=False):
+    """
+    Split each device's daily_energy_summary series into segments of
+    stable consumption (binary segmentation on the mean) and store them
+    in device_segments. With `batch_ids` or `incremental`, only the tail
+    of each device whose summary changed is re-segmented: from the start
+    of the segment before the earliest changed day, so the latest change
+    point can still move. Devices are segmented in a process pool when
+    there are many.
+    """
+
+    if batch_ids or incremental:
+        return _refresh_tails()
+
+    with engine.begin() as conn:
+        high_water = _max_change_id(conn)
+        df = pd.read_sql(
+            text("""
+                SELECT department_id, device_id, date, total_kwh
+                FROM daily_energy_summary
+                ORDER BY department_id, device_id, date
+            """),
+            conn,
+        )
+        rows = segment_frame(df)
+
+        with shadow_rebuild(conn, "device_segments") as shadow:
+            if rows:
+                conn.execute(
+                    text(SEGMENT_INSERT.format(table=shadow["device_segments"])),
+                    rows,
+                )
+
+        set_watermark(conn, STAGE, watermark_id=high_water)
+
+    return {
+        "status": "success",
+        "message": f"device_segments rebuilt with {len(rows)} segments"
+    }
+
+
+def _max_change_id(conn):
+    return conn.execute(
+        text("SELECT COALESCE(MAX(id), 0) FROM daily_summary_changes")
+    ).scalar()
+
+
+def _refresh_tails():
+    with engine.connect() as conn:
+        _, since = get_watermark(conn, STAGE)
+
+    if since is None:
+        return run_change_point_detection()
+
+    with engine.begin() as conn:
+        high_water = _max_change_id(conn)
+        if high_water <= since:
+            return {
+                "status": "success",
+                "message": "device_segments already up to date"
+            }
+
+        # tail_start NULL = re-segment the device's whole series
+        conn.execute(text(f"""
+            CREATE TEMP TABLE {TAILS_TABLE} ON COMMIT DROP AS
+            WITH changed AS (
+                SELECT department_id, device_id, MIN(date) AS first_changed
+                FROM daily_summary_changes
+                WHERE id > :since
+                  AND id <= :until
+                GROUP BY department_id, device_id
+            )
+            SELECT
+                c.department_id,
+                c.device_id,
+                (
+                    SELECT s.start_date
+                    FROM device_segments s
+                    WHERE s.department_id = c.department_id
+                      AND s.device_id = c.device_id
+                      AND s.start_date <= c.first_changed
+                    ORDER BY s.start_date DESC
+                    OFFSET 1
+                    LIMIT 1
+                ) AS tail_start
+            FROM changed c
+        """), {"since": since, "until": high_water})
+
+        df = pd.read_sql(
+            text(f"""
+                SELECT d.department_id, d.device_id, d.date, d.total_kwh
+                FROM {TAILS_TABLE} t
+                JOIN daily_energy_summary d
+                  ON d.department_id = t.department_id
+                 AND d.device_id = t.device_id
+                 AND (t.tail_start IS NULL OR d.date >= t.tail_start)
+                ORDER BY d.department_id, d.device_id, d.date
+            """),
+            conn,
+        )
+
+        conn.execute(text(f"""
+            DELETE FROM device_segments s
+            USING {TAILS_TABLE} t
+            WHERE s.department_id = t.department_id
+              AND s.device_id = t.device_id
+              AND (t.tail_start IS NULL OR s.start_date >= t.tail_start)
+        """))
+
+        rows = segment_frame(df)
+
+        # Each tail's first segment continues a kept, closed one; its
+        # shift is against that segment
+        if rows:
+            conn.execute(text(SEGMENT_INSERT.format(table="device_segments")), rows)
+        conn.execute(text(f"""
+            UPDATE device_segments s
+            SET shift_kwh = s.mean_kwh - p.mean_kwh
+            FROM {TAILS_TABLE} t, device_segments p
+            WHERE s.department_id = t.department_id
+              AND s.device_id = t.device_id
+              AND s.start_date = t.tail_start
+              AND p.department_id = s.department_id
+              AND p.device_id = s.device_id
+              AND p.end_date = (
+                  SELECT MAX(end_date)
+                  FROM device_segments q
+                  WHERE q.department_id = s.department_id
+                    AND q.device_id = s.device_id
+                    AND q.end_date < s.start_date
+              )
+        """))
+
+        devices = conn.execute(text(f"SELECT COUNT(*) FROM {TAILS_TABLE}")).scalar()
+        set_watermark(conn, STAGE, watermark_id=high_water)
+
+    return {
+        "status": "success",
+        "message": f"device_segments re-evaluated for {devices} devices"
+    }
+
+
+def segment_frame(df):
+    """
+    Segment rows for every device in `df` (department_id, device_id,
+    date, total_kwh; sorted by device then date).
+    """
+    if df.empty:
+        return []
+
+    series = [
+        (department_id, device_id, group["date"].to_numpy(), group["total_kwh"].to_numpy(dtype=float))
+        for (department_id, device_id), group in df.groupby(KEYS, sort=False)
+    ]
+
+    if len(series) < PARALLEL_MIN_DEVICES:
+        return _segment_chunk(series)
+
+    workers = min(MAX_WORKERS, len(series) // PARALLEL_MIN_DEVICES + 1)
+    chunks = [series[i::workers] for i in range(workers)]
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as pool:
+        return [row for rows in pool.map(_segment_chunk, chunks) for row in rows]
+
+
+def _segment_chunk(series):
+    rows = []
+
+    for department_id, device_id, dates, values in series:
+        bounds = [0] + find_change_points(values) + [len(values)]
+        previous_mean = None
+
+        for start, end in zip(bounds, bounds[1:]):
+            segment = values[start:end]
+            mean = float(segment.mean())
+            rows.append({
+                "department_id": department_id,
+                "device_id": device_id,
+                "start_date": pd.Timestamp(dates[start]).date(),
+                "end_date": pd.Timestamp(dates[end - 1]).date(),
+                "day_count": int(end - start),
+                "mean_kwh": mean,
+                "stddev_kwh": float(segment.std(ddof=1)) if end - start > 1 else None,
+                "shift_kwh": None if previous_mean is None else mean - previous_mean,
+                "is_open": end == len(values),
+            })
+            previous_mean = mean
+
+    return rows
+
+
+def find_change_points(values, min_size=MIN_SEGMENT_DAYS, penalty=PENALTY):
+    """
+    Binary segmentation for shifts in the mean. Each candidate split's
+    squared-error gain comes from prefix sums, so scanning a segment for
+    its best split is one vectorised pass. Returns sorted split indices
+    (the first index of each new segment).
+    """
+    n = len(values)
+    if n < 2 * min_size:
+        return []
+
+    # Noise level from day-to-day differences: robust to the level
+    # shifts being looked for
+    diffs = np.diff(values)
+    sigma = 1.4826 * np.median(np.abs(diffs)) / np.sqrt(2)
+    if sigma == 0:
+        sigma = np.std(diffs) / np.sqrt(2)
+    if sigma == 0:
+        return []
+    threshold = penalty * sigma ** 2 * np.log(n)
+
+    csum = np.concatenate([[0.0], np.cumsum(values)])
+    csq = np.concatenate([[0.0], np.cumsum(values ** 2)])
+
+    def cost(a, b):
+        total = csum[b] - csum[a]
+        return (csq[b] - csq[a]) - total ** 2 / (b - a)
+
+    splits = []
+    pending = [(0, n)]
+    while pending:
+        a, b = pending.pop()
+        if b - a < 2 * min_size:
+            continue
+
+        candidates = np.arange(a + min_size, b - min_size + 1)
+        gains = cost(a, b) - cost(a, candidates) - cost(candidates, b)
+        best = int(np.argmax(gains))
+
+        if gains[best] > threshold:
+            split = int(candidates[best])
+            splits.append(split)
+            pending.extend([(a, split), (split, b)])
+
+    return sorted(splits)
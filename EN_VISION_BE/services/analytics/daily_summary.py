@@ -1,44 +1,418 @@
+from datetime import timedelta
+
 from sqlalchemy import text
 from db.session import engine
+from services.analytics.windows import load_touched_keys, TOUCHED_KEYS_TABLE
+from services.analytics.watermarks import get_watermark, set_watermark
+from services.analytics.shadow import shadow_rebuild
+from services.analytics.sketch import sketch_bucket_sql
+from services.ingestion.dimensions import id_joins
+
+STAGE = "daily_summary"
+
+# created_at is stamped before the ingesting transaction commits, so a
+# slow batch can become visible with a created_at just below the
+# watermark. Rescanning this margin catches it; re-aggregating a window
+# twice is harmless.
+WATERMARK_OVERLAP = timedelta(minutes=15)
+
+# Stages that consume daily_summary_changes past their watermark_id
+CHANGELOG_CONSUMERS = ("baseline", "deviation", "change_points", "rolling_stats")
+
+SUMMARY_COLUMNS = """
+    date,
+    department_id,
+    device_id,
+    department_key,
+    device_key,
+    total_kwh,
+    avg_kwh,
+    peak_kwh,
+    kwh_sketch
+"""
 
 
-def run_daily_energy_summary():
+def day_totals_sql(keys, source):
     """
-    Rebuild daily_energy_summary table from energy_events
+    Per-day rows for SUMMARY_COLUMNS from one scan of the events in
+    `source` ("FROM ... e ..."). `keys` selects date, department_key and
+    device_key. Events are first counted per quantile-sketch bucket, then
+    the buckets are rolled up into each day's totals and sketch; the
+    string ids are joined on once per day, after aggregating.
+    """
+    return f"""
+        SELECT
+            t.date,
+            dp.department_id,
+            dv.device_id,
+            t.department_key,
+            t.device_key,
+            t.total_kwh,
+            t.avg_kwh,
+            t.peak_kwh,
+            t.kwh_sketch
+        FROM (
+            SELECT
+                date,
+                department_key,
+                device_key,
+                SUM(kwh_sum)        AS total_kwh,
+                SUM(kwh_sum) / SUM(readings) AS avg_kwh,
+                MAX(kwh_max)        AS peak_kwh,
+                jsonb_object_agg(bucket, readings) AS kwh_sketch
+            FROM (
+                SELECT
+                    {keys},
+                    {sketch_bucket_sql("e.kwh")} AS bucket,
+                    SUM(e.kwh) AS kwh_sum,
+                    COUNT(*)   AS readings,
+                    MAX(e.kwh) AS kwh_max
+                {source}
+                GROUP BY 1, 2, 3, 4
+            ) buckets
+            GROUP BY
+                date,
+                department_key,
+                device_key
+        ) t
+        {id_joins("t")}
     """
 
-    truncate_query = text("TRUNCATE TABLE daily_energy_summary RESTART IDENTITY;")
 
-    insert_query = text("""
-        INSERT INTO daily_energy_summary (
-            date,
-            department_id,
-            device_id,
-            total_kwh,
-            avg_kwh,
-            peak_kwh
-        )
+# Events of the touched windows; a range predicate on timestamp so the
+# (device_key, timestamp) index is used
+TOUCHED_WINDOW_EVENTS = f"""
+    FROM {TOUCHED_KEYS_TABLE} k
+    JOIN energy_events e
+      ON e.device_key = k.device_key
+     AND e.department_key = k.department_key
+     AND e."timestamp" >= k.date
+     AND e."timestamp" < k.date + 1
+"""
+
+# Touched windows that no longer have any events (their readings moved
+# to another department); the rows are removed rather than left stale
+EMPTIED_WINDOWS = f"""
+    FROM daily_energy_summary d
+    JOIN {TOUCHED_KEYS_TABLE} k
+      ON d.date = k.date
+     AND d.device_key = k.device_key
+     AND d.department_key = k.department_key
+    WHERE NOT EXISTS (
+        SELECT 1
+        FROM energy_events e
+        WHERE e.device_key = k.device_key
+          AND e.department_key = k.department_key
+          AND e."timestamp" >= k.date
+          AND e."timestamp" < k.date + 1
+    )
+"""
+
+# Every CTE sees the pre-statement snapshot, so `previous` holds the
+# totals from before the upsert and each real change is logged; an
+# emptied window is logged with new_total_kwh NULL.
+UPSERT_TOUCHED_WINDOWS = f"""
+    WITH previous AS (
+        SELECT d.date, d.department_key, d.device_key, d.total_kwh
+        FROM daily_energy_summary d
+        JOIN {TOUCHED_KEYS_TABLE} k
+          ON d.date = k.date
+         AND d.device_key = k.device_key
+         AND d.department_key = k.department_key
+    ),
+    upserted AS (
+        INSERT INTO daily_energy_summary ({SUMMARY_COLUMNS})
+        {day_totals_sql(
+            "k.date, k.department_key, k.device_key",
+            TOUCHED_WINDOW_EVENTS,
+        )}
+        ON CONFLICT (date, department_key, device_key) DO UPDATE SET
+            total_kwh = EXCLUDED.total_kwh,
+            avg_kwh = EXCLUDED.avg_kwh,
+            peak_kwh = EXCLUDED.peak_kwh,
+            kwh_sketch = EXCLUDED.kwh_sketch
+        RETURNING date, department_id, device_id, department_key, device_key, total_kwh
+    ),
+    emptied AS (
+        DELETE FROM daily_energy_summary s
+        USING (
+            SELECT d.date, d.department_key, d.device_key
+            {EMPTIED_WINDOWS}
+        ) x
+        WHERE s.date = x.date
+          AND s.device_key = x.device_key
+          AND s.department_key = x.department_key
+        RETURNING s.date, s.department_id, s.device_id,
+                  s.department_key, s.device_key, s.total_kwh
+    )
+    INSERT INTO daily_summary_changes (
+        date,
+        department_id,
+        device_id,
+        department_key,
+        device_key,
+        old_total_kwh,
+        new_total_kwh,
+        changed_at
+    )
+    SELECT
+        u.date,
+        u.department_id,
+        u.device_id,
+        u.department_key,
+        u.device_key,
+        p.total_kwh,
+        u.total_kwh,
+        CURRENT_TIMESTAMP
+    FROM upserted u
+    LEFT JOIN previous p
+      ON p.date = u.date
+     AND p.device_key = u.device_key
+     AND p.department_key = u.department_key
+    WHERE p.total_kwh IS DISTINCT FROM u.total_kwh
+    UNION ALL
+    SELECT
+        x.date,
+        x.department_id,
+        x.device_id,
+        x.department_key,
+        x.device_key,
+        x.total_kwh,
+        NULL,
+        CURRENT_TIMESTAMP
+    FROM emptied x
+"""
+
+
+# Full aggregation; `where` narrows the events read (e.g. to one shard)
+SUMMARY_INSERT = f"""
+    INSERT INTO {{table}} ({SUMMARY_COLUMNS})
+    {day_totals_sql(
+        'DATE(e."timestamp") AS date, e.department_key, e.device_key',
+        "FROM energy_events e {where}",
+    )}
+    ORDER BY
+        date
+"""
+
+
+# Sketches for summary rows written before kwh_sketch existed, from the
+# rows' own events; `:start` / `:end` bound the dates per statement
+SKETCH_BACKFILL = f"""
+    UPDATE daily_energy_summary d
+    SET kwh_sketch = s.kwh_sketch
+    FROM (
         SELECT
-            DATE("timestamp") AS date,
-            department_id,
-            device_id,
-            SUM(kwh)        AS total_kwh,
-            AVG(kwh)        AS avg_kwh,
-            MAX(kwh)        AS peak_kwh
-        FROM energy_events
+            date,
+            department_key,
+            device_key,
+            jsonb_object_agg(bucket, readings) AS kwh_sketch
+        FROM (
+            SELECT
+                m.date,
+                m.department_key,
+                m.device_key,
+                {sketch_bucket_sql("e.kwh")} AS bucket,
+                COUNT(*) AS readings
+            FROM daily_energy_summary m
+            JOIN energy_events e
+              ON e.device_key = m.device_key
+             AND e.department_key = m.department_key
+             AND e."timestamp" >= m.date
+             AND e."timestamp" < m.date + 1
+            WHERE m.kwh_sketch IS NULL
+              AND m.date >= :start
+              AND m.date < :end
+            GROUP BY 1, 2, 3, 4
+        ) buckets
         GROUP BY
-            DATE("timestamp"),
-            department_id,
-            device_id
-        ORDER BY
-            date;
-    """)
+            date,
+            department_key,
+            device_key
+    ) s
+    WHERE d.date = s.date
+      AND d.device_key = s.device_key
+      AND d.department_key = s.department_key
+"""
+
+
+def run_daily_energy_summary(batch_ids=None, incremental=False):
+    """
+    Rebuild daily_energy_summary table from energy_events.
+    With `batch_ids`, only the (date, device, department) windows in
+    ingestion_batch_keys (those batches' and any left unprocessed by
+    earlier runs) are re-aggregated. With `incremental`, the windows
+    are those of events created since the stage's last watermark.
+    Either way, no watermark (never built, or a failed sharded rebuild
+    cleared it) means a full rebuild.
+    """
+
+    if batch_ids:
+        with engine.connect() as conn:
+            watermark, _ = get_watermark(conn, STAGE)
+        if watermark is not None:
+            return _refresh_touched_windows()
+    elif incremental:
+        return _refresh_since_watermark()
 
     with engine.begin() as conn:
-        conn.execute(truncate_query)
-        result = conn.execute(insert_query)
+        high_water = max_created_at(conn)
+        # Built in a shadow table and swapped in, so readers never see it empty
+        with shadow_rebuild(conn, "daily_energy_summary") as shadow:
+            conn.execute(text(
+                SUMMARY_INSERT.format(table=shadow["daily_energy_summary"], where="")
+            ))
+        reset_summary_changelog(conn)
+        set_watermark(conn, STAGE, watermark_ts=high_water)
 
     return {
         "status": "success",
         "message": "daily_energy_summary refreshed successfully"
     }
+
+
+def reset_summary_changelog(conn):
+    """
+    After a full rebuild the change log no longer describes how the table
+    got here: clear it and the consumers' watermarks so each consumer
+    rebuilds once before going incremental again.
+    """
+    conn.execute(text("TRUNCATE TABLE daily_summary_changes RESTART IDENTITY"))
+    conn.execute(
+        text("DELETE FROM pipeline_watermarks WHERE stage = ANY(:stages)"),
+        {"stages": list(CHANGELOG_CONSUMERS)},
+    )
+
+
+def _upsert_touched_windows(conn):
+    conn.execute(text(UPSERT_TOUCHED_WINDOWS))
+    prune_summary_changelog(conn)
+
+
+def prune_summary_changelog(conn):
+    # Drop changes every consumer has already applied
+    conn.execute(
+        text("""
+            DELETE FROM daily_summary_changes
+            WHERE id <= (
+                SELECT MIN(watermark_id)
+                FROM pipeline_watermarks
+                WHERE stage = ANY(:stages)
+            )
+        """),
+        {"stages": list(CHANGELOG_CONSUMERS)},
+    )
+
+
+def has_emptied_windows(conn) -> bool:
+    """
+    Whether any window in the touched-keys table has a summary row but
+    no events left.
+    """
+    return conn.execute(
+        text(f"SELECT EXISTS (SELECT 1 {EMPTIED_WINDOWS})")
+    ).scalar()
+
+
+def backfill_sketches(step_days=31, on_progress=None) -> int:
+    """
+    Fill kwh_sketch on summary rows that predate it, `step_days` of
+    dates per transaction so the job can be stopped and rerun.
+    `on_progress(start, end, rows)` is called after each step.
+    Returns the number of rows filled.
+    """
+    with engine.connect() as conn:
+        first, last = conn.execute(text("""
+            SELECT MIN(date), MAX(date)
+            FROM daily_energy_summary
+            WHERE kwh_sketch IS NULL
+        """)).fetchone()
+
+    if first is None:
+        return 0
+
+    filled = 0
+    start = first
+    while start <= last:
+        end = start + timedelta(days=step_days)
+        with engine.begin() as conn:
+            rows = conn.execute(
+                text(SKETCH_BACKFILL), {"start": start, "end": end}
+            ).rowcount
+        filled += rows
+        if on_progress:
+            on_progress(start, end, rows)
+        start = end
+
+    return filled
+
+
+def max_created_at(conn):
+    return conn.execute(
+        text("SELECT MAX(created_at) FROM energy_events")
+    ).scalar()
+
+
+def _refresh_touched_windows():
+    with engine.begin() as conn:
+        windows = load_touched_keys(conn)
+        _upsert_touched_windows(conn)
+
+    return {
+        "status": "success",
+        "message": f"daily_energy_summary refreshed for {windows} windows"
+    }
+
+
+def _refresh_since_watermark():
+    with engine.connect() as conn:
+        watermark, _ = get_watermark(conn, STAGE)
+
+    if watermark is None:
+        # Never built: nothing to be incremental against
+        return run_daily_energy_summary()
+
+    with engine.begin() as conn:
+        high_water = max_created_at(conn)
+        if high_water is None or high_water <= watermark:
+            return {
+                "status": "success",
+                "message": "daily_energy_summary already up to date"
+            }
+
+        windows = load_new_event_keys(conn, watermark, high_water)
+        _upsert_touched_windows(conn)
+        set_watermark(conn, STAGE, watermark_ts=high_water)
+
+    return {
+        "status": "success",
+        "message": f"daily_energy_summary refreshed for {windows} windows"
+    }
+
+
+def load_new_event_keys(conn, watermark, high_water) -> int:
+    """
+    Materialise the windows of events created in (watermark, high_water]
+    into the touched-keys temp table (dropped at commit).
+    Returns the number of distinct windows.
+    """
+
+    # created_at index makes this a range scan over the new rows only
+    conn.execute(text(f"""
+        CREATE TEMP TABLE {TOUCHED_KEYS_TABLE} ON COMMIT DROP AS
+        SELECT DISTINCT
+            DATE("timestamp") AS date,
+            device_key,
+            department_key,
+            device_id,
+            department_id
+        FROM energy_events
+        WHERE created_at > :since
+          AND created_at <= :until
+    """), {"since": watermark - WATERMARK_OVERLAP, "until": high_water})
+
+    conn.execute(text(f"ANALYZE {TOUCHED_KEYS_TABLE}"))
+
+    return conn.execute(
+        text(f"SELECT COUNT(*) FROM {TOUCHED_KEYS_TABLE}")
+    ).scalar()
@@ -1,51 +1,212 @@
 from sqlalchemy import text
 from db.session import engine
+from services.analytics.watermarks import get_watermark, set_watermark
+from services.analytics.shadow import shadow_rebuild
 
+STAGE = "deviation"
 
-def run_deviation_detection():
+# Relative baseline movement (0.02 = 2%) beyond which a device's whole
+# deviation history is recomputed rather than just its changed days
+BASELINE_TOLERANCE = 0.02
+
+DEVIATION_KEYS_TABLE = "deviation_keys"
+
+
+def deviation_columns(actual, baseline):
+    """
+    deviation_percent and severity select-list entries for the given
+    actual / baseline kWh expressions.
+    """
+    return f"""
+        ROUND(
+            (
+                (({actual} - {baseline}) / {baseline}) * 100
+            )::numeric,
+            2
+        ) AS deviation_percent,
+        CASE
+            WHEN ABS(({actual} - {baseline}) / {baseline}) * 100 > 30
+                THEN 'CRITICAL'
+            WHEN ABS(({actual} - {baseline}) / {baseline}) * 100 > 20
+                THEN 'HIGH'
+            WHEN ABS(({actual} - {baseline}) / {baseline}) * 100 > 10
+                THEN 'MEDIUM'
+            ELSE 'NORMAL'
+        END AS severity
+    """
+
+
+DEVIATION_INSERT = f"""
+    INSERT INTO {{table}} (
+        date,
+        department_id,
+        device_id,
+        department_key,
+        device_key,
+        baseline_kwh,
+        actual_kwh,
+        deviation_percent,
+        severity
+    )
+    SELECT
+        d.date,
+        d.department_id,
+        d.device_id,
+        d.department_key,
+        d.device_key,
+        b.baseline_kwh,
+        d.total_kwh AS actual_kwh,
+        {deviation_columns("d.total_kwh", "b.baseline_kwh")}
+    FROM daily_energy_summary d
+    JOIN baseline_metrics b
+    ON d.device_key = b.device_key
+    AND d.department_key = b.department_key
+"""
+
+# Record the baselines energy_deviations rows are computed against
+REFERENCE_INSERT = """
+    INSERT INTO deviation_baselines (
+        department_id,
+        device_id,
+        department_key,
+        device_key,
+        baseline_kwh,
+        applied_at
+    )
+    SELECT
+        department_id,
+        device_id,
+        department_key,
+        device_key,
+        baseline_kwh,
+        CURRENT_TIMESTAMP
+    FROM baseline_metrics
+    {where}
+"""
+
+
+def run_deviation_detection(batch_ids=None, incremental=False,
+                            tolerance=BASELINE_TOLERANCE):
     """
     Rule-based deviation detection using baseline metrics.
+    With `batch_ids` or `incremental`, only daily rows changed since the
+    last run are rewritten, plus every row of a device whose baseline has
+    moved by more than `tolerance` (relative) since its rows were computed.
     """
 
-    delete_query = text("DELETE FROM energy_deviations;")
-
-    insert_query = text("""
-        INSERT INTO energy_deviations (
-            date,
-            department_id,
-            device_id,
-            baseline_kwh,
-            actual_kwh,
-            deviation_percent,
-            severity
-        )
-        SELECT
-            d.date,
-            d.department_id,
-            d.device_id,
-            b.baseline_kwh,
-            d.total_kwh AS actual_kwh,
-            ROUND(
-                (
-                    ((d.total_kwh - b.baseline_kwh) / b.baseline_kwh) * 100
-                )::numeric,
-                2
-            ) AS deviation_percent,
-            CASE
-                WHEN ABS((d.total_kwh - b.baseline_kwh) / b.baseline_kwh) * 100 > 30
-                    THEN 'CRITICAL'
-                WHEN ABS((d.total_kwh - b.baseline_kwh) / b.baseline_kwh) * 100 > 20
-                    THEN 'HIGH'
-                WHEN ABS((d.total_kwh - b.baseline_kwh) / b.baseline_kwh) * 100 > 10
-                    THEN 'MEDIUM'
-                ELSE 'NORMAL'
-            END AS severity
-        FROM daily_energy_summary d
-        JOIN baseline_metrics b
-        ON d.device_id = b.device_id
-        AND d.department_id = b.department_id;
-                        """)
+    if batch_ids or incremental:
+        return _refresh_changed(tolerance)
+
+    with engine.begin() as conn:
+        high_water = max_change_id(conn)
+
+        with shadow_rebuild(conn, "energy_deviations") as shadow:
+            conn.execute(text(
+                DEVIATION_INSERT.format(table=shadow["energy_deviations"]) + ";"
+            ))
+
+        conn.execute(text("DELETE FROM deviation_baselines;"))
+        conn.execute(text(REFERENCE_INSERT.format(where="")))
+
+        set_watermark(conn, STAGE, watermark_id=high_water)
+
+    return {
+        "status": "success",
+        "message": "energy_deviations rebuilt"
+    }
+
+
+def max_change_id(conn):
+    return conn.execute(
+        text("SELECT COALESCE(MAX(id), 0) FROM daily_summary_changes")
+    ).scalar()
+
+
+def _refresh_changed(tolerance):
+    with engine.connect() as conn:
+        _, since = get_watermark(conn, STAGE)
+
+    if since is None:
+        return run_deviation_detection()
 
     with engine.begin() as conn:
-        conn.execute(delete_query)
-        conn.execute(insert_query)
+        high_water = max_change_id(conn)
+
+        # Devices with no reference yet count as drifted so they get one
+        conn.execute(text("""
+            CREATE TEMP TABLE drifted_devices ON COMMIT DROP AS
+            SELECT
+                b.department_id,
+                b.device_id,
+                b.department_key,
+                b.device_key,
+                b.baseline_kwh
+            FROM baseline_metrics b
+            LEFT JOIN deviation_baselines r
+              ON r.department_key = b.department_key
+             AND r.device_key = b.device_key
+            WHERE r.baseline_kwh IS NULL
+               OR ABS(b.baseline_kwh - r.baseline_kwh)
+                    > :tolerance * ABS(r.baseline_kwh)
+        """), {"tolerance": tolerance})
+
+        conn.execute(text(f"""
+            CREATE TEMP TABLE {DEVIATION_KEYS_TABLE} ON COMMIT DROP AS
+            SELECT date, department_key, device_key
+            FROM daily_summary_changes
+            WHERE id > :since
+              AND id <= :until
+            UNION
+            SELECT d.date, d.department_key, d.device_key
+            FROM daily_energy_summary d
+            JOIN drifted_devices r
+              ON r.department_key = d.department_key
+             AND r.device_key = d.device_key
+        """), {"since": since, "until": high_water})
+
+        conn.execute(text(f"ANALYZE {DEVIATION_KEYS_TABLE}"))
+
+        conn.execute(text(f"""
+            DELETE FROM energy_deviations v
+            USING {DEVIATION_KEYS_TABLE} k
+            WHERE v.date = k.date
+              AND v.device_key = k.device_key
+              AND v.department_key = k.department_key;
+        """))
+
+        insert_query = DEVIATION_INSERT.format(table="energy_deviations") + f"""
+        JOIN {DEVIATION_KEYS_TABLE} k
+          ON d.date = k.date
+         AND d.device_key = k.device_key
+         AND d.department_key = k.department_key;
+        """
+        result = conn.execute(text(insert_query))
+
+        conn.execute(text("""
+            INSERT INTO deviation_baselines (
+                department_id,
+                device_id,
+                department_key,
+                device_key,
+                baseline_kwh,
+                applied_at
+            )
+            SELECT
+                department_id,
+                device_id,
+                department_key,
+                device_key,
+                baseline_kwh,
+                CURRENT_TIMESTAMP
+            FROM drifted_devices
+            ON CONFLICT (department_key, device_key) DO UPDATE SET
+                baseline_kwh = EXCLUDED.baseline_kwh,
+                applied_at = EXCLUDED.applied_at;
+        """))
+
+        set_watermark(conn, STAGE, watermark_id=high_water)
+
+    return {
+        "status": "success",
+        "message": f"energy_deviations rewritten for {result.rowcount} rows"
+    }
@@ -0,0 +1,325 @@
+from sqlalchemy import text
+from db.session import engine
+from services.analytics import baseline, daily_summary, deviation
+from services.analytics.windows import load_touched_keys, TOUCHED_KEYS_TABLE
+from services.analytics.watermarks import get_watermark, set_watermark
+
+STAGE = "summary_baseline_deviation"
+
+# The whole refresh as one statement. Every CTE sees the same
+# pre-statement snapshot, so later steps take the new values from the
+# RETURNING output of earlier ones rather than re-reading tables:
+#   previous  -> totals of touched days before this refresh
+#   summary   -> re-aggregated touched days (upserted)
+#   changed   -> days whose total actually moved (logged for consumers)
+#   deltas    -> per-device changes to the running sums
+#   baselines -> running baselines after applying the deltas (upserted)
+#   drifted   -> devices whose baseline moved past the tolerance
+#   rewrite   -> deviation rows to replace: changed days, plus every day
+#                of drifted devices
+FUSED_REFRESH = f"""
+    WITH previous AS (
+        SELECT d.date, d.department_key, d.device_key, d.total_kwh
+        FROM daily_energy_summary d
+        JOIN {TOUCHED_KEYS_TABLE} k
+          ON d.date = k.date
+         AND d.device_key = k.device_key
+         AND d.department_key = k.department_key
+    ),
+    summary AS (
+        INSERT INTO daily_energy_summary ({daily_summary.SUMMARY_COLUMNS})
+        {daily_summary.day_totals_sql(
+            "k.date, k.department_key, k.device_key",
+            daily_summary.TOUCHED_WINDOW_EVENTS,
+        )}
+        ON CONFLICT (date, department_key, device_key) DO UPDATE SET
+            total_kwh = EXCLUDED.total_kwh,
+            avg_kwh = EXCLUDED.avg_kwh,
+            peak_kwh = EXCLUDED.peak_kwh,
+            kwh_sketch = EXCLUDED.kwh_sketch
+        RETURNING date, department_id, device_id, department_key, device_key, total_kwh
+    ),
+    changed AS (
+        SELECT
+            s.date,
+            s.department_id,
+            s.device_id,
+            s.department_key,
+            s.device_key,
+            p.total_kwh AS old_total_kwh,
+            s.total_kwh AS new_total_kwh
+        FROM summary s
+        LEFT JOIN previous p
+          ON p.date = s.date
+         AND p.device_key = s.device_key
+         AND p.department_key = s.department_key
+        WHERE p.total_kwh IS DISTINCT FROM s.total_kwh
+    ),
+    logged AS (
+        INSERT INTO daily_summary_changes (
+            date,
+            department_id,
+            device_id,
+            department_key,
+            device_key,
+            old_total_kwh,
+            new_total_kwh,
+            changed_at
+        )
+        SELECT
+            date,
+            department_id,
+            device_id,
+            department_key,
+            device_key,
+            old_total_kwh,
+            new_total_kwh,
+            CURRENT_TIMESTAMP
+        FROM changed
+    ),
+    deltas AS (
+        SELECT
+            department_key,
+            device_key,
+            -- One string id per key; carried for the upsert below
+            MIN(department_id) AS department_id,
+            MIN(device_id) AS device_id,
+            SUM(new_total_kwh - COALESCE(old_total_kwh, 0)) AS d_sum,
+            SUM(
+                new_total_kwh * new_total_kwh
+                - COALESCE(old_total_kwh * old_total_kwh, 0)
+            ) AS d_sq,
+            SUM(CASE WHEN old_total_kwh IS NULL THEN 1 ELSE 0 END) AS d_count
+        FROM changed
+        GROUP BY
+            department_key,
+            device_key
+    ),
+    baselines AS (
+        INSERT INTO baseline_metrics (
+            department_id,
+            device_id,
+            department_key,
+            device_key,
+            baseline_kwh,
+            stddev_kwh,
+            sum_kwh,
+            sum_sq_kwh,
+            day_count,
+            last_updated
+        )
+        SELECT
+            department_id,
+            device_id,
+            department_key,
+            device_key,
+            COALESCE(d_sum / NULLIF(d_count, 0), 0),
+            {baseline.stddev_sql("d_sum", "d_sq", "d_count")},
+            d_sum,
+            d_sq,
+            d_count,
+            CURRENT_TIMESTAMP
+        FROM deltas
+        ON CONFLICT (department_key, device_key) DO UPDATE SET
+            sum_kwh = baseline_metrics.sum_kwh + EXCLUDED.sum_kwh,
+            sum_sq_kwh = baseline_metrics.sum_sq_kwh + EXCLUDED.sum_sq_kwh,
+            day_count = baseline_metrics.day_count + EXCLUDED.day_count,
+            baseline_kwh = (baseline_metrics.sum_kwh + EXCLUDED.sum_kwh)
+                / NULLIF(baseline_metrics.day_count + EXCLUDED.day_count, 0),
+            stddev_kwh = {baseline.stddev_sql(
+                "(baseline_metrics.sum_kwh + EXCLUDED.sum_kwh)",
+                "(baseline_metrics.sum_sq_kwh + EXCLUDED.sum_sq_kwh)",
+                "(baseline_metrics.day_count + EXCLUDED.day_count)",
+            )},
+            last_updated = EXCLUDED.last_updated
+        RETURNING department_id, device_id, department_key, device_key, baseline_kwh
+    ),
+    drifted AS (
+        SELECT
+            b.department_id,
+            b.device_id,
+            b.department_key,
+            b.device_key,
+            b.baseline_kwh
+        FROM baselines b
+        LEFT JOIN deviation_baselines r
+          ON r.department_key = b.department_key
+         AND r.device_key = b.device_key
+        WHERE r.baseline_kwh IS NULL
+           OR ABS(b.baseline_kwh - r.baseline_kwh)
+                > :tolerance * ABS(r.baseline_kwh)
+    ),
+    rewrite AS (
+        -- Changed days of devices that stay within tolerance
+        SELECT c.date, c.department_id, c.device_id,
+               c.department_key, c.device_key,
+               c.new_total_kwh AS total_kwh, b.baseline_kwh
+        FROM changed c
+        JOIN baselines b
+          ON b.department_key = c.department_key
+         AND b.device_key = c.device_key
+        WHERE NOT EXISTS (
+            SELECT 1 FROM drifted r
+            WHERE r.department_key = c.department_key
+              AND r.device_key = c.device_key
+        )
+        UNION ALL
+        -- Every pre-existing day of drifted devices, at its new total
+        SELECT d.date, d.department_id, d.device_id,
+               d.department_key, d.device_key,
+               COALESCE(s.total_kwh, d.total_kwh), r.baseline_kwh
+        FROM daily_energy_summary d
+        JOIN drifted r
+          ON r.department_key = d.department_key
+         AND r.device_key = d.device_key
+        LEFT JOIN summary s
+          ON s.date = d.date
+         AND s.device_key = d.device_key
+         AND s.department_key = d.department_key
+        UNION ALL
+        -- Days of drifted devices first seen in this refresh
+        SELECT s.date, s.department_id, s.device_id,
+               s.department_key, s.device_key,
+               s.total_kwh, r.baseline_kwh
+        FROM summary s
+        JOIN drifted r
+          ON r.department_key = s.department_key
+         AND r.device_key = s.device_key
+        WHERE NOT EXISTS (
+            SELECT 1 FROM previous p
+            WHERE p.date = s.date
+              AND p.device_key = s.device_key
+              AND p.department_key = s.department_key
+        )
+    ),
+    reference AS (
+        INSERT INTO deviation_baselines (
+            department_id,
+            device_id,
+            department_key,
+            device_key,
+            baseline_kwh,
+            applied_at
+        )
+        SELECT
+            department_id,
+            device_id,
+            department_key,
+            device_key,
+            baseline_kwh,
+            CURRENT_TIMESTAMP
+        FROM drifted
+        ON CONFLICT (department_key, device_key) DO UPDATE SET
+            baseline_kwh = EXCLUDED.baseline_kwh,
+            applied_at = EXCLUDED.applied_at
+    ),
+    cleared AS (
+        DELETE FROM energy_deviations v
+        USING rewrite w
+        WHERE v.date = w.date
+          AND v.device_key = w.device_key
+          AND v.department_key = w.department_key
+    )
+    INSERT INTO energy_deviations (
+        date,
+        department_id,
+        device_id,
+        department_key,
+        device_key,
+        baseline_kwh,
+        actual_kwh,
+        deviation_percent,
+        severity
+    )
+    SELECT
+        w.date,
+        w.department_id,
+        w.device_id,
+        w.department_key,
+        w.device_key,
+        w.baseline_kwh,
+        w.total_kwh AS actual_kwh,
+        {deviation.deviation_columns("w.total_kwh", "w.baseline_kwh")}
+    FROM rewrite w
+"""
+
+def run_fused_refresh(batch_ids=None, incremental=False,
+                      tolerance=deviation.BASELINE_TOLERANCE):
+    """
+    Refresh daily_energy_summary, baseline_metrics and energy_deviations
+    in one set-based statement and one transaction, instead of three
+    stages that each rescan the previous one's output.
+
+    Works on the windows in ingestion_batch_keys (those of `batch_ids`
+    plus any earlier runs left behind), or (with `incremental`)
+    by events created since the summary watermark. Falls back to the
+    separate stages when there is nothing to be incremental against: a
+    full rebuild, a first run, or change-log entries the baseline or
+    deviation stage hasn't consumed yet. Also when a touched window has
+    lost all its readings (moved to another department by an update
+    merge), since only the stages remove rows.
+    """
+
+    with engine.connect() as conn:
+        summary_watermark, _ = get_watermark(conn, daily_summary.STAGE)
+        _, baseline_watermark = get_watermark(conn, baseline.STAGE)
+        _, deviation_watermark = get_watermark(conn, deviation.STAGE)
+        change_id = baseline.max_change_id(conn)
+
+    caught_up = baseline_watermark == change_id == deviation_watermark
+    if not (batch_ids or incremental) or not caught_up or summary_watermark is None:
+        return _run_stages(batch_ids, incremental, tolerance)
+
+    with engine.begin() as conn:
+        if batch_ids:
+            windows = load_touched_keys(conn)
+            high_water = None
+        else:
+            high_water = daily_summary.max_created_at(conn)
+            if high_water is None or high_water <= summary_watermark:
+                return {
+                    "status": "success",
+                    "message": "daily summary, baselines and deviations already up to date"
+                }
+            windows = daily_summary.load_new_event_keys(
+                conn, summary_watermark, high_water
+            )
+
+        # Windows whose readings all moved department need their rows
+        # removed, which the stages handle and this statement doesn't
+        emptied = daily_summary.has_emptied_windows(conn)
+        if not emptied:
+            rows = conn.execute(text(FUSED_REFRESH), {"tolerance": tolerance}).rowcount
+
+            # Trailing windows follow from this refresh's change-log entries
+            new_change_id = baseline.max_change_id(conn)
+            baseline.load_summary_changes(conn, change_id, new_change_id)
+            for days in baseline.TRAILING_WINDOWS:
+                baseline.update_trailing_windows(conn, days)
+
+            if high_water is not None:
+                set_watermark(conn, daily_summary.STAGE, watermark_ts=high_water)
+            set_watermark(conn, baseline.STAGE, watermark_id=new_change_id)
+            set_watermark(conn, deviation.STAGE, watermark_id=new_change_id)
+            daily_summary.prune_summary_changelog(conn)
+
+    if emptied:
+        return _run_stages(batch_ids, incremental, tolerance)
+
+    return {
+        "status": "success",
+        "message": f"{windows} windows refreshed, {rows} deviation rows rewritten"
+    }
+
+
+def _run_stages(batch_ids, incremental, tolerance):
+    daily_summary.run_daily_energy_summary(batch_ids=batch_ids, incremental=incremental)
+    baseline.run_baseline_metrics(batch_ids=batch_ids, incremental=incremental)
+    deviation.run_deviation_detection(
+        batch_ids=batch_ids, incremental=incremental, tolerance=tolerance
+    )
+
+    return {
+        "status": "success",
+        "message": "daily summary, baselines and deviations refreshed stage by stage"
+    }
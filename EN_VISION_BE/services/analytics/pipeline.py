@@ -0,0 +1,441 @@
+import time
+import logging
+from contextlib import contextmanager
+from importlib import import_module
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from sqlalchemy import text
+from db.session import engine
+from services.analytics.windows import pending_batches, prune_batch_keys
+from utils.settings import FORECAST_RETRAIN_MINUTES
+
+logger = logging.getLogger(__name__)
+
+# Pseudo-input for stages that read raw readings
+RAW_EVENTS = "energy_events"
+
+MAX_PARALLEL_STAGES = 3
+
+# pg_advisory_lock key serialising analytics runs across processes: the
+# API's job queue, backfills, the pipeline CLI and sharded rebuilds
+PIPELINE_LOCK_KEY = 7_310_422
+
+
+class PipelineError(RuntimeError):
+    pass
+
+
+class Stage:
+    """
+    One node of the analytics DAG.
+
+    `target` is "module:function", imported on first run so heavy or
+    optional dependencies (xgboost, tensorflow) only load when needed.
+    `inputs` are upstream stage names and/or RAW_EVENTS. `mode` says how
+    the stage does partial work: "incremental" stages take
+    (batch_ids, incremental), "batches" stages take batch_ids only, and
+    None means the stage always recomputes. Stages with default=False
+    only run when asked for by name. A stage that `covers` others does
+    their work in one go and stands in for them in fused runs.
+    A failure of a non-`core` stage is recorded but does not fail the
+    pipeline. A stage with `min_interval` (seconds) is throttled in
+    incremental runs: it reruns no sooner than that after its last
+    success. Full and forced runs always run it.
+    """
+
+    def __init__(self, name, target, inputs, mode=None, default=True, covers=(),
+                 core=True, min_interval=None):
+        self.name = name
+        self.target = target
+        self.inputs = tuple(inputs)
+        self.mode = mode
+        self.default = default
+        self.covers = tuple(covers)
+        self.core = core
+        self.min_interval = min_interval
+
+    @property
+    def upstream(self):
+        return [name for name in self.inputs if name != RAW_EVENTS]
+
+    def call(self, batch_ids=None, full=False):
+        module, function = self.target.split(":")
+        fn = getattr(import_module(module), function)
+
+        if full or self.mode is None:
+            return fn()
+        if self.mode == "incremental":
+            return fn(batch_ids=batch_ids, incremental=True)
+        return fn(batch_ids=batch_ids)
+
+
+# Topological order
+PIPELINE = [
+    Stage("daily_summary", "services.analytics.daily_summary:run_daily_energy_summary",
+          [RAW_EVENTS], mode="incremental"),
+    Stage("baseline", "services.analytics.baseline:run_baseline_metrics",
+          ["daily_summary"], mode="incremental"),
+    Stage("deviation", "services.analytics.deviation:run_deviation_detection",
+          ["daily_summary", "baseline"], mode="incremental"),
+    Stage("summary_baseline_deviation", "services.analytics.fused:run_fused_refresh",
+          [RAW_EVENTS], mode="incremental", default=False,
+          covers=["daily_summary", "baseline", "deviation"]),
+    Stage("anomaly", "services.anomaly.isolation_forest:run_isolation_forest",
+          ["daily_summary"], mode="batches"),
+    Stage("change_points", "services.analytics.changepoints:run_change_point_detection",
+          ["daily_summary"], mode="incremental"),
+    Stage("rolling_stats", "services.analytics.rolling:run_rolling_stats",
+          ["daily_summary"], mode="incremental"),
+    Stage("rollups", "services.analytics.rollups:run_rollups",
+          [RAW_EVENTS, "baseline"], mode="incremental"),
+    Stage("baseline_profile", "services.analytics.profiles:run_baseline_profiles",
+          ["rollups"]),
+    Stage("forecast_xgboost", "services.forecasting.xgboost_model:run_xgboost_forecast",
+          ["daily_summary"], core=False, min_interval=FORECAST_RETRAIN_MINUTES * 60),
+    Stage("forecast_lstm", "services.forecasting.lstm_model:run_lstm_forecast",
+          ["daily_summary"], default=False, core=False),
+    Stage("carbon", "services.carbon.forecast:run_carbon_emission_forecast",
+          ["forecast_xgboost", "forecast_lstm"], core=False),
+]
+
+STAGES_BY_NAME = {stage.name: stage for stage in PIPELINE}
+
+FUSED_STAGES = [stage for stage in PIPELINE if stage.covers]
+
+
+def select_stages(names=None, upstream=False, downstream=False):
+    """
+    Stage names to run, in DAG order. No names means every default stage;
+    `upstream` / `downstream` extend the named stages with their default
+    dependencies / dependents.
+    """
+
+    if not names:
+        return [stage.name for stage in PIPELINE if stage.default]
+
+    unknown = [name for name in names if name not in STAGES_BY_NAME]
+    if unknown:
+        raise ValueError(f"Unknown pipeline stages: {', '.join(unknown)}")
+
+    selected = set(names)
+
+    if upstream:
+        for stage in reversed(PIPELINE):
+            if stage.name in selected:
+                selected.update(
+                    name for name in stage.upstream
+                    if STAGES_BY_NAME[name].default
+                )
+
+    if downstream:
+        for stage in PIPELINE:
+            if stage.default and selected.intersection(stage.upstream):
+                selected.add(stage.name)
+
+    return [stage.name for stage in PIPELINE if stage.name in selected]
+
+
+def fuse_stages(names):
+    """
+    Swap runs of stages that a fused stage covers for the fused stage.
+    Returns (names, aliases), aliases mapping each covered stage to the
+    stage now doing its work.
+    """
+
+    names = list(names)
+    aliases = {}
+
+    for fused in FUSED_STAGES:
+        if not any(name in fused.covers for name in names):
+            continue
+        position = min(names.index(name) for name in fused.covers if name in names)
+        names = [name for name in names if name not in fused.covers]
+        names.insert(position, fused.name)
+        aliases.update((name, fused.name) for name in fused.covers)
+
+    return names, aliases
+
+
+@contextmanager
+def pipeline_lock():
+    """
+    Hold the pipeline-wide advisory lock for the block, waiting for any
+    run in another process or thread to finish first. The lock lives on
+    a connection of its own (committed, so not idle in a transaction)
+    and Postgres releases it if the process dies.
+    """
+    with engine.connect() as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": PIPELINE_LOCK_KEY})
+        conn.commit()
+        try:
+            yield
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": PIPELINE_LOCK_KEY})
+            conn.commit()
+
+
+def invalidate_stages(conn, names):
+    """
+    Make stages rerun on the next pipeline run even if their inputs look
+    unchanged, e.g. after their tables were rebuilt outside the pipeline.
+    Their next success bumps output_version, so dependents rerun too.
+    """
+    conn.execute(
+        text("UPDATE pipeline_stage_runs SET status = 'stale' WHERE stage = ANY(:stages)"),
+        {"stages": list(names)},
+    )
+
+
+def _raw_signature(conn):
+    # Every ingest path records batch keys, including in-place updates
+    # that leave created_at alone. The id sequence rather than MAX(id),
+    # since processed keys are pruned.
+    row = conn.execute(text("""
+        SELECT
+            (SELECT MAX(created_at) FROM energy_events) AS created_at,
+            pg_sequence_last_value(
+                pg_get_serial_sequence('ingestion_batch_keys', 'id')::regclass
+            ) AS batch_key_id
+    """)).fetchone()
+    return f"{row.created_at}/{row.batch_key_id}"
+
+
+def _input_signature(conn, stage):
+    versions = dict(conn.execute(
+        text("""
+            SELECT stage, output_version
+            FROM pipeline_stage_runs
+            WHERE stage = ANY(:stages)
+        """),
+        {"stages": stage.upstream},
+    ).fetchall())
+
+    parts = []
+    for name in stage.inputs:
+        version = _raw_signature(conn) if name == RAW_EVENTS else versions.get(name, 0)
+        parts.append(f"{name}={version}")
+
+    return ";".join(parts)
+
+
+def _record_run(stage, status, seconds, signature=None, error=None):
+    # Success moves the signature and bumps the version dependents key on;
+    # failure leaves both so the next run retries
+    on_conflict = (
+        """
+            input_signature = EXCLUDED.input_signature,
+            output_version = pipeline_stage_runs.output_version + 1,
+        """
+        if status == "succeeded"
+        else ""
+    )
+
+    with engine.begin() as conn:
+        conn.execute(
+            text(f"""
+                INSERT INTO pipeline_stage_runs (
+                    stage,
+                    input_signature,
+                    output_version,
+                    status,
+                    error,
+                    duration_seconds,
+                    last_run_at
+                )
+                VALUES (
+                    :stage,
+                    :signature,
+                    :version,
+                    :status,
+                    :error,
+                    :seconds,
+                    CURRENT_TIMESTAMP
+                )
+                ON CONFLICT (stage) DO UPDATE SET
+                    {on_conflict}
+                    status = EXCLUDED.status,
+                    error = EXCLUDED.error,
+                    duration_seconds = EXCLUDED.duration_seconds,
+                    last_run_at = EXCLUDED.last_run_at
+            """),
+            {
+                "stage": stage.name,
+                "signature": signature,
+                "version": 1 if status == "succeeded" else 0,
+                "status": status,
+                "error": error,
+                "seconds": seconds,
+            },
+        )
+
+
+def _run_stage(stage, batch_ids, full, force):
+    with engine.connect() as conn:
+        signature = _input_signature(conn, stage)
+        previous = conn.execute(
+            text("""
+                SELECT
+                    status,
+                    input_signature,
+                    EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - last_run_at) AS age_seconds
+                FROM pipeline_stage_runs
+                WHERE stage = :stage
+            """),
+            {"stage": stage.name},
+        ).fetchone()
+
+    if (
+        not force
+        and previous is not None
+        and previous.status == "succeeded"
+        and previous.input_signature == signature
+    ):
+        logger.info(f"Analytics stage {stage.name} skipped, inputs unchanged")
+        return {"status": "skipped", "seconds": 0.0}
+
+    if (
+        not force
+        and not full
+        and stage.min_interval
+        and previous is not None
+        and previous.status == "succeeded"
+        and previous.age_seconds < stage.min_interval
+    ):
+        logger.info(f"Analytics stage {stage.name} throttled, last ran {previous.age_seconds:.0f}s ago")
+        return {"status": "throttled", "seconds": 0.0}
+
+    started = time.perf_counter()
+    try:
+        stage.call(batch_ids=batch_ids, full=full)
+    except Exception as e:
+        seconds = round(time.perf_counter() - started, 3)
+        logger.exception(f"Analytics stage {stage.name} failed")
+        _record_run(stage, "failed", seconds, error=str(e))
+        return {"status": "failed", "seconds": seconds, "error": str(e)}
+
+    seconds = round(time.perf_counter() - started, 3)
+    _record_run(stage, "succeeded", seconds, signature=signature)
+
+    # Dependents key on the covered stages' versions, so bump those too.
+    # No signature: a later unfused run of them checks in with its own.
+    for name in stage.covers:
+        _record_run(STAGES_BY_NAME[name], "succeeded", seconds)
+
+    logger.info(f"Analytics stage {stage.name} finished in {seconds}s")
+
+    return {"status": "succeeded", "seconds": seconds}
+
+
+def run_pipeline(stages=None, batch_ids=None, full=False, force=False,
+                 on_stage_complete=None, max_workers=MAX_PARALLEL_STAGES,
+                 fused=False):
+    """
+    Run `stages` (default: every default stage) as a DAG. A stage starts
+    once its selected upstream stages are done, so independent branches
+    (e.g. anomaly and forecasting next to baseline) run concurrently.
+
+    A stage is skipped when its input signature - the raw-event
+    high-water mark and/or its upstream stages' output versions - matches
+    its last successful run, unless `force`. A failed stage blocks its
+    dependents but not the rest of the DAG. With `fused`, stages covered
+    by a fused stage (see fuse_stages) run as that one stage. The whole
+    run holds pipeline_lock.
+
+    Returns {stage: {"status": succeeded|skipped|throttled|failed|blocked,
+    "seconds": float, ...}}; `on_stage_complete(name, seconds)` is called
+    for each stage that actually ran.
+    """
+
+    selected = select_stages(stages)
+    aliases = {}
+    if fused:
+        selected, aliases = fuse_stages(selected)
+    pending = [STAGES_BY_NAME[name] for name in selected]
+
+    results = {}
+    running = {}
+
+    with pipeline_lock(), ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while pending or running:
+            for stage in list(pending):
+                deps = {aliases.get(name, name) for name in stage.upstream}
+                deps = [name for name in deps if name in selected]
+
+                if any(results.get(name, {}).get("status") in ("failed", "blocked")
+                       for name in deps):
+                    results[stage.name] = {"status": "blocked", "seconds": 0.0}
+                    pending.remove(stage)
+                elif all(name in results for name in deps):
+                    future = pool.submit(_run_stage, stage, batch_ids, full, force)
+                    running[future] = stage.name
+                    pending.remove(stage)
+
+            if not running:
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                results[name] = future.result()
+
+                if on_stage_complete and results[name]["status"] == "succeeded":
+                    on_stage_complete(name, results[name]["seconds"])
+
+    return {name: results[name] for name in selected}
+
+
+def run_analytics_pipeline(batch_ids=None, on_stage_complete=None, stages=None,
+                           force=False, fused=None, on_stage_failed=None):
+    """
+    Post-ingest entry point. With `batch_ids`, incremental stages only
+    process what those batches (and anything since their watermarks)
+    changed, and summary/baseline/deviation run as one fused pass unless
+    `fused` is False; without, stages fully rebuild.
+    Returns {stage_name: seconds} for the stages that ran and raises
+    PipelineError if a core stage failed or was blocked. Failures of
+    other stages (forecasting, carbon) are only reported, through
+    `on_stage_failed(name, error)` and pipeline_stage_runs.
+
+    Once every core stage has succeeded (or been skipped), the
+    ingestion_batch_keys of every batch recorded before the run started
+    are deleted: incremental stages load all unpruned windows, and a
+    full run rebuilds everything, so both have covered them. Runs of a
+    subset of `stages` leave the keys for the next whole run.
+    """
+
+    with engine.connect() as conn:
+        processed = pending_batches(conn)
+
+    results = run_pipeline(
+        stages=stages,
+        batch_ids=batch_ids,
+        full=not batch_ids,
+        force=force,
+        on_stage_complete=on_stage_complete,
+        fused=bool(batch_ids) if fused is None else fused,
+    )
+
+    failed = {}
+    for name, result in results.items():
+        if result["status"] not in ("failed", "blocked"):
+            continue
+        error = result.get("error", "blocked by a failed upstream stage")
+        if STAGES_BY_NAME[name].core:
+            failed[name] = error
+        elif on_stage_failed:
+            on_stage_failed(name, error)
+
+    if failed:
+        raise PipelineError(
+            "; ".join(f"{name}: {error}" for name, error in failed.items())
+        )
+
+    if processed and stages is None:
+        with engine.begin() as conn:
+            prune_batch_keys(conn, processed)
+
+    return {
+        name: result["seconds"]
+        for name, result in results.items()
+        if result["status"] == "succeeded"
+    }
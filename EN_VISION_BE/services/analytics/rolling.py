@@ -0,0 +1,241 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from db.session import engine
+from services.analytics.watermarks import get_watermark, set_watermark
+from services.analytics.shadow import shadow_rebuild
+from services.ingestion.copy_loader import copy_frame
+
+STAGE = "rolling_stats"
+
+# Trailing window lengths, in calendar days
+ROLLING_WINDOWS = (7, 28)
+
+# Fewer prior days than this and a day is not scored
+MIN_HISTORY_DAYS = 3
+
+# Scales MAD to a stddev estimate for normally distributed loads
+MAD_SCALE = 1.4826
+
+KEYS = ["department_id", "device_id"]
+
+CHANGED_TABLE = "rolling_changed_devices"
+
+STATS_COLUMNS = [
+    "date",
+    "department_id",
+    "device_id",
+    "window_days",
+    "actual_kwh",
+    "mean_kwh",
+    "stddev_kwh",
+    "median_kwh",
+    "mad_kwh",
+    "ewma_kwh",
+    "z_score",
+    "robust_score",
+]
+
+
+def run_rolling_stats(batch_ids=None, incremental=False, windows=ROLLING_WINDOWS):
+    """
+    Score every device-day in daily_energy_summary against the device's
+    own trailing window: mean / stddev, median / MAD and EWMA of the
+    `window` calendar days before it, plus z-score and robust score.
+    All devices are computed together in one grouped pass per window.
+    A full run swaps the table in whole; with `batch_ids` or
+    `incremental`, only devices with entries in daily_summary_changes
+    since the stage's watermark are recomputed. Rows are written with
+    COPY, so deviation queries stay plain indexed reads.
+    """
+
+    if batch_ids or incremental:
+        return _refresh_changed_devices(windows)
+
+    with engine.begin() as conn:
+        high_water = _max_change_id(conn)
+        df = pd.read_sql(
+            text("""
+                SELECT
+                    date,
+                    department_id,
+                    device_id,
+                    total_kwh
+                FROM daily_energy_summary
+                ORDER BY
+                    department_id,
+                    device_id,
+                    date
+            """),
+            conn,
+        )
+        stats = score_frame(df, windows)
+
+        with shadow_rebuild(conn, "device_rolling_stats") as shadow:
+            copy_frame(conn, stats, shadow["device_rolling_stats"], STATS_COLUMNS)
+
+        set_watermark(conn, STAGE, watermark_id=high_water)
+
+    return {
+        "status": "success",
+        "message": f"device_rolling_stats rebuilt with {len(stats)} rows"
+    }
+
+
+def _max_change_id(conn):
+    return conn.execute(
+        text("SELECT COALESCE(MAX(id), 0) FROM daily_summary_changes")
+    ).scalar()
+
+
+def _refresh_changed_devices(windows):
+    with engine.connect() as conn:
+        _, since = get_watermark(conn, STAGE)
+
+    if since is None:
+        return run_rolling_stats(windows=windows)
+
+    with engine.begin() as conn:
+        high_water = _max_change_id(conn)
+        if high_water <= since:
+            return {
+                "status": "success",
+                "message": "device_rolling_stats already up to date"
+            }
+
+        conn.execute(text(f"""
+            CREATE TEMP TABLE {CHANGED_TABLE} ON COMMIT DROP AS
+            SELECT DISTINCT department_id, device_id
+            FROM daily_summary_changes
+            WHERE id > :since
+              AND id <= :until
+        """), {"since": since, "until": high_water})
+
+        # Whole series per device: the EWMA carries all earlier days
+        df = pd.read_sql(
+            text(f"""
+                SELECT d.date, d.department_id, d.device_id, d.total_kwh
+                FROM {CHANGED_TABLE} c
+                JOIN daily_energy_summary d
+                  ON d.department_id = c.department_id
+                 AND d.device_id = c.device_id
+                ORDER BY d.department_id, d.device_id, d.date
+            """),
+            conn,
+        )
+        stats = score_frame(df, windows)
+
+        conn.execute(text(f"""
+            DELETE FROM device_rolling_stats s
+            USING {CHANGED_TABLE} c
+            WHERE s.department_id = c.department_id
+              AND s.device_id = c.device_id
+        """))
+        copy_frame(conn, stats, "device_rolling_stats", STATS_COLUMNS)
+
+        devices = conn.execute(text(f"SELECT COUNT(*) FROM {CHANGED_TABLE}")).scalar()
+        set_watermark(conn, STAGE, watermark_id=high_water)
+
+    return {
+        "status": "success",
+        "message": f"device_rolling_stats recomputed for {devices} devices"
+    }
+
+
+def score_frame(df, windows=ROLLING_WINDOWS):
+    """
+    STATS_COLUMNS rows for summary rows sorted by device and date. Each
+    device's series is laid out on consecutive calendar days first, so a
+    window of N days means N days on the calendar even when some have no
+    summary row; only real days are scored.
+    """
+
+    if df.empty:
+        return pd.DataFrame(columns=STATS_COLUMNS)
+
+    days = _calendar_days(df)
+    present = days["total_kwh"].notna().to_numpy()
+
+    stats = pd.concat(
+        [_window_stats(days, window)[present] for window in windows],
+        ignore_index=True,
+    )
+    stats["date"] = stats["date"].dt.date
+
+    return stats.rename(columns={"total_kwh": "actual_kwh"})[STATS_COLUMNS]
+
+
+def _calendar_days(df):
+    # One row per device per day from its first to its last summary day,
+    # total_kwh NaN where there is no summary row; order is kept
+    df = df.assign(date=pd.to_datetime(df["date"]))
+    spans = df.groupby(KEYS, sort=False)["date"].agg(["min", "max"]).reset_index()
+
+    lengths = ((spans["max"] - spans["min"]).dt.days + 1).to_numpy()
+    starts = np.cumsum(lengths) - lengths
+    offsets = np.arange(lengths.sum()) - np.repeat(starts, lengths)
+
+    grid = spans.loc[spans.index.repeat(lengths), KEYS].reset_index(drop=True)
+    grid["date"] = (
+        np.repeat(spans["min"].to_numpy(), lengths)
+        + pd.to_timedelta(offsets, unit="D").to_numpy()
+    )
+
+    return grid.merge(df, on=KEYS + ["date"], how="left")
+
+
+def _window_stats(df, days):
+    """
+    Trailing statistics for one window length. Rows are sorted by device
+    and date, so the previous `days` values of each device are group-wise
+    shifts; stacking them gives a (rows x days) matrix that numpy reduces
+    in one go, median and MAD included.
+    """
+
+    grouped = df.groupby(KEYS, sort=False)["total_kwh"]
+    history = np.column_stack(
+        [grouped.shift(lag).to_numpy(dtype=float) for lag in range(1, days + 1)]
+    )
+
+    counts = np.sum(~np.isnan(history), axis=1)
+    enough = counts >= MIN_HISTORY_DAYS
+    history[~enough] = np.nan
+
+    # All-NaN rows (too little history) come out NaN, with a warning
+    with warnings.catch_warnings(), np.errstate(invalid="ignore", divide="ignore"):
+        warnings.simplefilter("ignore", RuntimeWarning)
+        mean = np.nanmean(history, axis=1)
+        stddev = np.nanstd(history, axis=1, ddof=1)
+        median = np.nanmedian(history, axis=1)
+        mad = np.nanmedian(np.abs(history - median[:, None]), axis=1)
+
+        actual = df["total_kwh"].to_numpy(dtype=float)
+        z_score = np.where(stddev > 0, (actual - mean) / stddev, np.nan)
+        robust_score = np.where(
+            mad > 0, (actual - median) / (MAD_SCALE * mad), np.nan
+        )
+
+    # EWMA of the days before each day, restarting per device
+    ewma = (
+        grouped.shift(1)
+        .groupby([df[key] for key in KEYS], sort=False)
+        .ewm(span=days, min_periods=MIN_HISTORY_DAYS)
+        .mean()
+        .reset_index(level=list(range(len(KEYS))), drop=True)
+        .reindex(df.index)
+    )
+
+    out = df[["date", "department_id", "device_id", "total_kwh"]].copy()
+    out["window_days"] = days
+    out["mean_kwh"] = mean
+    out["stddev_kwh"] = stddev
+    out["median_kwh"] = median
+    out["mad_kwh"] = mad
+    out["ewma_kwh"] = ewma.to_numpy()
+    out["z_score"] = z_score
+    out["robust_score"] = robust_score
+
+    return out
+
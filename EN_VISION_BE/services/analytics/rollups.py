@@ -0,0 +1,366 @@
+from sqlalchemy import text
+from db.session import engine
+from services.analytics.daily_summary import WATERMARK_OVERLAP, TOUCHED_WINDOW_EVENTS
+from services.analytics.windows import load_touched_keys, TOUCHED_KEYS_TABLE
+from services.analytics.watermarks import get_watermark, set_watermark
+from services.analytics.shadow import shadow_rebuild
+from services.carbon.forecast import EMISSION_FACTOR
+from utils.settings import TARIFF_PER_KWH, READING_INTERVAL_MINUTES
+
+STAGE = "rollups"
+
+# Touched keys per tier, each derived from the tier below
+HOURS_TABLE = "rollup_hours"
+DAYS_TABLE = "rollup_days"
+WEEKS_TABLE = "rollup_weeks"
+MONTHS_TABLE = "rollup_months"
+
+ROLLUP_TABLES = (
+    "energy_agg_hourly",
+    "energy_agg_daily",
+    "energy_agg_weekly",
+    "energy_agg_monthly",
+)
+
+
+# Touched rows whose source rows are gone (all of an hour's events
+# deleted, say) are removed before each tier's upsert, which only
+# writes keys that still have something to aggregate
+HOURLY_DELETE_EMPTIED = """
+    DELETE FROM {hourly} a
+    USING {hours} k
+    WHERE a.hour = k.hour
+      AND a.meter_id = k.meter_id
+      AND NOT EXISTS (
+          SELECT 1
+          FROM energy_events e
+          WHERE e.device_id = k.meter_id
+            AND e."timestamp" >= k.hour
+            AND e."timestamp" < k.hour + INTERVAL '1 hour'
+      )
+"""
+
+DAILY_DELETE_EMPTIED = """
+    DELETE FROM {daily} d
+    USING {days} k
+    WHERE d.date = k.date
+      AND NOT EXISTS (
+          SELECT 1
+          FROM {hourly} a
+          WHERE a.hour >= k.date
+            AND a.hour < k.date + 1
+      )
+"""
+
+PERIOD_DELETE_EMPTIED = """
+    DELETE FROM {table} t
+    USING {periods} p
+    WHERE t.{key} = p.{key}
+      AND NOT EXISTS (
+          SELECT 1
+          FROM {daily} d
+          WHERE d.date >= p.{key}
+            AND d.date < (p.{key} + INTERVAL '{length}')::date
+      )
+"""
+
+HOURLY_UPSERT = """
+    INSERT INTO {hourly} (
+        hour,
+        meter_id,
+        department_id,
+        consumption_kwh,
+        cost,
+        emissions_kg,
+        peak_power_kw,
+        reading_count
+    )
+    SELECT
+        k.hour,
+        k.meter_id,
+        MAX(e.department_id),
+        SUM(e.kwh),
+        SUM(e.kwh) * :tariff,
+        SUM(e.kwh) * :emission_factor,
+        -- Meters report energy per interval; peak power is the largest
+        -- interval reading expressed per hour
+        MAX(e.kwh) * 60.0 / :interval_minutes,
+        COUNT(*)
+    FROM {hours} k
+    JOIN energy_events e
+      ON e.device_id = k.meter_id
+     AND e."timestamp" >= k.hour
+     AND e."timestamp" < k.hour + INTERVAL '1 hour'
+    GROUP BY
+        k.hour,
+        k.meter_id
+    ON CONFLICT (hour, meter_id) DO UPDATE SET
+        department_id = EXCLUDED.department_id,
+        consumption_kwh = EXCLUDED.consumption_kwh,
+        cost = EXCLUDED.cost,
+        emissions_kg = EXCLUDED.emissions_kg,
+        peak_power_kw = EXCLUDED.peak_power_kw,
+        reading_count = EXCLUDED.reading_count
+"""
+
+# Site power is taken hour by hour: avg_power is the mean and peak_power
+# the largest hourly site load (kWh in an hour = average kW). Baseline is
+# the sum of the per-device baselines of meters reporting that day.
+DAILY_UPSERT = """
+    WITH site_hours AS (
+        SELECT
+            a.hour,
+            SUM(a.consumption_kwh) AS kwh,
+            SUM(a.cost) AS cost,
+            SUM(a.emissions_kg) AS emissions
+        FROM {days} d
+        JOIN {hourly} a
+          ON a.hour >= d.date
+         AND a.hour < d.date + 1
+        GROUP BY a.hour
+    ),
+    meters AS (
+        SELECT DISTINCT
+            a.hour::date AS date,
+            a.meter_id,
+            a.department_id
+        FROM {days} d
+        JOIN {hourly} a
+          ON a.hour >= d.date
+         AND a.hour < d.date + 1
+    ),
+    baselines AS (
+        SELECT
+            m.date,
+            SUM(b.baseline_kwh) AS baseline_kwh
+        FROM meters m
+        JOIN baseline_metrics b
+          ON b.device_id = m.meter_id
+         AND b.department_id = m.department_id
+        GROUP BY m.date
+    )
+    INSERT INTO {daily} (
+        date,
+        total_kwh,
+        total_cost,
+        total_emissions,
+        avg_power,
+        peak_power,
+        baseline_kwh,
+        hours_covered
+    )
+    SELECT
+        s.hour::date,
+        SUM(s.kwh),
+        SUM(s.cost),
+        SUM(s.emissions),
+        SUM(s.kwh) / COUNT(*),
+        MAX(s.kwh),
+        MAX(bl.baseline_kwh),
+        COUNT(*)
+    FROM site_hours s
+    LEFT JOIN baselines bl
+      ON bl.date = s.hour::date
+    GROUP BY s.hour::date
+    ON CONFLICT (date) DO UPDATE SET
+        total_kwh = EXCLUDED.total_kwh,
+        total_cost = EXCLUDED.total_cost,
+        total_emissions = EXCLUDED.total_emissions,
+        avg_power = EXCLUDED.avg_power,
+        peak_power = EXCLUDED.peak_power,
+        baseline_kwh = EXCLUDED.baseline_kwh,
+        hours_covered = EXCLUDED.hours_covered
+"""
+
+# Weekly and monthly rows are plain sums of daily rows; avg_power is
+# re-weighted by hours covered so partial days don't skew it
+PERIOD_UPSERT = """
+    INSERT INTO {table} (
+        {key},
+        total_kwh,
+        total_cost,
+        total_emissions,
+        avg_power,
+        peak_power,
+        baseline_kwh,
+        hours_covered
+    )
+    SELECT
+        p.{key},
+        SUM(d.total_kwh),
+        SUM(d.total_cost),
+        SUM(d.total_emissions),
+        SUM(d.total_kwh) / NULLIF(SUM(d.hours_covered), 0),
+        MAX(d.peak_power),
+        SUM(d.baseline_kwh),
+        SUM(d.hours_covered)
+    FROM {periods} p
+    JOIN {daily} d
+      ON d.date >= p.{key}
+     AND d.date < (p.{key} + INTERVAL '{length}')::date
+    GROUP BY p.{key}
+    ON CONFLICT ({key}) DO UPDATE SET
+        total_kwh = EXCLUDED.total_kwh,
+        total_cost = EXCLUDED.total_cost,
+        total_emissions = EXCLUDED.total_emissions,
+        avg_power = EXCLUDED.avg_power,
+        peak_power = EXCLUDED.peak_power,
+        baseline_kwh = EXCLUDED.baseline_kwh,
+        hours_covered = EXCLUDED.hours_covered
+"""
+
+
+# (hour, meter) keys of the events in `source`
+HOUR_KEYS = """
+    SELECT DISTINCT
+        date_trunc('hour', e."timestamp") AS hour,
+        e.device_id AS meter_id
+    {source}
+"""
+
+# Stored hourly rows of the touched windows, so hours whose events are
+# all gone are revisited too (HOUR_KEYS only finds hours with events)
+STORED_TOUCHED_HOURS = f"""
+    SELECT DISTINCT
+        a.hour,
+        a.meter_id
+    FROM {TOUCHED_KEYS_TABLE} k
+    JOIN energy_agg_hourly a
+      ON a.meter_id = k.device_id
+     AND a.hour >= k.date
+     AND a.hour < k.date + 1
+"""
+
+NEW_EVENTS = """
+    FROM energy_events e
+    WHERE e.created_at > :since
+      AND e.created_at <= :until
+"""
+
+
+def run_rollups(batch_ids=None, incremental=False):
+    """
+    Build the dashboard rollups: energy_agg_hourly from energy_events,
+    then daily from hourly, and weekly and monthly from daily.
+    Only the hourly tier reads raw events. With `batch_ids` or
+    `incremental`, only the hours holding events created since the last
+    run - plus, with `batch_ids`, every hour of the windows still
+    recorded in ingestion_batch_keys - are rebuilt, and each tier
+    above rebuilds just the periods whose lower-tier rows changed. Full
+    rebuilds fill shadow tables and swap all four tiers in together.
+    """
+
+    if batch_ids or incremental:
+        with engine.connect() as conn:
+            watermark, _ = get_watermark(conn, STAGE)
+        if watermark is None:
+            return run_rollups()
+    else:
+        watermark = None
+
+    with engine.begin() as conn:
+        high_water = conn.execute(
+            text("SELECT MAX(created_at) FROM energy_events")
+        ).scalar()
+
+        if watermark is None:
+            _load_touched_periods(conn, HOUR_KEYS.format(source="FROM energy_events e"), {})
+            # Indexes up front: the tier upserts need their ON CONFLICT keys
+            with shadow_rebuild(conn, *ROLLUP_TABLES, with_indexes=True) as shadow:
+                hours, days = _cascade(conn, shadow)
+        elif not batch_ids and (high_water is None or high_water <= watermark):
+            return {
+                "status": "success",
+                "message": "rollups already up to date"
+            }
+        else:
+            # The batches' own windows catch whatever the created_at scan
+            # can't see; the scan catches batches run without analytics
+            keys = HOUR_KEYS.format(source=NEW_EVENTS)
+            if batch_ids:
+                load_touched_keys(conn)
+                keys += " UNION " + HOUR_KEYS.format(source=TOUCHED_WINDOW_EVENTS)
+                keys += " UNION " + STORED_TOUCHED_HOURS
+
+            _load_touched_periods(
+                conn,
+                keys,
+                {"since": watermark - WATERMARK_OVERLAP, "until": high_water or watermark},
+            )
+            hours, days = _cascade(conn, {table: table for table in ROLLUP_TABLES})
+
+        if high_water is not None and (watermark is None or high_water > watermark):
+            set_watermark(conn, STAGE, watermark_ts=high_water)
+
+    return {
+        "status": "success",
+        "message": f"rollups refreshed for {hours} meter-hours over {days} days"
+    }
+
+
+def _load_touched_periods(conn, hour_keys, params):
+    conn.execute(text(f"""
+        CREATE TEMP TABLE {HOURS_TABLE} ON COMMIT DROP AS
+        {hour_keys}
+    """), params)
+
+    conn.execute(text(f"""
+        CREATE TEMP TABLE {DAYS_TABLE} ON COMMIT DROP AS
+        SELECT DISTINCT hour::date AS date FROM {HOURS_TABLE}
+    """))
+    conn.execute(text(f"""
+        CREATE TEMP TABLE {WEEKS_TABLE} ON COMMIT DROP AS
+        SELECT DISTINCT date_trunc('week', date)::date AS week_start
+        FROM {DAYS_TABLE}
+    """))
+    conn.execute(text(f"""
+        CREATE TEMP TABLE {MONTHS_TABLE} ON COMMIT DROP AS
+        SELECT DISTINCT date_trunc('month', date)::date AS month_start
+        FROM {DAYS_TABLE}
+    """))
+    conn.execute(text(f"ANALYZE {HOURS_TABLE}"))
+
+
+def _cascade(conn, tables):
+    """
+    Upsert each tier from the one below, first deleting touched rows
+    left with nothing below them; `tables` maps each rollup table to the
+    table actually written (itself, or its shadow).
+    """
+
+    names = {
+        "hours": HOURS_TABLE,
+        "days": DAYS_TABLE,
+        "hourly": tables["energy_agg_hourly"],
+        "daily": tables["energy_agg_daily"],
+    }
+
+    conn.execute(text(HOURLY_DELETE_EMPTIED.format(**names)))
+    hours = conn.execute(
+        text(HOURLY_UPSERT.format(**names)),
+        {
+            "tariff": TARIFF_PER_KWH,
+            "emission_factor": EMISSION_FACTOR,
+            "interval_minutes": READING_INTERVAL_MINUTES,
+        },
+    ).rowcount
+
+    conn.execute(text(DAILY_DELETE_EMPTIED.format(**names)))
+    days = conn.execute(text(DAILY_UPSERT.format(**names))).rowcount
+
+    periods = (
+        ("energy_agg_weekly", "week_start", WEEKS_TABLE, "7 days"),
+        ("energy_agg_monthly", "month_start", MONTHS_TABLE, "1 month"),
+    )
+    for table, key, period_table, length in periods:
+        params = {
+            "table": tables[table],
+            "key": key,
+            "periods": period_table,
+            "daily": names["daily"],
+            "length": length,
+        }
+        conn.execute(text(PERIOD_DELETE_EMPTIED.format(**params)))
+        conn.execute(text(PERIOD_UPSERT.format(**params)))
+
+    return hours, days
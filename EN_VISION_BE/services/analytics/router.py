@@ -1,9 +1,125 @@
-from fastapi import APIRouter
+from datetime import date
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from db.session import get_db
 from services.analytics.deviation import run_deviation_detection
+from services.analytics.rolling import ROLLING_WINDOWS
+from services.analytics.sketch import (
+    RELATIVE_ACCURACY,
+    merge_sketches,
+    missing_sketch_days,
+    quantiles,
+)
 
 router = APIRouter()
 
+SCORE_COLUMNS = {"z": "z_score", "robust": "robust_score"}
+
 @router.post("/deviations")
 def generate_deviations():
     run_deviation_detection()
     return {"status": "deviation detection completed"}
+
+
+@router.get("/deviation-scores")
+def get_deviation_scores(
+    start_date: date,
+    end_date: Optional[date] = None,
+    window_days: int = Query(default=ROLLING_WINDOWS[-1]),
+    method: str = Query(default="robust"),
+    threshold: float = Query(default=3.0),
+    db: Session = Depends(get_db),
+):
+    """
+    Device-days whose z-score or robust (MAD) score against the device's
+    own trailing window exceeds `threshold`, from device_rolling_stats.
+    """
+
+    if method not in SCORE_COLUMNS:
+        raise HTTPException(status_code=400, detail="method must be 'z' or 'robust'")
+    score = SCORE_COLUMNS[method]
+
+    rows = db.execute(
+        text(f"""
+            SELECT
+                date,
+                department_id,
+                device_id,
+                actual_kwh,
+                mean_kwh,
+                median_kwh,
+                ewma_kwh,
+                {score} AS score
+            FROM device_rolling_stats
+            WHERE window_days = :window_days
+              AND date BETWEEN :start AND :end
+              AND ABS({score}) > :threshold
+            ORDER BY ABS({score}) DESC
+        """),
+        {
+            "window_days": window_days,
+            "start": start_date,
+            "end": end_date or start_date,
+            "threshold": threshold,
+        },
+    ).fetchall()
+
+    return [
+        {
+            "date": str(row.date),
+            "department_id": row.department_id,
+            "device_id": row.device_id,
+            "actual": row.actual_kwh,
+            "mean": row.mean_kwh,
+            "median": row.median_kwh,
+            "ewma": row.ewma_kwh,
+            "score": row.score,
+        }
+        for row in rows
+    ]
+
+
+@router.get("/percentiles")
+def get_percentiles(
+    start_date: date,
+    end_date: date,
+    device_id: Optional[List[str]] = Query(default=None),
+    department_id: Optional[str] = None,
+    q: List[float] = Query(default=[0.5, 0.95, 0.99]),
+    db: Session = Depends(get_db),
+):
+    """
+    Percentiles of interval kWh readings over a date range, for the given
+    devices / department (default: all). Answered by merging the daily
+    quantile sketches, never raw events; values are within
+    RELATIVE_ACCURACY of the exact percentile. Summary rows written
+    before sketches existed have none (until scripts.run_sketch_backfill
+    has run); `days_without_sketch` counts the days in the range whose
+    readings are, in whole or in part, left out for that reason.
+    """
+
+    if any(not 0 <= value <= 1 for value in q):
+        raise HTTPException(status_code=400, detail="q values must be between 0 and 1")
+
+    where = ["d.date BETWEEN :start AND :end"]
+    params = {"start": start_date, "end": end_date}
+    if device_id:
+        where.append("d.device_id = ANY(:device_ids)")
+        params["device_ids"] = device_id
+    if department_id:
+        where.append("d.department_id = :department_id")
+        params["department_id"] = department_id
+
+    clause = "WHERE " + " AND ".join(where)
+    buckets = merge_sketches(db, clause, params)
+    values = quantiles(buckets, q)
+
+    return {
+        "readings": sum(buckets.values()),
+        "days_without_sketch": missing_sketch_days(db, clause, params),
+        "relative_accuracy": RELATIVE_ACCURACY,
+        "percentiles": {str(key): value for key, value in values.items()},
+    }
@@ -0,0 +1,204 @@
+import time
+import logging
+from contextlib import contextmanager
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+logger = logging.getLogger(__name__)
+
+SHADOW_SUFFIX = "__shadow"
+OLD_SUFFIX = "__old"
+
+# The swap needs a brief ACCESS EXCLUSIVE lock. Waiting on it would queue
+# every new dashboard read behind us, so give up quickly and retry.
+SWAP_LOCK_TIMEOUT = "2s"
+SWAP_ATTEMPTS = 10
+SWAP_RETRY_SECONDS = 1.0
+
+
+@contextmanager
+def shadow_rebuild(conn, *tables, with_indexes=False):
+    """
+    Rebuild `tables` without blocking readers.
+
+        with engine.begin() as conn:
+            with shadow_rebuild(conn, "daily_energy_summary") as shadow:
+                conn.execute(text(f"INSERT INTO {shadow['daily_energy_summary']} ..."))
+
+    Yields {table: shadow_table}. Each shadow is an empty copy of its
+    table (columns, defaults, checks). Indexes are built after the fill,
+    so it is a plain bulk load, unless `with_indexes` is set (needed when
+    the fill itself uses ON CONFLICT). On exit all shadows are renamed
+    over their tables together. Nothing is visible to other
+    sessions until `conn`'s transaction commits, so readers see either
+    the old tables or the complete new ones, never an empty table.
+
+    Tables with dependent views or incoming foreign keys can't be swapped.
+    """
+
+    shadows = {table: _create_shadow(conn, table) for table in tables}
+
+    if with_indexes:
+        for table, shadow in shadows.items():
+            _build_indexes(conn, table, shadow)
+
+    yield shadows
+
+    for table, shadow in shadows.items():
+        if not with_indexes:
+            _build_indexes(conn, table, shadow)
+        conn.execute(text(f"ANALYZE {shadow}"))
+
+    _lock_for_swap(conn, tables)
+
+    for table, shadow in shadows.items():
+        _swap(conn, table, shadow)
+
+
+def _create_shadow(conn, table):
+    shadow = f"{table}{SHADOW_SUFFIX}"
+
+    conn.execute(text(f"DROP TABLE IF EXISTS {shadow}"))
+    conn.execute(text(f"""
+        CREATE TABLE {shadow} (
+            LIKE {table}
+            INCLUDING DEFAULTS
+            INCLUDING CONSTRAINTS
+            INCLUDING IDENTITY
+        )
+    """))
+
+    return shadow
+
+
+def _temp_name(name):
+    # Original names are still taken until the old table is dropped
+    return f"{name[:48]}{SHADOW_SUFFIX}"
+
+
+def _build_indexes(conn, table, shadow):
+    # Primary key / unique constraints, re-added as constraints
+    constraints = conn.execute(
+        text("""
+            SELECT conname, pg_get_constraintdef(oid) AS definition
+            FROM pg_constraint
+            WHERE conrelid = CAST(:table AS regclass)
+              AND contype IN ('p', 'u')
+        """),
+        {"table": table},
+    ).fetchall()
+
+    for row in constraints:
+        conn.execute(text(
+            f"ALTER TABLE {shadow} ADD CONSTRAINT "
+            f"{_temp_name(row.conname)} {row.definition}"
+        ))
+
+    # Plain indexes; the text after USING is method, columns and predicate
+    indexes = conn.execute(
+        text("""
+            SELECT
+                c.relname AS name,
+                x.indisunique AS is_unique,
+                pg_get_indexdef(x.indexrelid) AS definition
+            FROM pg_index x
+            JOIN pg_class c ON c.oid = x.indexrelid
+            WHERE x.indrelid = CAST(:table AS regclass)
+              AND NOT EXISTS (
+                  SELECT 1 FROM pg_constraint con
+                  WHERE con.conindid = x.indexrelid
+                    AND con.conrelid = x.indrelid
+                    AND con.contype IN ('p', 'u')
+              )
+        """),
+        {"table": table},
+    ).fetchall()
+
+    for row in indexes:
+        _, using = row.definition.split(" USING ", 1)
+        unique = "UNIQUE " if row.is_unique else ""
+        conn.execute(text(
+            f"CREATE {unique}INDEX {_temp_name(row.name)} "
+            f"ON {shadow} USING {using}"
+        ))
+
+
+def _lock_for_swap(conn, tables):
+    for attempt in range(1, SWAP_ATTEMPTS + 1):
+        savepoint = conn.begin_nested()
+        try:
+            conn.execute(text(f"SET LOCAL lock_timeout = '{SWAP_LOCK_TIMEOUT}'"))
+            for table in tables:
+                conn.execute(text(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE"))
+        except OperationalError:
+            savepoint.rollback()
+            if attempt == SWAP_ATTEMPTS:
+                raise
+            logger.info(
+                f"Swap lock on {', '.join(tables)} busy, "
+                f"retrying ({attempt}/{SWAP_ATTEMPTS})"
+            )
+            time.sleep(SWAP_RETRY_SECONDS)
+        else:
+            # Locks are held to the end of the transaction, not the savepoint
+            savepoint.commit()
+            conn.execute(text("SET LOCAL lock_timeout TO DEFAULT"))
+            return
+
+
+def _swap(conn, table, shadow):
+    old = f"{table}{OLD_SUFFIX}"
+
+    index_names = conn.execute(
+        text("""
+            SELECT c.relname AS name, con.conname AS constraint_name
+            FROM pg_index x
+            JOIN pg_class c ON c.oid = x.indexrelid
+            LEFT JOIN pg_constraint con
+              ON con.conindid = x.indexrelid
+             AND con.conrelid = x.indrelid
+             AND con.contype IN ('p', 'u')
+            WHERE x.indrelid = CAST(:table AS regclass)
+        """),
+        {"table": table},
+    ).fetchall()
+
+    # The shadow's serial defaults still point at the live table's
+    # sequences; hand ownership over so dropping the old table keeps them
+    sequences = conn.execute(
+        text("""
+            SELECT
+                a.attname AS column_name,
+                pg_get_serial_sequence(:table, a.attname) AS sequence_name
+            FROM pg_attribute a
+            WHERE a.attrelid = CAST(:table AS regclass)
+              AND a.attnum > 0
+              AND NOT a.attisdropped
+              AND a.attidentity = ''
+        """),
+        {"table": table},
+    ).fetchall()
+
+    for row in sequences:
+        if row.sequence_name:
+            conn.execute(text(
+                f"ALTER SEQUENCE {row.sequence_name} "
+                f"OWNED BY {shadow}.{row.column_name}"
+            ))
+
+    conn.execute(text(f"ALTER TABLE {table} RENAME TO {old}"))
+    conn.execute(text(f"ALTER TABLE {shadow} RENAME TO {table}"))
+    conn.execute(text(f"DROP TABLE {old}"))
+
+    # Give the indexes back their original names
+    for row in index_names:
+        if row.constraint_name:
+            conn.execute(text(
+                f"ALTER TABLE {table} RENAME CONSTRAINT "
+                f"{_temp_name(row.constraint_name)} TO {row.constraint_name}"
+            ))
+        else:
+            conn.execute(text(
+                f"ALTER INDEX {_temp_name(row.name)} RENAME TO {row.name}"
+            ))
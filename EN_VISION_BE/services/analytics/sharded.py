@@ -0,0 +1,215 @@
+import os
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+
+import pandas as pd
+from sqlalchemy import text
+from db.session import engine
+from services.analytics import baseline, daily_summary, deviation
+from services.analytics.watermarks import set_watermark
+from services.analytics.pipeline import pipeline_lock, invalidate_stages
+
+logger = logging.getLogger(__name__)
+
+# Shard on a device's surrogate key, or its department's. Every stage
+# here only relates rows of the same device, so with either key a
+# shard's summary -> baseline -> deviation chain needs nothing from the
+# other shards.
+SHARD_KEYS = ("device", "department")
+
+DEFAULT_SHARDS = os.cpu_count() or 4
+
+# Pipeline stages whose tables a sharded run rebuilds
+REBUILT_STAGES = ("daily_summary", "baseline", "deviation", "summary_baseline_deviation")
+
+
+def shard_filter(by="device", alias=""):
+    """
+    SQL predicate selecting the rows of shard :shard of :shard_count.
+    `alias` prefixes the column ("d." etc.).
+    """
+    if by not in SHARD_KEYS:
+        raise ValueError(f"Unknown shard key: {by}")
+
+    # Keys are dense serials, so a plain modulo spreads them evenly
+    return f"{alias}{by}_key % :shard_count = :shard"
+
+
+def run_sharded_refresh(shards=DEFAULT_SHARDS, by="device", workers=None,
+                        anomalies=True, on_shard_complete=None):
+    """
+    Full rebuild of daily_energy_summary, baseline_metrics,
+    energy_deviations and (optionally) energy_anomalies, split into
+    `shards` key partitions that run concurrently.
+
+    The SQL stages of each shard run back to back on a thread with its
+    own pooled connection, so Postgres works on `workers` shards at once;
+    Isolation Forest shards run in a process pool. Each shard stage
+    replaces its own rows in one transaction, so a device's rows switch
+    over atomically but different shards do not.
+
+    The whole run holds pipeline_lock, so post-ingest runs (and any
+    other pipeline run) wait instead of writing the change log or the
+    watermarks underneath it. Watermarks and the change log are reset
+    in every case: after success to the rebuilt state, after a shard
+    failure to nothing, so the next pipeline run does a full rebuild
+    rather than building on a partly rebuilt table. The rebuilt stages
+    are marked stale in pipeline_stage_runs either way, so the pipeline
+    reruns them and their dependents.
+
+    Anomaly scoring uses one Isolation Forest fitted on every device's
+    days, and the shards only score and write, so results do not depend
+    on the shard count.
+
+    `on_shard_complete(stage, shard, seconds)` is called as each shard
+    stage finishes. Returns {stage: {shard: seconds}}.
+    """
+
+    with pipeline_lock():
+        return _run_sharded(shards, by, workers, anomalies, on_shard_complete)
+
+
+def _run_sharded(shards, by, workers, anomalies, on_shard_complete):
+    workers = workers or min(shards, DEFAULT_SHARDS)
+    progress = {"daily_summary": {}, "baseline": {}, "deviation": {}}
+
+    with engine.connect() as conn:
+        high_water = daily_summary.max_created_at(conn)
+
+    def report(stage, shard, seconds):
+        progress[stage][shard] = seconds
+        done = len(progress[stage])
+        logger.info(f"Shard {shard} {stage} done in {seconds}s ({done}/{shards})")
+        if on_shard_complete:
+            on_shard_complete(stage, shard, seconds)
+
+    failures = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(_sql_shard, shard, shards, by, report): shard
+            for shard in range(shards)
+        }
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                logger.exception(f"Shard {futures[future]} failed")
+                failures.append(f"shard {futures[future]}: {e}")
+
+    with engine.begin() as conn:
+        daily_summary.reset_summary_changelog(conn)
+        invalidate_stages(conn, REBUILT_STAGES + ("anomaly",))
+
+        if failures:
+            conn.execute(
+                text("DELETE FROM pipeline_watermarks WHERE stage = :stage"),
+                {"stage": daily_summary.STAGE},
+            )
+        else:
+            set_watermark(conn, daily_summary.STAGE, watermark_ts=high_water)
+            change_id = baseline.max_change_id(conn)
+            set_watermark(conn, baseline.STAGE, watermark_id=change_id)
+            set_watermark(conn, deviation.STAGE, watermark_id=change_id)
+
+    if failures:
+        raise RuntimeError("; ".join(failures))
+
+    if anomalies:
+        from services.anomaly.isolation_forest import fit_model
+
+        progress["anomaly"] = {}
+        model = fit_model(_load_summary())
+
+        with ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn")) as pool:
+            futures = {
+                pool.submit(anomaly_shard, shard, shards, by, model): shard
+                for shard in range(shards)
+            }
+            for future in as_completed(futures):
+                report("anomaly", futures[future], future.result())
+
+    return progress
+
+
+def _load_summary(where="", params=None):
+    return pd.read_sql(
+        text(f"""
+            SELECT
+                date,
+                department_id,
+                device_id,
+                department_key,
+                device_key,
+                total_kwh,
+                avg_kwh,
+                peak_kwh
+            FROM daily_energy_summary
+            {where}
+        """),
+        engine,
+        params=params or {},
+    )
+
+
+def _sql_shard(shard, shard_count, by, report):
+    params = {"shard": shard, "shard_count": shard_count}
+    where = f"WHERE {shard_filter(by)}"
+
+    steps = [
+        ("daily_summary", [
+            f"DELETE FROM daily_energy_summary {where}",
+            daily_summary.SUMMARY_INSERT.format(table="daily_energy_summary", where=where),
+        ]),
+        ("baseline", [
+            f"DELETE FROM baseline_metrics {where}",
+            baseline.BASELINE_INSERT.format(table="baseline_metrics", where=where),
+            f"DELETE FROM baseline_windows {where}",
+        ] + [
+            (baseline.WINDOW_BUILD.format(device_filter=where), {"days": days})
+            for days in baseline.TRAILING_WINDOWS
+        ]),
+        ("deviation", [
+            f"DELETE FROM energy_deviations {where}",
+            deviation.DEVIATION_INSERT.format(table="energy_deviations")
+            + f"WHERE {shard_filter(by, 'd.')}",
+            f"DELETE FROM deviation_baselines {where}",
+            deviation.REFERENCE_INSERT.format(where=where),
+        ]),
+    ]
+
+    for stage, statements in steps:
+        started = time.perf_counter()
+        with engine.begin() as conn:
+            for statement in statements:
+                statement, extra = (
+                    statement if isinstance(statement, tuple) else (statement, {})
+                )
+                conn.execute(text(statement), {**params, **extra})
+        report(stage, shard, round(time.perf_counter() - started, 3))
+
+
+def anomaly_shard(shard, shard_count, by="device", model=None):
+    """
+    Score one shard and replace its energy_anomalies rows. `model` is
+    the Isolation Forest fitted on all devices; without it the shard
+    fits its own, and scores then depend on how devices were sharded.
+    Top-level so a process pool can run it.
+    """
+    from services.anomaly.isolation_forest import ANOMALY_INSERT, score_frame
+
+    started = time.perf_counter()
+    params = {"shard": shard, "shard_count": shard_count}
+    where = f"WHERE {shard_filter(by)}"
+
+    df = _load_summary(where, params)
+
+    rows = score_frame(df, model) if not df.empty else []
+
+    with engine.begin() as conn:
+        conn.execute(text(f"DELETE FROM energy_anomalies {where}"), params)
+        if rows:
+            conn.execute(text(ANOMALY_INSERT.format(table="energy_anomalies")), rows)
+
+    return round(time.perf_counter() - started, 3)
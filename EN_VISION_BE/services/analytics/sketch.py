@@ -0,0 +1,96 @@
+import math
+
+from sqlalchemy import text
+
+# Log-bucketed quantile sketch (as in DDSketch): a reading x > 0 counts
+# towards bucket ceil(log_gamma(x)), and any quantile read back from the
+# bucket counts is within RELATIVE_ACCURACY of the true value. Sketches
+# merge by adding counts per bucket, so daily sketches combine over any
+# range of days and devices.
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+
+# Bucket for readings of exactly zero (no log)
+ZERO_BUCKET = "z"
+
+
+def sketch_bucket_sql(value):
+    return (
+        f"CASE WHEN {value} > 0 "
+        f"THEN CEIL(LN({value}) / {math.log(GAMMA)!r})::int::text "
+        f"ELSE '{ZERO_BUCKET}' END"
+    )
+
+
+def merge_sketches(conn, where, params):
+    """
+    Sum the kwh_sketch bucket counts of the daily_energy_summary rows
+    matching `where`, in the database. Returns {bucket: count}; the
+    result has at most a few hundred buckets however many days it spans.
+    """
+    rows = conn.execute(
+        text(f"""
+            SELECT
+                b.key AS bucket,
+                SUM(b.value::bigint) AS readings
+            FROM daily_energy_summary d
+            CROSS JOIN LATERAL jsonb_each_text(d.kwh_sketch) b
+            {where}
+            GROUP BY b.key
+        """),
+        params,
+    ).fetchall()
+
+    return {row.bucket: int(row.readings) for row in rows}
+
+
+def missing_sketch_days(conn, where, params) -> int:
+    """
+    Days with at least one daily_energy_summary row matching `where` (a
+    WHERE clause) that has no kwh_sketch, because it was written before
+    sketches existed; merge_sketches leaves those readings out.
+    """
+    return conn.execute(
+        text(f"""
+            SELECT COUNT(DISTINCT d.date)
+            FROM daily_energy_summary d
+            {where}
+            AND d.kwh_sketch IS NULL
+        """),
+        params,
+    ).scalar()
+
+
+def quantiles(buckets, qs):
+    """
+    Values at quantiles `qs` (0-1) of a merged sketch, or None for an
+    empty sketch. Each value is the midpoint of its bucket in relative
+    terms, 2 * gamma^i / (gamma + 1).
+    """
+    total = sum(buckets.values())
+    if total == 0:
+        return {q: None for q in qs}
+
+    ordered = []
+    if ZERO_BUCKET in buckets:
+        ordered.append((0.0, buckets[ZERO_BUCKET]))
+    ordered.extend(
+        (2 * GAMMA ** int(key) / (GAMMA + 1), count)
+        for key, count in sorted(
+            ((k, c) for k, c in buckets.items() if k != ZERO_BUCKET),
+            key=lambda item: int(item[0]),
+        )
+    )
+
+    result = {}
+    for q in qs:
+        # Rank of the q-quantile among `total` readings, 0-based
+        rank = q * (total - 1)
+        seen = 0
+        for value, count in ordered:
+            seen += count
+            if seen > rank:
+                result[q] = value
+                break
+
+    return result
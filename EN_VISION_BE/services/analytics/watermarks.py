@@ -0,0 +1,51 @@
+from sqlalchemy import text
+
+
+def get_watermark(conn, stage: str):
+    """
+    (watermark_ts, watermark_id) for a stage; (None, None) if it never ran.
+    """
+    row = conn.execute(
+        text("""
+            SELECT watermark_ts, watermark_id
+            FROM pipeline_watermarks
+            WHERE stage = :stage
+        """),
+        {"stage": stage},
+    ).fetchone()
+
+    if row is None:
+        return None, None
+    return row.watermark_ts, row.watermark_id
+
+
+def set_watermark(conn, stage: str, watermark_ts=None, watermark_id=None):
+    """
+    Advance a stage's watermark. Call inside the transaction that wrote
+    the stage's output so progress and results commit together.
+    """
+    conn.execute(
+        text("""
+            INSERT INTO pipeline_watermarks (
+                stage,
+                watermark_ts,
+                watermark_id,
+                updated_at
+            )
+            VALUES (
+                :stage,
+                :watermark_ts,
+                :watermark_id,
+                CURRENT_TIMESTAMP
+            )
+            ON CONFLICT (stage) DO UPDATE SET
+                watermark_ts = EXCLUDED.watermark_ts,
+                watermark_id = EXCLUDED.watermark_id,
+                updated_at = EXCLUDED.updated_at
+        """),
+        {
+            "stage": stage,
+            "watermark_ts": watermark_ts,
+            "watermark_id": watermark_id,
+        },
+    )
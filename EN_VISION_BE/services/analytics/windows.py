@@ -0,0 +1,119 @@
+from sqlalchemy import text
+
+TOUCHED_KEYS_TABLE = "touched_keys"
+
+
+def record_batch_keys(conn, batch_id: str):
+    """
+    Remember which (date, device_id, department_id) windows a batch wrote
+    to, with their surrogate keys, so the pipeline can recompute just
+    those windows later.
+    Runs in the ingestion transaction, right after the rows land.
+    """
+    conn.execute(
+        text("""
+            INSERT INTO ingestion_batch_keys (
+                ingestion_batch_id,
+                date,
+                device_id,
+                department_id,
+                device_key,
+                department_key
+            )
+            SELECT DISTINCT
+                :batch_id,
+                DATE("timestamp"),
+                device_id,
+                department_id,
+                device_key,
+                department_key
+            FROM energy_events
+            WHERE ingestion_batch_id = :batch_id
+        """),
+        {"batch_id": batch_id},
+    )
+
+
+def record_moved_keys(conn, staging_table: str):
+    """
+    Before an update-mode merge: record the current (date, device_id,
+    department_id) window of every stored row the staged rows are about
+    to move to another department, under the staged row's batch id.
+    The merge overwrites department_id, so afterwards only the new
+    window would be found and the old department's derived rows would
+    stay stale.
+    """
+    conn.execute(text(f"""
+        INSERT INTO ingestion_batch_keys (
+            ingestion_batch_id,
+            date,
+            device_id,
+            department_id,
+            device_key,
+            department_key
+        )
+        SELECT DISTINCT
+            s.ingestion_batch_id,
+            DATE(e."timestamp"),
+            e.device_id,
+            e.department_id,
+            e.device_key,
+            e.department_key
+        FROM {staging_table} s
+        JOIN energy_events e
+          ON e."timestamp" = s."timestamp"
+         AND e.device_id = s.device_id
+        WHERE e.department_key IS DISTINCT FROM s.department_key
+    """))
+
+
+def pending_batches(conn) -> list:
+    """
+    Batch ids that still have windows recorded, i.e. not yet covered by
+    a successful pipeline run: the batches of the run about to start,
+    plus leftovers of failed runs and of loads made with analytics
+    deferred. A batch's keys are all written in its ingestion
+    transaction, so a batch listed here has all of its keys visible.
+    """
+    rows = conn.execute(
+        text("SELECT DISTINCT ingestion_batch_id FROM ingestion_batch_keys")
+    ).fetchall()
+    return [r.ingestion_batch_id for r in rows]
+
+
+def prune_batch_keys(conn, batch_ids) -> int:
+    """
+    Forget the windows of batches the pipeline has processed.
+    """
+    return conn.execute(
+        text("DELETE FROM ingestion_batch_keys WHERE ingestion_batch_id = ANY(:batch_ids)"),
+        {"batch_ids": list(batch_ids)},
+    ).rowcount
+
+
+def load_touched_keys(conn) -> int:
+    """
+    Materialise every window not yet pruned into a temp table (dropped
+    at commit) that the stage queries join against. That is the windows
+    of the batches being processed plus any left behind by failed runs
+    or deferred loads, so those are caught up by the next run.
+    Windows carry both the surrogate keys, which the stage queries join
+    on, and the string ids, for the stages still keyed on those.
+    Returns the number of distinct windows.
+    """
+    conn.execute(text(f"""
+        CREATE TEMP TABLE {TOUCHED_KEYS_TABLE} ON COMMIT DROP AS
+        SELECT DISTINCT
+            date,
+            device_key,
+            department_key,
+            device_id,
+            department_id
+        FROM ingestion_batch_keys
+    """))
+
+    conn.execute(text(f"ANALYZE {TOUCHED_KEYS_TABLE}"))
+
+    return conn.execute(
+        text(f"SELECT COUNT(*) FROM {TOUCHED_KEYS_TABLE}")
+    ).scalar()
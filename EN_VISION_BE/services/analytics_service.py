@@ -1,43 +1,22 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import func, cast, Date
-from db.models import EnergyEvent
-from db.analytics_models import DailyEnergySummary
+from db.session import engine
+from services.analytics.daily_summary import STAGE, run_daily_energy_summary
+from services.analytics.pipeline import pipeline_lock, invalidate_stages
 
 
-def compute_daily_energy_summary(db: Session):
+def compute_daily_energy_summary(db: Session = None, incremental: bool = False):
     """
     Aggregates raw energy events into daily summaries.
+    Delegates to services.analytics.daily_summary: the full rebuild fills
+    a shadow table and swaps it in, and both paths advance the stage's
+    watermark. Runs under pipeline_lock, and the stage is marked stale so
+    the next pipeline run rebuilds what depends on the summary. `db` is
+    unused and kept for existing callers.
     """
 
-    results = (
-        db.query(
-            cast(EnergyEvent.timestamp, Date).label("date"),
-            EnergyEvent.department_id,
-            EnergyEvent.device_id,
-            func.sum(EnergyEvent.kwh).label("total_kwh"),
-            func.avg(EnergyEvent.kwh).label("avg_kwh"),
-            func.max(EnergyEvent.kwh).label("peak_kwh"),
-        )
-        .group_by(
-            cast(EnergyEvent.timestamp, Date),
-            EnergyEvent.department_id,
-            EnergyEvent.device_id,
-        )
-        .all()
-    )
+    with pipeline_lock():
+        result = run_daily_energy_summary(incremental=incremental)
+        with engine.begin() as conn:
+            invalidate_stages(conn, [STAGE])
 
-    # Clear old summaries (rebuildable table)
-    db.query(DailyEnergySummary).delete()
-
-    for row in results:
-        summary = DailyEnergySummary(
-            date=row.date,
-            department_id=row.department_id,
-            device_id=row.device_id,
-            total_kwh=row.total_kwh,
-            avg_kwh=row.avg_kwh,
-            peak_kwh=row.peak_kwh,
-        )
-        db.add(summary)
-
-    db.commit()
+    return result
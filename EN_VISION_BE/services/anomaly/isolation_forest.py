@@ -3,11 +3,39 @@ import numpy as np
 from sklearn.ensemble import IsolationForest
 from sqlalchemy import text
 from db.session import engine
+from services.analytics.windows import load_touched_keys, TOUCHED_KEYS_TABLE
+from services.analytics.shadow import shadow_rebuild
+
+ANOMALY_INSERT = """
+    INSERT INTO {table} (
+        date,
+        department_id,
+        device_id,
+        department_key,
+        device_key,
+        total_kwh,
+        anomaly_score,
+        anomaly_label
+    )
+    VALUES (
+        :date,
+        :department_id,
+        :device_id,
+        :department_key,
+        :device_key,
+        :total_kwh,
+        :anomaly_score,
+        :anomaly_label
+    )
+"""
 
 
-def run_isolation_forest():
+def run_isolation_forest(batch_ids=None):
     """
-    ML-based anomaly detection using Isolation Forest
+    ML-based anomaly detection using Isolation Forest.
+    The model is always fit on the full daily summary (small: one row per
+    device-day); with `batch_ids`, only the windows still recorded in
+    ingestion_batch_keys are rescored and rewritten.
     """
 
     # 1️⃣ Load data
@@ -16,6 +44,8 @@ def run_isolation_forest():
             date,
             department_id,
             device_id,
+            department_key,
+            device_key,
             total_kwh,
             avg_kwh,
             peak_kwh
@@ -26,61 +56,100 @@ def run_isolation_forest():
     if df.empty:
         return
 
-    # 2️⃣ Feature engineering
+    # 2️⃣ Score
+    rows = score_frame(df)
+
+    # 3️⃣ Persist results
+    with engine.begin() as conn:
+        if batch_ids:
+            load_touched_keys(conn)
+            touched = {
+                (r.date, r.department_key, r.device_key)
+                for r in conn.execute(text(
+                    f"SELECT date, department_key, device_key FROM {TOUCHED_KEYS_TABLE}"
+                ))
+            }
+            rows = [
+                r for r in rows
+                if (r["date"], r["department_key"], r["device_key"]) in touched
+            ]
+
+            conn.execute(text(f"""
+                DELETE FROM energy_anomalies a
+                USING {TOUCHED_KEYS_TABLE} k
+                WHERE a.date = k.date
+                  AND a.device_key = k.device_key
+                  AND a.department_key = k.department_key;
+            """))
+
+            if rows:
+                conn.execute(text(ANOMALY_INSERT.format(table="energy_anomalies")), rows)
+        else:
+            # Full rescore goes through a shadow table so readers never see it empty
+            with shadow_rebuild(conn, "energy_anomalies") as shadow:
+                conn.execute(
+                    text(ANOMALY_INSERT.format(table=shadow["energy_anomalies"])),
+                    rows,
+                )
+
+
+def _features(df):
     df["date"] = pd.to_datetime(df["date"])
     df["day_of_week"] = df["date"].dt.dayofweek
     df["month"] = df["date"].dt.month
 
-    features = df[
+    return df[
         ["total_kwh", "avg_kwh", "peak_kwh", "day_of_week", "month"]
     ]
 
-    # 3️⃣ Train Isolation Forest
+
+def fit_model(df):
+    """
+    Train an Isolation Forest on `df` (daily_energy_summary rows).
+    """
     model = IsolationForest(
         n_estimators=100,
         contamination=0.05,   # 5% anomalies
         random_state=42
     )
+    return model.fit(_features(df))
 
-    df["anomaly_score"] = model.fit_predict(features)
+
+def score_frame(df, model=None):
+    """
+    Score `df` (daily_energy_summary rows) and return one
+    energy_anomalies row dict per input row. Without `model`, one is
+    fitted on `df` itself; pass a model fitted on every device to score
+    a subset the same way the full table would be.
+    """
+
+    # 1️⃣ Feature engineering
+    features = _features(df)
+
+    # 2️⃣ Score with the given model, or train one on this data
+    if model is None:
+        model = fit_model(df)
+
+    df["anomaly_score"] = model.predict(features)
 
     # Convert output
     df["anomaly_label"] = df["anomaly_score"].apply(
         lambda x: "ANOMALY" if x == -1 else "NORMAL"
     )
 
-    # 4️⃣ Persist results
-    insert_query = text("""
-        INSERT INTO energy_anomalies (
-            date,
-            department_id,
-            device_id,
-            total_kwh,
-            anomaly_score,
-            anomaly_label
-        )
-        VALUES (
-            :date,
-            :department_id,
-            :device_id,
-            :total_kwh,
-            :anomaly_score,
-            :anomaly_label
-        )
-    """)
+    # 3️⃣ Rows for energy_anomalies
+    rows = [
+        {
+            "date": row.date.date(),
+            "department_id": row.department_id,
+            "device_id": row.device_id,
+            "department_key": int(row.department_key),
+            "device_key": int(row.device_key),
+            "total_kwh": row.total_kwh,
+            "anomaly_score": int(row.anomaly_score),
+            "anomaly_label": row.anomaly_label
+        }
+        for row in df.itertuples(index=False)
+    ]
 
-    with engine.begin() as conn:
-        conn.execute(text("DELETE FROM energy_anomalies;"))
-
-        for _, row in df.iterrows():
-            conn.execute(
-                insert_query,
-                {
-                    "date": row["date"].date(),
-                    "department_id": row["department_id"],
-                    "device_id": row["device_id"],
-                    "total_kwh": row["total_kwh"],
-                    "anomaly_score": int(row["anomaly_score"]),
-                    "anomaly_label": row["anomaly_label"]
-                }
-            )
+    return rows
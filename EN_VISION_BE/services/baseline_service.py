@@ -1,36 +1,23 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from db.analytics_models import DailyEnergySummary
-from db.baseline_models import BaselineMetric
+from services.analytics.baseline import (
+    TRAILING_WINDOWS,
+    rebuild_baselines,
+    run_baseline_metrics,
+)
 
 
-def compute_baselines(db: Session):
+def compute_baselines(db: Session, incremental: bool = False, windows=TRAILING_WINDOWS):
     """
     Computes baseline energy consumption per device & department.
+    Runs set-based in the session's transaction, keeping the running
+    sums and watermark that incremental updates build on. With
+    `incremental`, only daily totals changed since the last run are
+    applied (see services.analytics.baseline).
     """
 
-    results = (
-        db.query(
-            DailyEnergySummary.department_id,
-            DailyEnergySummary.device_id,
-            func.avg(DailyEnergySummary.total_kwh).label("baseline_kwh"),
-        )
-        .group_by(
-            DailyEnergySummary.department_id,
-            DailyEnergySummary.device_id
-        )
-        .all()
-    )
+    if incremental:
+        return run_baseline_metrics(incremental=True, windows=windows)
 
-    # Clear old baselines
-    db.query(BaselineMetric).delete()
-
-    for row in results:
-        baseline = BaselineMetric(
-            department_id=row.department_id,
-            device_id=row.device_id,
-            baseline_kwh=row.baseline_kwh,
-        )
-        db.add(baseline)
+    rebuild_baselines(db.connection(), windows)
 
     db.commit()
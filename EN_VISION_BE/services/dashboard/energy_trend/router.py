@@ -4,6 +4,7 @@ from sqlalchemy import text
 from datetime import date, datetime, timedelta
 from typing import Optional
 from db.session import get_db
+from services.analytics.profiles import HOUR_OF_WEEK, hour_of_week_sql
 
 router = APIRouter(prefix="/energy-trend", tags=["Energy Trend"])
 
@@ -20,7 +21,7 @@ def get_energy_trend(
     Energy trend aligned with:
     energy_agg_daily
     energy_agg_hourly
-    baseline_metrics
+    baseline_profiles (hourly)
     """
 
     # ---------------------------------
@@ -49,7 +50,7 @@ def get_energy_trend(
     # ---------------------------------
     if granularity == "hourly":
         rows = db.execute(
-            text("""
+            text(f"""
             SELECT
                 h.hour AS timestamp,
                 h.consumption_kwh,
@@ -58,12 +59,15 @@ def get_energy_trend(
                 h.peak_power_kw,
                 b.baseline_kwh
             FROM energy_agg_hourly h
-            LEFT JOIN baseline_metrics b
-                ON h.meter_id = b.meter_id
+            LEFT JOIN baseline_profiles b
+                ON b.device_id = h.meter_id
+                AND b.department_id = h.department_id
+                AND b.profile = :profile
+                AND b.slot = {hour_of_week_sql("h.hour")}
             WHERE h.hour BETWEEN :start AND :end
             ORDER BY h.hour
             """),
-            {"start": start_date, "end": end_date},
+            {"start": start_date, "end": end_date, "profile": HOUR_OF_WEEK},
         ).fetchall()
 
         return {
@@ -10,7 +10,7 @@ def run_lstm_forecast(days_ahead=7):
     """
 
     df = pd.read_sql("""
-        SELECT date, department_id, device_id, total_kwh
+        SELECT date, department_id, device_id, department_key, device_key, total_kwh
         FROM daily_energy_summary
         ORDER BY date
     """, engine)
@@ -22,7 +22,7 @@ def run_lstm_forecast(days_ahead=7):
 
     forecasts = []
 
-    for (dept, dev), group in df.groupby(["department_id", "device_id"]):
+    for (dept, dev), group in df.groupby(["department_key", "device_key"]):
         series = group["total_kwh"].values
 
         if len(series) < 20:
@@ -54,8 +54,10 @@ def run_lstm_forecast(days_ahead=7):
 
             forecasts.append({
                 "forecast_date": future_date.date(),
-                "department_id": dept,
-                "device_id": dev,
+                "department_id": group["department_id"].iloc[-1],
+                "device_id": group["device_id"].iloc[-1],
+                "department_key": int(dept),
+                "device_key": int(dev),
                 "model_type": "LSTM",
                 "predicted_kwh": round(float(pred), 2)
             })
@@ -67,6 +69,8 @@ def run_lstm_forecast(days_ahead=7):
         for f in forecasts:
             conn.execute(text("""
                 INSERT INTO energy_forecasts
-                (forecast_date, department_id, device_id, model_type, predicted_kwh)
-                VALUES (:forecast_date, :department_id, :device_id, :model_type, :predicted_kwh)
+                (forecast_date, department_id, device_id, department_key, device_key,
+                 model_type, predicted_kwh)
+                VALUES (:forecast_date, :department_id, :device_id, :department_key, :device_key,
+                        :model_type, :predicted_kwh)
             """), f)
@@ -0,0 +1,222 @@
+import asyncio
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers
+
+from utils.settings import MAX_UPLOAD_BYTES
+
+# Uploads processed at once (each holds a DB connection for its COPY)
+MAX_CONCURRENT_INGESTIONS = 4
+# Sum of Content-Length across uploads being received or processed
+MAX_BYTES_IN_FLIGHT = 2 * 1024 ** 3
+# Uploads allowed to wait for a slot before we start shedding with 429
+MAX_QUEUED = 16
+# How long a queued upload waits before giving up with 429
+QUEUE_TIMEOUT_SECONDS = 30.0
+RETRY_AFTER_SECONDS = 10
+
+# File upload endpoints (POST) gated by AdmissionMiddleware
+ADMITTED_PATHS = {
+    "/ingest/csv",
+    "/ingest/csv/stream",
+    "/ingest/parquet",
+    "/ingest/arrow",
+}
+
+
+class AdmissionController:
+    """
+    Caps concurrent ingestions and total bytes in flight.
+
+    Requests over the limit wait in a bounded queue; when the queue is
+    full, or a request waits longer than `queue_timeout`, it is rejected
+    with 429 + Retry-After so clients back off instead of piling up.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = MAX_CONCURRENT_INGESTIONS,
+        max_bytes: int = MAX_BYTES_IN_FLIGHT,
+        max_queued: int = MAX_QUEUED,
+        queue_timeout: float = QUEUE_TIMEOUT_SECONDS,
+        retry_after: int = RETRY_AFTER_SECONDS,
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_bytes = max_bytes
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+
+        self._cond = asyncio.Condition()
+        self._active = 0
+        self._bytes = 0
+        self._queued = 0
+        self._admitted_total = 0
+        self._rejected_total = 0
+
+    def _fits(self, size: int) -> bool:
+        if self._active >= self.max_concurrent:
+            return False
+        # A single upload larger than the budget may run alone
+        return self._active == 0 or self._bytes + size <= self.max_bytes
+
+    def _reject(self, reason: str):
+        self._rejected_total += 1
+        raise HTTPException(
+            status_code=429,
+            detail=f"Ingestion busy: {reason}",
+            headers={"Retry-After": str(self.retry_after)},
+        )
+
+    async def acquire(self, size: int):
+        async with self._cond:
+            if not self._fits(size):
+                if self._queued >= self.max_queued:
+                    self._reject("queue full")
+
+                self._queued += 1
+                try:
+                    await asyncio.wait_for(
+                        self._cond.wait_for(lambda: self._fits(size)),
+                        timeout=self.queue_timeout,
+                    )
+                except asyncio.TimeoutError:
+                    self._reject("timed out waiting for a slot")
+                finally:
+                    self._queued -= 1
+
+            self._active += 1
+            self._bytes += size
+            self._admitted_total += 1
+
+    async def release(self, size: int):
+        async with self._cond:
+            self._active -= 1
+            self._bytes -= size
+            self._cond.notify_all()
+
+    def stats(self) -> dict:
+        return {
+            "active": self._active,
+            "bytes_in_flight": self._bytes,
+            "queue_depth": self._queued,
+            "admitted_total": self._admitted_total,
+            "rejected_total": self._rejected_total,
+            "limits": {
+                "max_concurrent": self.max_concurrent,
+                "max_bytes_in_flight": self.max_bytes,
+                "max_queued": self.max_queued,
+                "queue_timeout_seconds": self.queue_timeout,
+                "retry_after_seconds": self.retry_after,
+            },
+        }
+
+
+ingestion_admission = AdmissionController()
+
+
+class UploadTooLarge(Exception):
+    """Raised from the wrapped receive once a body passes the upload limit."""
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware applying admission control to ADMITTED_PATHS before
+    the request body is read.
+
+    A FastAPI dependency only runs after the multipart body has been
+    parsed and spooled, so it could limit processing but not the memory
+    and temp disk spent receiving uploads. Here the slot is taken first
+    and held until the response is sent.
+
+    Uploads declaring a Content-Length over MAX_UPLOAD_BYTES get 413
+    before any body is read; the others reserve their declared size.
+    Chunked uploads (no Content-Length, e.g. curl -T - into
+    /ingest/csv/stream) reserve MAX_UPLOAD_BYTES, and the bytes actually
+    received are counted: once a body passes the limit, reading stops
+    and the response is replaced with 413.
+    """
+
+    def __init__(self, app, controller: AdmissionController = None,
+                 paths=ADMITTED_PATHS, max_upload_bytes: int = MAX_UPLOAD_BYTES):
+        self.app = app
+        self.controller = controller or ingestion_admission
+        self.paths = paths
+        self.max_upload_bytes = max_upload_bytes
+
+    def _too_large(self, size=None):
+        received = f"Upload of {size} bytes" if size is not None else "Upload"
+        return JSONResponse(
+            {"detail": f"{received} exceeds the {self.max_upload_bytes} byte limit"},
+            status_code=413,
+        )
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "POST"
+            or scope["path"].rstrip("/") not in self.paths
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        length = Headers(scope=scope).get("content-length")
+        if length is not None and not length.isdigit():
+            response = JSONResponse(
+                {"detail": f"Invalid Content-Length: {length!r}"},
+                status_code=400,
+            )
+            await response(scope, receive, send)
+            return
+
+        if length is None:
+            size = self.max_upload_bytes
+        else:
+            size = int(length)
+            if size > self.max_upload_bytes:
+                await self._too_large(size)(scope, receive, send)
+                return
+
+        try:
+            await self.controller.acquire(size)
+        except HTTPException as e:
+            response = JSONResponse(
+                {"detail": e.detail},
+                status_code=e.status_code,
+                headers=e.headers,
+            )
+            await response(scope, receive, send)
+            return
+
+        state = {"received": 0, "too_large": False, "started": False}
+
+        async def counted_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                state["received"] += len(message.get("body", b""))
+                if state["received"] > self.max_upload_bytes:
+                    state["too_large"] = True
+                    raise UploadTooLarge()
+            return message
+
+        async def checked_send(message):
+            # The app may turn the receive error into its own 400/500;
+            # answer 413 instead and drop the app's response
+            if state["too_large"]:
+                if not state["started"]:
+                    state["started"] = True
+                    await self._too_large()(scope, receive, send)
+                return
+            if message["type"] == "http.response.start":
+                state["started"] = True
+            await send(message)
+
+        try:
+            await self.app(scope, counted_receive, checked_send)
+        except UploadTooLarge:
+            if not state["started"]:
+                state["started"] = True
+                await self._too_large()(scope, receive, send)
+        finally:
+            await self.controller.release(size)
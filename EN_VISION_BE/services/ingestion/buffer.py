@@ -0,0 +1,274 @@
+import os
+import time
+import uuid
+import logging
+import threading
+
+import pandas as pd
+
+from db.session import engine
+from services.ingestion.copy_loader import copy_events
+from services.ingestion.dedup import STAGING_TABLE, prepare_staging, merge_staged_events
+from services.ingestion.schemas import STREAM_FIELDS
+from services.ingestion.service import write_audit_log, enqueue_analytics
+from services.analytics.windows import record_batch_keys
+from services.ingestion.dimensions import dimension_cache
+from utils.settings import DEAD_LETTER_DIR
+
+logger = logging.getLogger(__name__)
+
+# Flush when this many readings are buffered ...
+MAX_ROWS = 50_000
+# ... or when the oldest buffered reading is this old
+MAX_AGE_SECONDS = 5.0
+
+# A failed flush puts its rows back and is retried after a backoff that
+# doubles each time; after MAX_FLUSH_ATTEMPTS the batch is spilled to
+# the dead-letter directory
+MAX_FLUSH_ATTEMPTS = 6
+RETRY_BACKOFF_SECONDS = 1.0
+
+# Above this many buffered readings (e.g. while the DB is down) new
+# readings are refused instead of acknowledged
+MAX_PENDING_ROWS = 10 * MAX_ROWS
+
+
+class BufferFull(Exception):
+    pass
+
+
+class ReadingBuffer:
+    """
+    In-process micro-batch buffer for streamed readings.
+
+    Readings accumulate as row tuples and are COPYed into energy_events
+    in one batch (one ingestion_batch_id) when the buffer reaches
+    `max_rows` or its oldest reading reaches `max_age_seconds`.
+    A daemon thread enforces the age limit between requests.
+
+    Readings are acknowledged once buffered, so a failed write puts them
+    back at the head of the buffer and the next flush (after a backoff)
+    retries them. A batch that fails MAX_FLUSH_ATTEMPTS times in a row
+    is taken out of the buffer and written to `dead_letter_dir` as
+    stream-<batch id>.csv (the /ingest/csv column layout), so it can be
+    replayed with `python -m scripts.run_backfill <dead_letter_dir>`;
+    its rows count in failed_rows. While writes keep failing
+    the buffer grows until `max_pending_rows`, then add() raises
+    BufferFull so new readings are refused rather than acknowledged.
+    """
+
+    def __init__(self, max_rows: int = MAX_ROWS, max_age_seconds: float = MAX_AGE_SECONDS,
+                 max_pending_rows: int = MAX_PENDING_ROWS, dead_letter_dir: str = DEAD_LETTER_DIR):
+        self.max_rows = max_rows
+        self.max_age_seconds = max_age_seconds
+        self.max_pending_rows = max_pending_rows
+        self.dead_letter_dir = dead_letter_dir
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._rows = []
+        self._oldest = None
+        self._ticker = None
+
+        # Consecutive failed flushes, and when the next one may run
+        self._attempts = 0
+        self._retry_at = 0.0
+
+        self.flushed_rows = 0
+        self.flushed_batches = 0
+        self.failed_rows = 0
+        self.retried_flushes = 0
+        self.dead_letter_files = []
+
+    def add(self, rows: list) -> int:
+        """
+        Buffer validated row tuples; flushes inline when the size limit
+        is hit. Returns the number of rows currently buffered.
+        Raises BufferFull (buffering nothing) when the rows don't fit.
+        """
+        self._ensure_ticker()
+
+        with self._lock:
+            if len(self._rows) + len(rows) > self.max_pending_rows:
+                raise BufferFull(
+                    f"{len(self._rows)} of {self.max_pending_rows} readings buffered; retry later"
+                )
+            if not self._rows:
+                self._oldest = time.monotonic()
+            self._rows.extend(rows)
+            full = len(self._rows) >= self.max_rows
+
+        if full:
+            self.flush()
+
+        return self.pending()
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._rows)
+
+    def flush(self, force: bool = False) -> int:
+        """
+        Write everything buffered as one batch. Waits out the retry
+        backoff after a failure unless `force`. Returns rows written.
+        """
+        # One writer at a time keeps batches in arrival order
+        with self._flush_lock:
+            with self._lock:
+                if not force and time.monotonic() < self._retry_at:
+                    return 0
+                rows = self._rows
+                oldest = self._oldest
+                self._rows = []
+                self._oldest = None
+
+            if not rows:
+                return 0
+
+            try:
+                self._write(rows)
+            except Exception:
+                self._attempts += 1
+
+                if self._attempts >= MAX_FLUSH_ATTEMPTS:
+                    logger.exception(
+                        f"Stream buffer flush of {len(rows)} readings failed "
+                        f"{self._attempts} times; moving them to the dead-letter directory"
+                    )
+                    self._spill(rows)
+                    self.failed_rows += len(rows)
+                    self._attempts = 0
+                    self._retry_at = 0.0
+                    return 0
+
+                backoff = RETRY_BACKOFF_SECONDS * 2 ** (self._attempts - 1)
+                logger.exception(
+                    f"Stream buffer flush of {len(rows)} readings failed "
+                    f"(attempt {self._attempts}); retrying in {backoff}s"
+                )
+
+                # Back at the head, ahead of anything buffered meanwhile
+                with self._lock:
+                    self._rows = rows + self._rows
+                    self._oldest = oldest
+                self.retried_flushes += 1
+                self._retry_at = time.monotonic() + backoff
+                return 0
+
+            self._attempts = 0
+            self._retry_at = 0.0
+            self.flushed_rows += len(rows)
+            self.flushed_batches += 1
+            return len(rows)
+
+    def drain(self) -> int:
+        """
+        Flush until the buffer is empty or a batch is given up on,
+        sleeping through the backoffs (used at shutdown).
+        """
+        written = 0
+        while self.pending():
+            failed_before = self.failed_rows
+            written += self.flush(force=True)
+            if self.failed_rows != failed_before:
+                break
+            if self.pending():
+                time.sleep(max(self._retry_at - time.monotonic(), 0))
+        return written
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = len(self._rows)
+            age = time.monotonic() - self._oldest if self._oldest else 0.0
+
+        return {
+            "buffered": pending,
+            "oldest_age_seconds": round(age, 3),
+            "flushed_rows": self.flushed_rows,
+            "flushed_batches": self.flushed_batches,
+            "failed_rows": self.failed_rows,
+            "retried_flushes": self.retried_flushes,
+            "dead_letter_files": list(self.dead_letter_files),
+            "flush_attempts": self._attempts,
+            "max_rows": self.max_rows,
+            "max_age_seconds": self.max_age_seconds,
+        }
+
+    def _spill(self, rows: list):
+        """
+        Write readings the buffer gave up on to a dead-letter CSV and log
+        its batch id. If even that fails the readings are lost, and the
+        error says how many.
+        """
+        batch_id = str(uuid.uuid4())
+        path = os.path.join(self.dead_letter_dir, f"stream-{batch_id}.csv")
+
+        try:
+            os.makedirs(self.dead_letter_dir, exist_ok=True)
+            pd.DataFrame.from_records(rows, columns=STREAM_FIELDS).to_csv(path, index=False)
+        except Exception:
+            logger.exception(
+                f"Could not write dead-letter batch {batch_id}; "
+                f"{len(rows)} acknowledged readings are lost"
+            )
+            return None
+
+        logger.error(
+            f"Dead-letter batch {batch_id}: {len(rows)} readings written to {path}"
+        )
+        self.dead_letter_files.append(path)
+        return path
+
+    def _write(self, rows: list):
+        batch_id = str(uuid.uuid4())
+
+        df = pd.DataFrame.from_records(rows, columns=STREAM_FIELDS)
+        df["ingestion_batch_id"] = batch_id
+
+        # Meters retransmit on timeouts: stage + merge so resends are no-ops
+        with engine.begin() as conn:
+            prepare_staging(conn)
+            df = dimension_cache.for_load(conn).add_to_frame(df)
+            copy_events(conn, df, STAGING_TABLE)
+            written = merge_staged_events(conn, "skip")
+            record_batch_keys(conn, batch_id)
+
+            write_audit_log(conn, "STREAM_INGEST", {
+                "rows_received": len(df),
+                "rows_ingested": written,
+                "batch_id": batch_id,
+                "mode": "stream_buffer",
+            })
+
+        if written:
+            enqueue_analytics(batch_id)
+
+    def _ensure_ticker(self):
+        if self._ticker is not None:
+            return
+
+        with self._lock:
+            if self._ticker is None:
+                self._ticker = threading.Thread(
+                    target=self._tick,
+                    name="stream-buffer-flusher",
+                    daemon=True,
+                )
+                self._ticker.start()
+
+    def _tick(self):
+        interval = max(self.max_age_seconds / 4, 0.05)
+        while True:
+            time.sleep(interval)
+
+            with self._lock:
+                expired = (
+                    self._oldest is not None
+                    and time.monotonic() - self._oldest >= self.max_age_seconds
+                )
+
+            if expired:
+                self.flush()
+
+
+reading_buffer = ReadingBuffer()
@@ -0,0 +1,174 @@
+import logging
+from datetime import datetime
+
+import pandas as pd
+from fastapi import UploadFile, HTTPException
+from sqlalchemy.exc import IntegrityError
+
+from services.ingestion.copy_loader import copy_arrow, EVENT_COLUMNS
+from services.ingestion.service import (
+    REQUIRED_COLUMNS,
+    load_event_batches,
+    check_duplicate_upload,
+    chunk_validator,
+    conflict_error,
+)
+
+logger = logging.getLogger(__name__)
+
+# Rows per record batch when reading Parquet row groups
+BATCH_SIZE = 100_000
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        raise HTTPException(
+            status_code=501,
+            detail="Columnar ingestion requires pyarrow",
+        )
+
+
+def _check_schema(names):
+    if not REQUIRED_COLUMNS.issubset(names):
+        raise ValueError(
+            f"Missing required columns: {REQUIRED_COLUMNS - set(names)}"
+        )
+
+
+def record_batch_validator(strict_devices: bool = False):
+    """
+    `validate` hook for load_event_batches over Arrow record batches.
+    Runs the same validate_chunk checks as the CSV paths on the batch's
+    pandas view and hands the valid rows back as a record batch. Row
+    numbers count across batches, as they do for CSV chunks.
+    """
+    import pyarrow as pa
+
+    validate = chunk_validator(strict_devices)
+    seen = {"rows": 0}
+
+    def validate_batch(conn, batch):
+        df = batch.to_pandas()
+        df.index = pd.RangeIndex(seen["rows"], seen["rows"] + len(df))
+        seen["rows"] += len(df)
+
+        valid, rejects = validate(conn, df)
+        return pa.RecordBatch.from_pandas(valid, preserve_index=False), rejects
+
+    return validate_batch
+
+
+def _copy_record_batch(conn, batch, batch_id, table):
+    """
+    Tag a record batch with batch id and created_at and COPY it.
+    Added columns are built with Arrow kernels, not Python lists.
+    """
+    import pyarrow as pa
+
+    n = batch.num_rows
+    if n == 0:
+        return 0
+
+    arrow_table = pa.Table.from_batches([batch])
+    arrow_table = arrow_table.append_column(
+        "ingestion_batch_id",
+        pa.nulls(n, pa.string()).fill_null(batch_id),
+    )
+    arrow_table = arrow_table.append_column(
+        "created_at",
+        pa.nulls(n, pa.timestamp("us")).fill_null(
+            pa.scalar(datetime.utcnow(), pa.timestamp("us"))
+        ),
+    )
+
+    return copy_arrow(conn, arrow_table, table, EVENT_COLUMNS)
+
+
+def ingest_parquet_file(
+    file: UploadFile,
+    batch_size: int = BATCH_SIZE,
+    on_conflict: str = "error",
+    strict_devices: bool = False,
+):
+    """
+    Parquet ingestion.
+    Streams row-group batches straight into energy_events via COPY.
+    Rows failing validation are written to ingestion_rejects.
+    """
+    _require_pyarrow()
+
+    try:
+        import pyarrow.parquet as pq
+
+        fingerprint, skipped = check_duplicate_upload(file.file)
+        if skipped:
+            return skipped
+
+        parquet_file = pq.ParquetFile(file.file)
+        _check_schema(parquet_file.schema_arrow.names)
+
+        return load_event_batches(
+            parquet_file.iter_batches(
+                batch_size=batch_size,
+                columns=sorted(REQUIRED_COLUMNS),
+            ),
+            _copy_record_batch,
+            file_name=file.filename,
+            event_type="PARQUET_INGEST",
+            mode="parquet",
+            fingerprint=fingerprint,
+            on_conflict=on_conflict,
+            validate=record_batch_validator(strict_devices),
+        )
+
+    except IntegrityError as e:
+        raise conflict_error(e)
+
+    except Exception as e:
+        logger.exception("Parquet ingestion failed")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Ingestion failed: {str(e)}",
+        )
+
+
+def ingest_arrow_stream(file: UploadFile, on_conflict: str = "error",
+                        strict_devices: bool = False):
+    """
+    Arrow IPC stream ingestion.
+    Record batches are validated and loaded as they are read off the stream.
+    """
+    _require_pyarrow()
+
+    try:
+        import pyarrow as pa
+
+        fingerprint, skipped = check_duplicate_upload(file.file)
+        if skipped:
+            return skipped
+
+        reader = pa.ipc.open_stream(file.file)
+        _check_schema(reader.schema.names)
+
+        return load_event_batches(
+            reader,
+            _copy_record_batch,
+            file_name=file.filename,
+            event_type="ARROW_INGEST",
+            mode="arrow_ipc",
+            fingerprint=fingerprint,
+            on_conflict=on_conflict,
+            validate=record_batch_validator(strict_devices),
+        )
+
+    except IntegrityError as e:
+        raise conflict_error(e)
+
+    except Exception as e:
+        logger.exception("Arrow IPC ingestion failed")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Ingestion failed: {str(e)}",
+        )
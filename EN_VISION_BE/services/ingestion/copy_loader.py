@@ -0,0 +1,84 @@
+import io
+from datetime import datetime
+
+import pandas as pd
+
+
+EVENT_COLUMNS = [
+    "timestamp",
+    "device_id",
+    "department_id",
+    "device_key",
+    "department_key",
+    "kwh",
+    "source_type",
+    "ingestion_batch_id",
+    "created_at",
+]
+
+
+def copy_frame(conn, df: pd.DataFrame, table: str, columns: list) -> int:
+    """
+    Bulk-load a DataFrame into `table` with PostgreSQL COPY FROM STDIN.
+    Runs on the caller's connection so it joins the open transaction.
+    """
+
+    if df.empty:
+        return 0
+
+    buffer = io.StringIO()
+    df.reindex(columns=columns).to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+
+    cursor = conn.connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+            buffer,
+        )
+    finally:
+        cursor.close()
+
+    return len(df)
+
+
+def copy_arrow(conn, table, target: str, columns: list) -> int:
+    """
+    COPY an Arrow table/record batch. Serialised by Arrow's C++ CSV
+    writer, so rows never become Python objects.
+    """
+    import pyarrow.csv as pa_csv
+
+    if table.num_rows == 0:
+        return 0
+
+    buffer = io.BytesIO()
+    pa_csv.write_csv(
+        table.select(columns),
+        buffer,
+        write_options=pa_csv.WriteOptions(include_header=False),
+    )
+    buffer.seek(0)
+
+    cursor = conn.connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {target} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+            buffer,
+        )
+    finally:
+        cursor.close()
+
+    return table.num_rows
+
+
+def copy_events(conn, df: pd.DataFrame, table: str = "energy_events") -> int:
+    """
+    COPY one chunk of raw readings into energy_events (or its staging table).
+    created_at is stamped here because COPY skips the ORM-side default.
+    """
+
+    chunk = df.copy()
+    chunk["created_at"] = datetime.utcnow()
+
+    return copy_frame(conn, chunk, table, EVENT_COLUMNS)
@@ -0,0 +1,79 @@
+import gzip
+from typing import Optional
+
+GZIP = "gzip"
+ZSTD = "zstd"
+
+_MAGIC = {
+    GZIP: b"\x1f\x8b",
+    ZSTD: b"\x28\xb5\x2f\xfd",
+}
+
+_SUFFIXES = {
+    ".gz": GZIP,
+    ".gzip": GZIP,
+    ".zst": ZSTD,
+    ".zstd": ZSTD,
+}
+
+_HEADER_VALUES = {
+    "gzip": GZIP,
+    "x-gzip": GZIP,
+    "zstd": ZSTD,
+}
+
+
+class UnsupportedEncoding(ValueError):
+    pass
+
+
+def detect_encoding(fileobj, file_name: Optional[str] = None, content_encoding: Optional[str] = None):
+    """
+    Work out how an upload is compressed: explicit Content-Encoding
+    first, then the file suffix, then the magic bytes.
+    Returns GZIP, ZSTD or None (plain). Leaves the file rewound.
+    """
+
+    if content_encoding:
+        value = content_encoding.strip().lower()
+        if value not in ("", "identity"):
+            if value not in _HEADER_VALUES:
+                raise UnsupportedEncoding(f"Unsupported Content-Encoding: {content_encoding}")
+            return _HEADER_VALUES[value]
+
+    if file_name:
+        lowered = file_name.lower()
+        for suffix, encoding in _SUFFIXES.items():
+            if lowered.endswith(suffix):
+                return encoding
+
+    head = fileobj.read(4)
+    fileobj.seek(0)
+    for encoding, magic in _MAGIC.items():
+        if head.startswith(magic):
+            return encoding
+
+    return None
+
+
+def open_decompressed(fileobj, encoding: Optional[str]):
+    """
+    Wrap an upload in an incremental decompressor. The result is a
+    file-like object the chunked CSV reader pulls from, so only a
+    window of the decompressed data is ever in memory.
+    """
+
+    if encoding is None:
+        return fileobj
+
+    if encoding == GZIP:
+        return gzip.GzipFile(fileobj=fileobj, mode="rb")
+
+    if encoding == ZSTD:
+        try:
+            import zstandard
+        except ImportError:
+            raise UnsupportedEncoding("zstd uploads require the zstandard package")
+        return zstandard.ZstdDecompressor().stream_reader(fileobj)
+
+    raise UnsupportedEncoding(f"Unsupported encoding: {encoding}")
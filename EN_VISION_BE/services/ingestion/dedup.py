@@ -0,0 +1,122 @@
+import hashlib
+
+from sqlalchemy import text
+
+from services.ingestion.copy_loader import EVENT_COLUMNS
+from services.analytics.windows import record_moved_keys
+
+STAGING_TABLE = "energy_events_staging"
+
+# How a batch treats rows whose (timestamp, device_id) already exists
+ON_CONFLICT_MODES = ("error", "skip", "update")
+
+_HASH_BLOCK = 1024 * 1024
+
+
+def fingerprint_upload(fileobj) -> str:
+    """
+    sha256 of the raw upload bytes. Rewinds the file afterwards so the
+    loader can read it from the start.
+    """
+    digest = hashlib.sha256()
+    for block in iter(lambda: fileobj.read(_HASH_BLOCK), b""):
+        digest.update(block)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+
+def find_ingested_file(conn, fingerprint: str):
+    """
+    Primary-key lookup of a previously ingested upload (None if new).
+    """
+    return conn.execute(
+        text("""
+            SELECT batch_id, file_name, rows_ingested, created_at
+            FROM ingestion_files
+            WHERE fingerprint = :fingerprint
+        """),
+        {"fingerprint": fingerprint},
+    ).fetchone()
+
+
+def record_ingested_file(conn, fingerprint: str, file_name: str, batch_id: str, rows: int):
+    conn.execute(
+        text("""
+            INSERT INTO ingestion_files (
+                fingerprint,
+                file_name,
+                batch_id,
+                rows_ingested,
+                created_at
+            )
+            VALUES (
+                :fingerprint,
+                :file_name,
+                :batch_id,
+                :rows_ingested,
+                CURRENT_TIMESTAMP
+            )
+        """),
+        {
+            "fingerprint": fingerprint,
+            "file_name": file_name,
+            "batch_id": batch_id,
+            "rows_ingested": rows,
+        },
+    )
+
+
+def prepare_staging(conn):
+    """
+    Session-local staging table for dedup loads. Batches are COPYed here
+    first, then merged into energy_events with ON CONFLICT.
+    """
+    conn.execute(text(f"""
+        CREATE TEMP TABLE IF NOT EXISTS {STAGING_TABLE}
+        ON COMMIT DELETE ROWS
+        AS SELECT {", ".join(f'"{c}"' for c in EVENT_COLUMNS)}
+        FROM energy_events
+        WITH NO DATA
+    """))
+
+
+def merge_staged_events(conn, on_conflict: str) -> int:
+    """
+    Move staged rows into energy_events keyed on (timestamp, device_id)
+    and empty the staging table. Returns the number of rows written.
+    Duplicates inside the batch collapse to one row first, since
+    ON CONFLICT cannot touch the same target row twice. In update mode
+    the windows of rows changing department are recorded first (see
+    record_moved_keys).
+    """
+    columns = ", ".join(f'"{c}"' for c in EVENT_COLUMNS)
+
+    if on_conflict == "skip":
+        conflict_clause = "DO NOTHING"
+    elif on_conflict == "update":
+        conflict_clause = """
+            DO UPDATE SET
+                kwh = EXCLUDED.kwh,
+                department_id = EXCLUDED.department_id,
+                department_key = EXCLUDED.department_key,
+                source_type = EXCLUDED.source_type,
+                ingestion_batch_id = EXCLUDED.ingestion_batch_id,
+                created_at = EXCLUDED.created_at
+            WHERE energy_events.kwh IS DISTINCT FROM EXCLUDED.kwh
+               OR energy_events.department_id IS DISTINCT FROM EXCLUDED.department_id
+        """
+        record_moved_keys(conn, STAGING_TABLE)
+    else:
+        raise ValueError(f"Unsupported on_conflict mode: {on_conflict}")
+
+    result = conn.execute(text(f"""
+        INSERT INTO energy_events ({columns})
+        SELECT DISTINCT ON ("timestamp", device_id) {columns}
+        FROM {STAGING_TABLE}
+        ORDER BY "timestamp", device_id
+        ON CONFLICT ("timestamp", device_id) {conflict_clause}
+    """))
+
+    conn.execute(text(f"TRUNCATE {STAGING_TABLE}"))
+
+    return result.rowcount
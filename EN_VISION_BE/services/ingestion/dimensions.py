@@ -0,0 +1,248 @@
+import threading
+
+import pandas as pd
+from sqlalchemy import text
+
+# dimension table -> (string id column, fact-table key column)
+DIMENSIONS = {
+    "devices": ("device_id", "device_key"),
+    "departments": ("department_id", "department_key"),
+}
+
+# Tables carrying department_key / device_key next to the string ids
+FACT_TABLES = (
+    "energy_events",
+    "ingestion_batch_keys",
+    "daily_energy_summary",
+    "daily_summary_changes",
+    "baseline_metrics",
+    "baseline_windows",
+    "deviation_baselines",
+    "energy_deviations",
+    "energy_anomalies",
+    "energy_forecasts",
+)
+
+# Indexes on the keys, and the string-id indexes they replace
+KEY_INDEXES = (
+    ("ix_energy_events_device_key_timestamp",
+     "CREATE INDEX IF NOT EXISTS {name} ON energy_events (device_key, \"timestamp\")",
+     None),
+    ("uq_daily_energy_summary_keys",
+     "CREATE UNIQUE INDEX IF NOT EXISTS {name} "
+     "ON daily_energy_summary (date, department_key, device_key)",
+     "uq_daily_energy_summary_key"),
+    ("uq_baseline_metrics_keys",
+     "CREATE UNIQUE INDEX IF NOT EXISTS {name} "
+     "ON baseline_metrics (department_key, device_key)",
+     "uq_baseline_metrics_device"),
+    ("uq_baseline_windows_keys",
+     "CREATE UNIQUE INDEX IF NOT EXISTS {name} "
+     "ON baseline_windows (department_key, device_key, window_days)",
+     "uq_baseline_windows_device"),
+    ("uq_deviation_baselines_keys",
+     "CREATE UNIQUE INDEX IF NOT EXISTS {name} "
+     "ON deviation_baselines (department_key, device_key)",
+     None),
+)
+
+
+class DimensionCache:
+    """
+    Process-wide map from string ids to devices / departments surrogate
+    keys, so a warm ingest resolves a chunk's ids without a query.
+
+    Only keys of rows other transactions have committed are cached. Ids
+    an ingest registers itself are looked up in its own transaction and
+    kept by that load's DimensionKeys, so a rolled-back upload never
+    leaves a key in the cache that points at no row.
+    """
+
+    def __init__(self):
+        self._keys = {table: {} for table in DIMENSIONS}
+        self._lock = threading.Lock()
+
+    def lookup(self, table: str, ids) -> dict:
+        keys = self._keys[table]
+        with self._lock:
+            return {i: keys[i] for i in ids if i in keys}
+
+    def remember(self, table: str, keys: dict):
+        with self._lock:
+            self._keys[table].update(keys)
+
+    def clear(self):
+        with self._lock:
+            for keys in self._keys.values():
+                keys.clear()
+
+    def for_load(self, conn) -> "DimensionKeys":
+        return DimensionKeys(self, conn)
+
+
+dimension_cache = DimensionCache()
+
+
+class DimensionKeys:
+    """
+    Key resolution for one ingest transaction. Misses are registered on
+    `conn`, so dimension rows commit (or roll back) with the facts that
+    reference them and the registry only knows ids with committed rows.
+    """
+
+    def __init__(self, cache: DimensionCache, conn):
+        self.cache = cache
+        self.conn = conn
+        # Ids this transaction inserted; not shareable until it commits
+        self._created = {table: {} for table in DIMENSIONS}
+
+    def resolve(self, table: str, ids) -> dict:
+        """
+        {string id: key} for every id in `ids`, registering new ones.
+        """
+        wanted = {i for i in ids if i is not None}
+        created = self._created[table]
+
+        keys = {i: created[i] for i in wanted if i in created}
+        keys.update(self.cache.lookup(table, wanted - keys.keys()))
+
+        missing = sorted(wanted - keys.keys())
+        if missing:
+            column, _ = DIMENSIONS[table]
+
+            # Sorted, so concurrent loads take the unique-index locks in
+            # the same order. A concurrent insert of the same id makes
+            # this wait, then see that row once it commits.
+            new = dict(
+                (row[1], row[0])
+                for row in self.conn.execute(
+                    text(f"""
+                        INSERT INTO {table} ({column}, created_at)
+                        SELECT UNNEST(CAST(:ids AS text[])), CURRENT_TIMESTAMP
+                        ORDER BY 1
+                        ON CONFLICT ({column}) DO NOTHING
+                        RETURNING id, {column}
+                    """),
+                    {"ids": missing},
+                )
+            )
+            created.update(new)
+            keys.update(new)
+
+            existing = [i for i in missing if i not in new]
+            if existing:
+                committed = dict(
+                    (row[1], row[0])
+                    for row in self.conn.execute(
+                        text(f"SELECT id, {column} FROM {table} WHERE {column} = ANY(:ids)"),
+                        {"ids": existing},
+                    )
+                )
+                self.cache.remember(table, committed)
+                keys.update(committed)
+
+        return keys
+
+    def add_to_frame(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Add device_key / department_key columns to a chunk of readings:
+        one lookup per distinct id, then a vectorised map.
+        """
+        df = df.copy()
+        for table, (column, key_column) in DIMENSIONS.items():
+            keys = self.resolve(table, df[column].dropna().unique())
+            df[key_column] = df[column].map(keys).astype("Int64")
+        return df
+
+    def add_to_record_batch(self, batch):
+        """
+        Arrow counterpart of add_to_frame, using compute kernels.
+        """
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        columns, names = list(batch.columns), list(batch.schema.names)
+        for table, (column, key_column) in DIMENSIONS.items():
+            values = batch.column(names.index(column))
+            ids = pc.unique(values).drop_null().to_pylist()
+            keys = self.resolve(table, ids)
+
+            positions = pc.index_in(values, value_set=pa.array(ids, values.type))
+            columns.append(pc.take(pa.array([keys[i] for i in ids], pa.int32()), positions))
+            names.append(key_column)
+
+        return pa.RecordBatch.from_arrays(columns, names=names)
+
+    def add_keys(self, batch):
+        """
+        Keys for a validated ingestion batch, a DataFrame or an Arrow
+        record batch.
+        """
+        if isinstance(batch, pd.DataFrame):
+            return self.add_to_frame(batch)
+        return self.add_to_record_batch(batch)
+
+
+def sync_dimensions(conn) -> dict:
+    """
+    Upgrade step, safe to rerun: add the key columns to FACT_TABLES,
+    register every device and department in energy_events, fill NULL
+    keys from the string ids and move the unique indexes onto the keys.
+    energy_events.device_key / department_key are made NOT NULL at the
+    end, so a writer that skips key resolution fails instead of leaving
+    rows the analytics would group together. Returns rows keyed per
+    table.
+    """
+    for fact in FACT_TABLES:
+        conn.execute(text(f"""
+            ALTER TABLE {fact}
+                ADD COLUMN IF NOT EXISTS department_key integer,
+                ADD COLUMN IF NOT EXISTS device_key integer
+        """))
+
+    for table, (column, _) in DIMENSIONS.items():
+        conn.execute(text(f"""
+            INSERT INTO {table} ({column}, created_at)
+            SELECT DISTINCT {column}, CURRENT_TIMESTAMP
+            FROM energy_events
+            ORDER BY 1
+            ON CONFLICT ({column}) DO NOTHING
+        """))
+
+    keyed = {}
+    for fact in FACT_TABLES:
+        keyed[fact] = conn.execute(text(f"""
+            UPDATE {fact} f
+            SET
+                device_key = dv.id,
+                department_key = dp.id
+            FROM devices dv, departments dp
+            WHERE dv.device_id = f.device_id
+              AND dp.department_id = f.department_id
+              AND (f.device_key IS NULL OR f.department_key IS NULL)
+        """)).rowcount
+
+    for name, create, replaces in KEY_INDEXES:
+        conn.execute(text(create.format(name=name)))
+        if replaces:
+            conn.execute(text(f"DROP INDEX IF EXISTS {replaces}"))
+
+    conn.execute(text("""
+        ALTER TABLE energy_events
+            ALTER COLUMN device_key SET NOT NULL,
+            ALTER COLUMN department_key SET NOT NULL
+    """))
+
+    return keyed
+
+
+def id_joins(alias: str) -> str:
+    """
+    JOINs exposing dp.department_id and dv.device_id for the keys of
+    `alias`, so a query grouped on the keys can still return the ids
+    the API speaks.
+    """
+    return f"""
+        JOIN departments dp ON dp.id = {alias}.department_key
+        JOIN devices dv ON dv.id = {alias}.device_key
+    """
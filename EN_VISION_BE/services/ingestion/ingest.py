@@ -1,13 +1,143 @@
-from fastapi import APIRouter, UploadFile, File
-from services.ingestion.service import ingest_csv_file
+from typing import Literal, Optional
+
+from fastapi import APIRouter, UploadFile, File, HTTPException, Request, Query, Header
+from starlette.concurrency import run_in_threadpool
+
+from services.ingestion.admission import ingestion_admission
+from services.ingestion.service import ingest_csv_file, ingest_csv_stream
+from services.ingestion.columnar import ingest_parquet_file, ingest_arrow_stream
+from services.ingestion.decompress import UnsupportedEncoding, detect_encoding
+from services.ingestion.stream import ingest_ndjson_stream
+from services.ingestion.buffer import reading_buffer
+from services.ingestion.schemas import StreamIngestResponse
+from services.jobs.queue import analytics_queue
 
 router = APIRouter(prefix="/ingest", tags=["Ingestion"])
 
+# Row-level dedup on (timestamp, device_id); see services/ingestion/dedup.py
+OnConflict = Literal["error", "skip", "update"]
+
+
+def _upload_encoding(file: UploadFile, content_encoding: Optional[str]):
+    # The part's own Content-Encoding wins over the request header
+    part_encoding = file.headers.get("content-encoding") if file.headers else None
+    try:
+        return detect_encoding(file.file, file.filename, part_encoding or content_encoding)
+    except UnsupportedEncoding as e:
+        raise HTTPException(status_code=415, detail=str(e))
+
 
 @router.post("/csv")
-async def ingest_csv(file: UploadFile = File(...)):
+async def ingest_csv(
+    file: UploadFile = File(...),
+    on_conflict: OnConflict = Query("skip"),
+    strict_devices: bool = Query(False),
+    content_encoding: Optional[str] = Header(None),
+):
     """
     CSV ingestion endpoint.
     Delegates processing to service layer.
+    Compressed uploads (.csv.gz / .csv.zst / Content-Encoding) always
+    take the chunked loader so they are never inflated in memory.
+    Overlapping exports skip rows already stored by default.
+    """
+    encoding = _upload_encoding(file, content_encoding)
+
+    # Off the event loop, so admitted uploads really run side by side
+    if encoding:
+        return await run_in_threadpool(
+            ingest_csv_stream,
+            file,
+            on_conflict=on_conflict,
+            strict_devices=strict_devices,
+            content_encoding=encoding,
+        )
+
+    return await run_in_threadpool(
+        ingest_csv_file,
+        file,
+        on_conflict=on_conflict,
+        strict_devices=strict_devices,
+    )
+
+
+@router.post("/csv/stream")
+def ingest_csv_streaming(
+    file: UploadFile = File(...),
+    on_conflict: OnConflict = Query("error"),
+    strict_devices: bool = Query(False),
+    content_encoding: Optional[str] = Header(None),
+):
+    """
+    Chunked CSV ingestion via COPY (bounded memory).
+    Accepts plain, gzip and zstd uploads.
+    Rows failing validation are written to ingestion_rejects.
+    Sync handler so FastAPI runs it in the threadpool.
+    """
+    return ingest_csv_stream(
+        file,
+        on_conflict=on_conflict,
+        strict_devices=strict_devices,
+        content_encoding=_upload_encoding(file, content_encoding),
+    )
+
+
+@router.post("/parquet")
+def ingest_parquet(
+    file: UploadFile = File(...),
+    on_conflict: OnConflict = Query("error"),
+    strict_devices: bool = Query(False),
+):
+    """
+    Parquet ingestion endpoint (row-group batches, bulk COPY).
+    """
+    return ingest_parquet_file(file, on_conflict=on_conflict, strict_devices=strict_devices)
+
+
+@router.post("/arrow")
+def ingest_arrow(
+    file: UploadFile = File(...),
+    on_conflict: OnConflict = Query("error"),
+    strict_devices: bool = Query(False),
+):
+    """
+    Arrow IPC stream ingestion endpoint.
+    """
+    return ingest_arrow_stream(file, on_conflict=on_conflict, strict_devices=strict_devices)
+
+
+@router.post("/stream", response_model=StreamIngestResponse)
+async def ingest_stream(request: Request):
+    """
+    NDJSON / IoT streaming ingestion endpoint.
+    One reading per line; readings are micro-batched before COPY.
+    """
+    return await ingest_ndjson_stream(request)
+
+
+@router.get("/stream/stats")
+def ingest_stream_stats():
+    """
+    Current state of the streaming micro-batch buffer.
+    """
+    return reading_buffer.stats()
+
+
+@router.get("/admission")
+def ingest_admission_stats():
+    """
+    Live admission-control state (active uploads, bytes, queue depth)
+    for tuning the limits in services/ingestion/admission.py.
+    """
+    return ingestion_admission.stats()
+
+
+@router.get("/jobs/{job_id}")
+def get_ingestion_job(job_id: str):
+    """
+    Status and per-stage timings of a background analytics job.
     """
-    return ingest_csv_file(file)
+    job = analytics_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
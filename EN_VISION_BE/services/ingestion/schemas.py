@@ -0,0 +1,97 @@
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from pydantic import BaseModel, Field
+
+
+STREAM_FIELDS = (
+    "timestamp",
+    "device_id",
+    "department_id",
+    "kwh",
+    "source_type",
+)
+
+DEFAULT_SOURCE_TYPE = "iot"
+
+
+class EnergyReading(BaseModel):
+    timestamp: datetime
+    device_id: str
+    department_id: str
+    kwh: float = Field(..., ge=0)
+    source_type: Optional[str] = DEFAULT_SOURCE_TYPE
+
+
+class RejectedLine(BaseModel):
+    line: int
+    error: str
+
+
+class StreamIngestResponse(BaseModel):
+    status: str = "success"
+    accepted: int
+    rejected: int
+    errors: List[RejectedLine]
+    buffered: int
+
+
+def _parse_timestamp(value) -> datetime:
+    if isinstance(value, str):
+        ts = datetime.fromisoformat(value)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        # Epoch seconds
+        ts = datetime.fromtimestamp(value, tz=timezone.utc)
+    else:
+        raise ValueError("timestamp must be an ISO string or epoch seconds")
+
+    # energy_events.timestamp is naive UTC
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts
+
+
+def parse_reading(obj) -> tuple:
+    """
+    Validate one decoded NDJSON object against EnergyReading and return
+    a row tuple in STREAM_FIELDS order.
+
+    Hand-rolled instead of EnergyReading(**obj) because the streaming
+    endpoint validates tens of thousands of readings per second and
+    model construction dominates at that rate. Keep the two in sync.
+    """
+    if not isinstance(obj, dict):
+        raise ValueError("reading must be a JSON object")
+
+    try:
+        timestamp = obj["timestamp"]
+        device_id = obj["device_id"]
+        department_id = obj["department_id"]
+        kwh = obj["kwh"]
+    except KeyError as e:
+        raise ValueError(f"missing field {e.args[0]}")
+
+    if not isinstance(device_id, str) or not device_id.strip():
+        raise ValueError("device_id must be a non-empty string")
+    if not isinstance(department_id, str) or not department_id.strip():
+        raise ValueError("department_id must be a non-empty string")
+
+    if isinstance(kwh, bool) or not isinstance(kwh, (int, float)):
+        raise ValueError("kwh must be numeric")
+    kwh = float(kwh)
+    if kwh != kwh or kwh in (float("inf"), float("-inf")):
+        raise ValueError("kwh must be finite")
+    if kwh < 0:
+        raise ValueError("kwh must not be negative")
+
+    source_type = obj.get("source_type") or DEFAULT_SOURCE_TYPE
+    if not isinstance(source_type, str):
+        raise ValueError("source_type must be a string")
+
+    return (
+        _parse_timestamp(timestamp),
+        device_id,
+        department_id,
+        kwh,
+        source_type,
+    )
@@ -0,0 +1,88 @@
+import json
+
+from fastapi import Request, HTTPException
+from starlette.concurrency import run_in_threadpool
+
+from services.ingestion.buffer import reading_buffer, BufferFull
+from services.ingestion.schemas import parse_reading
+
+# Validated readings handed to the buffer per call
+HANDOFF_ROWS = 5_000
+# Cap on per-line errors echoed back to the client
+MAX_REPORTED_ERRORS = 100
+
+
+async def ingest_ndjson_stream(request: Request):
+    """
+    NDJSON ingestion.
+    Parses the body line by line as it arrives (works for plain bodies
+    and long-lived chunked uploads) and hands validated readings to the
+    micro-batch buffer. Invalid lines are skipped and reported.
+    Responds 503 when the buffer is full (writes are failing); readings
+    handed over before that were accepted and are counted in the detail.
+    """
+
+    accepted = 0
+    rejected = 0
+    errors = []
+    rows = []
+    line_no = 0
+    tail = b""
+    handed_over = 0
+
+    async def hand_over(batch):
+        nonlocal handed_over
+        try:
+            await run_in_threadpool(reading_buffer.add, batch)
+        except BufferFull as e:
+            raise HTTPException(
+                status_code=503,
+                detail={
+                    "error": f"Stream buffer full: {e}",
+                    "accepted": handed_over,
+                },
+                headers={"Retry-After": "5"},
+            )
+        handed_over += len(batch)
+
+    def handle(raw: bytes):
+        nonlocal accepted, rejected, line_no
+        line_no += 1
+
+        raw = raw.strip()
+        if not raw:
+            return
+
+        try:
+            rows.append(parse_reading(json.loads(raw)))
+            accepted += 1
+        except (ValueError, TypeError, OverflowError, OSError) as e:
+            rejected += 1
+            if len(errors) < MAX_REPORTED_ERRORS:
+                errors.append({"line": line_no, "error": str(e)})
+
+    async for chunk in request.stream():
+        lines = (tail + chunk).split(b"\n")
+        tail = lines.pop()
+
+        for raw in lines:
+            handle(raw)
+
+        if len(rows) >= HANDOFF_ROWS:
+            # Buffer may flush to the DB inline; keep it off the event loop
+            await hand_over(rows)
+            rows = []
+
+    if tail:
+        handle(tail)
+
+    if rows:
+        await hand_over(rows)
+
+    return {
+        "status": "success",
+        "accepted": accepted,
+        "rejected": rejected,
+        "errors": errors,
+        "buffered": reading_buffer.pending(),
+    }
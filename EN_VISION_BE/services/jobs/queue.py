@@ -0,0 +1,167 @@
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+MAX_TRACKED_JOBS = 1000
+
+
+class AnalyticsJob:
+    """
+    One enqueue request. Several jobs can share a single pipeline run
+    when they are queued while that run has not started yet.
+    """
+
+    def __init__(self, batch_id: str, run_id: str):
+        self.job_id = str(uuid.uuid4())
+        self.batch_id = batch_id
+        self.run_id = run_id
+        self.status = "queued"
+        self.coalesced_batches = [batch_id]
+        self.stage_timings = {}
+        # Non-core stages (forecasting, carbon) that failed in a run
+        # that otherwise succeeded
+        self.stage_errors = {}
+        self.error = None
+        self.created_at = datetime.utcnow()
+        self.started_at = None
+        self.finished_at = None
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id,
+            "batch_id": self.batch_id,
+            "run_id": self.run_id,
+            "status": self.status,
+            "coalesced_batches": list(self.coalesced_batches),
+            "stage_timings": dict(self.stage_timings),
+            "stage_errors": dict(self.stage_errors),
+            "error": self.error,
+            "created_at": self.created_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class AnalyticsJobQueue:
+    """
+    In-process queue for the post-ingest analytics pipeline.
+
+    At most one run is pending at a time: every job enqueued before that
+    run starts joins it, so a burst of uploads costs a single rebuild.
+    Runs are serialised on one worker thread because each stage rebuilds
+    whole tables (and across processes by the pipeline's advisory lock).
+
+    Job state lives in this process only: /ingest/jobs/{id} answers for
+    jobs enqueued by the same process since it started, so it 404s after
+    a restart and, with several uvicorn workers, on any worker but the
+    one that took the upload. Run the API as a single process when
+    clients poll job status.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix="analytics",
+        )
+        self._jobs = OrderedDict()
+        self._pending_run_id = None
+        self._pending_submitted = False
+        self._pending_jobs = []
+        self._paused = False
+
+    def enqueue(self, batch_id: str) -> AnalyticsJob:
+        with self._lock:
+            if self._pending_run_id is None:
+                self._pending_run_id = str(uuid.uuid4())
+
+            job = AnalyticsJob(batch_id, self._pending_run_id)
+            self._pending_jobs.append(job)
+            self._remember(job)
+
+            self._submit_pending()
+
+        return job
+
+    def pause(self):
+        """
+        Hold new runs: jobs keep queuing (and coalescing) but nothing
+        starts until resume(). A run already started is not interrupted.
+        """
+        with self._lock:
+            self._paused = True
+
+    def resume(self):
+        with self._lock:
+            self._paused = False
+            self._submit_pending()
+
+    def _submit_pending(self):
+        # Caller holds self._lock
+        if self._paused or self._pending_run_id is None or self._pending_submitted:
+            return
+        self._pending_submitted = True
+        self._executor.submit(self._run, self._pending_run_id)
+
+    def get(self, job_id: str):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return job.to_dict() if job else None
+
+    def _remember(self, job: AnalyticsJob):
+        self._jobs[job.job_id] = job
+        while len(self._jobs) > MAX_TRACKED_JOBS:
+            self._jobs.popitem(last=False)
+
+    def _run(self, run_id: str):
+        from services.analytics.pipeline import run_analytics_pipeline
+
+        # Claim the pending run; later enqueues start a new one
+        with self._lock:
+            jobs = self._pending_jobs
+            self._pending_jobs = []
+            self._pending_run_id = None
+            self._pending_submitted = False
+
+            batch_ids = [job.batch_id for job in jobs]
+            started_at = datetime.utcnow()
+            for job in jobs:
+                job.status = "running"
+                job.started_at = started_at
+                job.coalesced_batches = batch_ids
+
+        def on_stage_complete(name, seconds):
+            with self._lock:
+                for job in jobs:
+                    job.stage_timings[name] = seconds
+
+        def on_stage_failed(name, error):
+            with self._lock:
+                for job in jobs:
+                    job.stage_errors[name] = error
+
+        try:
+            run_analytics_pipeline(
+                batch_ids=batch_ids,
+                on_stage_complete=on_stage_complete,
+                on_stage_failed=on_stage_failed,
+            )
+            status, error = "succeeded", None
+        except Exception as e:
+            logger.exception(f"Analytics run {run_id} failed")
+            status, error = "failed", str(e)
+
+        with self._lock:
+            finished_at = datetime.utcnow()
+            for job in jobs:
+                job.status = status
+                job.error = error
+                job.finished_at = finished_at
+
+
+analytics_queue = AnalyticsJobQueue()
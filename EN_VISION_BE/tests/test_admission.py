@@ -0,0 +1,205 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI, HTTPException, Request, UploadFile, File
+from fastapi.testclient import TestClient
+
+from services.ingestion.admission import AdmissionController, AdmissionMiddleware
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_requests_within_limits_are_admitted_immediately():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=2, max_bytes=100)
+        await controller.acquire(40)
+        await controller.acquire(60)
+        stats = controller.stats()
+        await controller.release(40)
+        await controller.release(60)
+        return stats, controller.stats()
+
+    during, after = run(scenario())
+
+    assert during["active"] == 2
+    assert during["bytes_in_flight"] == 100
+    assert after["active"] == 0
+    assert after["bytes_in_flight"] == 0
+    assert after["admitted_total"] == 2
+
+
+def test_oversized_upload_runs_alone():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=4, max_bytes=100)
+        await controller.acquire(500)
+        return controller.stats()
+
+    assert run(scenario())["active"] == 1
+
+
+def test_queued_request_is_admitted_when_a_slot_frees():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=1, queue_timeout=5)
+        await controller.acquire(10)
+
+        waiter = asyncio.create_task(controller.acquire(10))
+        await asyncio.sleep(0)
+        queued = controller.stats()["queue_depth"]
+
+        await controller.release(10)
+        await asyncio.wait_for(waiter, timeout=1)
+        return queued, controller.stats()
+
+    queued, stats = run(scenario())
+
+    assert queued == 1
+    assert stats["active"] == 1
+    assert stats["queue_depth"] == 0
+
+
+def test_byte_budget_holds_back_requests():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=4, max_bytes=100, queue_timeout=5)
+        await controller.acquire(80)
+
+        waiter = asyncio.create_task(controller.acquire(30))
+        await asyncio.sleep(0)
+        admitted_early = waiter.done()
+
+        await controller.release(80)
+        await asyncio.wait_for(waiter, timeout=1)
+        return admitted_early
+
+    assert run(scenario()) is False
+
+
+def test_full_queue_rejects_with_retry_after():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=1, max_queued=1, retry_after=7)
+        await controller.acquire(1)
+        waiter = asyncio.create_task(controller.acquire(1))
+        await asyncio.sleep(0)
+
+        try:
+            with pytest.raises(HTTPException) as info:
+                await controller.acquire(1)
+            return info.value, controller.stats()
+        finally:
+            waiter.cancel()
+
+    error, stats = run(scenario())
+
+    assert error.status_code == 429
+    assert "queue full" in error.detail
+    assert error.headers == {"Retry-After": "7"}
+    assert stats["rejected_total"] == 1
+
+
+def test_queue_timeout_rejects_and_leaves_the_queue():
+    async def scenario():
+        controller = AdmissionController(max_concurrent=1, queue_timeout=0.05)
+        await controller.acquire(1)
+
+        with pytest.raises(HTTPException) as info:
+            await controller.acquire(1)
+        return info.value, controller.stats()
+
+    error, stats = run(scenario())
+
+    assert error.status_code == 429
+    assert "timed out" in error.detail
+    assert stats["queue_depth"] == 0
+    assert stats["active"] == 1
+
+
+@pytest.fixture
+def upload_client():
+    api = FastAPI()
+
+    @api.post("/ingest/csv/stream")
+    async def receive_body(request: Request):
+        return {"bytes": len(await request.body())}
+
+    @api.post("/ingest/csv")
+    async def receive_file(file: UploadFile = File(...)):
+        return {"bytes": len(await file.read())}
+
+    controller = AdmissionController()
+    api.add_middleware(AdmissionMiddleware, controller=controller, max_upload_bytes=1000)
+    with TestClient(api) as client:
+        yield client, controller
+
+
+def chunks(total, size=100):
+    for start in range(0, total, size):
+        yield b"x" * min(size, total - start)
+
+
+def test_middleware_admits_sized_uploads(upload_client):
+    client, controller = upload_client
+
+    response = client.post("/ingest/csv/stream", content=b"x" * 500)
+
+    assert response.status_code == 200
+    assert response.json() == {"bytes": 500}
+    assert controller.stats()["active"] == 0
+
+
+def test_middleware_rejects_declared_oversize_uploads(upload_client):
+    client, controller = upload_client
+
+    response = client.post("/ingest/csv/stream", content=b"x" * 1001)
+
+    assert response.status_code == 413
+    assert controller.stats()["admitted_total"] == 0
+
+
+def test_middleware_admits_chunked_uploads(upload_client):
+    client, controller = upload_client
+
+    response = client.post("/ingest/csv/stream", content=chunks(900))
+
+    assert response.status_code == 200
+    assert response.json() == {"bytes": 900}
+    assert controller.stats()["bytes_in_flight"] == 0
+
+
+def test_middleware_cuts_off_chunked_uploads_past_the_limit(upload_client):
+    client, controller = upload_client
+
+    response = client.post("/ingest/csv/stream", content=chunks(5000))
+
+    assert response.status_code == 413
+    assert controller.stats()["active"] == 0
+
+
+def test_middleware_answers_413_when_the_app_handles_the_cutoff(upload_client):
+    # Multipart parsing turns receive errors into FastAPI's own 400
+    client, _ = upload_client
+    body = (
+        b"--b\r\nContent-Disposition: form-data; name=\"file\"; filename=\"a.csv\"\r\n\r\n"
+        + b"x" * 5000 + b"\r\n--b--\r\n"
+    )
+
+    def parts():
+        for start in range(0, len(body), 100):
+            yield body[start:start + 100]
+
+    response = client.post(
+        "/ingest/csv",
+        content=parts(),
+        headers={"Content-Type": "multipart/form-data; boundary=b"},
+    )
+
+    assert response.status_code == 413
+
+
+def test_middleware_ignores_other_paths(upload_client):
+    client, controller = upload_client
+
+    response = client.post("/ingest/other", content=b"x" * 5000)
+
+    assert response.status_code == 404
+    assert controller.stats()["admitted_total"] == 0
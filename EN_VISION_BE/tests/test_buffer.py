@@ -0,0 +1,118 @@
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from services.ingestion import buffer
+from services.ingestion.buffer import BufferFull, ReadingBuffer
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class FlakyBuffer(ReadingBuffer):
+    """ReadingBuffer whose writes fail `failures` times, then succeed."""
+
+    def __init__(self, failures=0, **kwargs):
+        super().__init__(max_age_seconds=3600, **kwargs)
+        self.failures = failures
+        self.writes = []
+        self.attempts = 0
+
+    def _write(self, rows):
+        self.attempts += 1
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("database unavailable")
+        self.writes.append(list(rows))
+
+
+def reading(device_id, kwh=1.0):
+    return (datetime(2024, 1, 1), device_id, "D1", kwh, "iot")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(buffer, "time", clock)
+    return clock
+
+
+def test_failed_flush_requeues_rows_ahead_of_newer_ones(clock, tmp_path):
+    buf = FlakyBuffer(failures=1, dead_letter_dir=str(tmp_path))
+
+    buf.add([reading("a")])
+    assert buf.flush() == 0
+    assert buf.pending() == 1
+    assert buf.retried_flushes == 1
+
+    buf.add([reading("b")])
+    assert buf.flush(force=True) == 2
+    assert [row[1] for row in buf.writes[0]] == ["a", "b"]
+    assert buf.failed_rows == 0
+
+
+def test_flush_waits_out_a_doubling_backoff(clock, tmp_path):
+    buf = FlakyBuffer(failures=3, dead_letter_dir=str(tmp_path))
+    buf.add([reading("a")])
+
+    waits = []
+    for _ in range(3):
+        buf.flush(force=True)
+        waits.append(buf._retry_at - clock.now)
+
+    base = buffer.RETRY_BACKOFF_SECONDS
+    assert waits == [base, 2 * base, 4 * base]
+
+    # Inside the backoff nothing is attempted
+    attempts = buf.attempts
+    assert buf.flush() == 0
+    assert buf.attempts == attempts
+
+    clock.sleep(4 * base)
+    assert buf.flush() == 1
+    assert buf.stats()["flush_attempts"] == 0
+
+
+def test_batch_is_dead_lettered_after_max_attempts(clock, tmp_path):
+    buf = FlakyBuffer(failures=buffer.MAX_FLUSH_ATTEMPTS, dead_letter_dir=str(tmp_path))
+    buf.add([reading("a", 1.5), reading("b", 2.5)])
+
+    for _ in range(buffer.MAX_FLUSH_ATTEMPTS):
+        buf.flush(force=True)
+
+    assert buf.pending() == 0
+    assert buf.failed_rows == 2
+    assert len(buf.dead_letter_files) == 1
+
+    spilled = pd.read_csv(buf.dead_letter_files[0])
+    assert list(spilled.columns) == list(buffer.STREAM_FIELDS)
+    assert spilled["device_id"].tolist() == ["a", "b"]
+    assert spilled["kwh"].tolist() == [1.5, 2.5]
+
+
+def test_drain_stops_once_a_batch_is_given_up_on(clock, tmp_path):
+    buf = FlakyBuffer(failures=100, dead_letter_dir=str(tmp_path))
+    buf.add([reading("a")])
+
+    assert buf.drain() == 0
+    assert buf.attempts == buffer.MAX_FLUSH_ATTEMPTS
+    assert buf.pending() == 0
+    assert buf.failed_rows == 1
+
+
+def test_add_refuses_rows_past_the_pending_limit(clock, tmp_path):
+    buf = FlakyBuffer(max_pending_rows=2, dead_letter_dir=str(tmp_path))
+    buf.add([reading("a"), reading("b")])
+
+    with pytest.raises(BufferFull):
+        buf.add([reading("c")])
+    assert buf.pending() == 2
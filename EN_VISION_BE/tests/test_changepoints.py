@@ -0,0 +1,71 @@
+import numpy as np
+import pandas as pd
+
+from services.analytics.changepoints import (
+    MIN_SEGMENT_DAYS,
+    find_change_points,
+    segment_frame,
+)
+
+
+def noisy(levels, days=30, scale=0.5, seed=3):
+    """Consecutive `days`-long segments around each level."""
+    rng = np.random.default_rng(seed)
+    return np.concatenate([level + rng.normal(0, scale, days) for level in levels])
+
+
+def test_stable_series_has_no_change_points():
+    assert find_change_points(noisy([10.0], days=120)) == []
+
+
+def test_single_level_shift_is_found_near_its_day():
+    splits = find_change_points(noisy([10.0, 20.0]))
+
+    assert len(splits) == 1
+    assert abs(splits[0] - 30) <= 1
+
+
+def test_several_shifts_come_back_sorted():
+    splits = find_change_points(noisy([10.0, 20.0, 5.0]))
+
+    assert len(splits) == 2
+    assert splits == sorted(splits)
+    assert abs(splits[0] - 30) <= 1
+    assert abs(splits[1] - 60) <= 1
+
+
+def test_segments_respect_min_size():
+    values = noisy([10.0, 40.0, 10.0, 40.0], days=MIN_SEGMENT_DAYS)
+
+    bounds = [0] + find_change_points(values) + [len(values)]
+    assert all(b - a >= MIN_SEGMENT_DAYS for a, b in zip(bounds, bounds[1:]))
+
+
+def test_short_or_constant_series_are_left_alone():
+    assert find_change_points(noisy([10.0, 50.0], days=MIN_SEGMENT_DAYS - 1)) == []
+    assert find_change_points(np.full(60, 7.0)) == []
+
+
+def test_higher_penalty_suppresses_small_shifts():
+    values = noisy([10.0, 10.6], days=60, scale=0.5)
+
+    assert find_change_points(values, penalty=1000.0) == []
+
+
+def test_segment_frame_rows():
+    values = noisy([10.0, 20.0])
+    df = pd.DataFrame({
+        "department_id": "D1",
+        "device_id": "m1",
+        "date": pd.date_range("2024-01-01", periods=len(values)),
+        "total_kwh": values,
+    })
+
+    first, second = segment_frame(df)
+
+    assert first["start_date"] == pd.Timestamp("2024-01-01").date()
+    assert first["shift_kwh"] is None and not first["is_open"]
+    assert second["is_open"]
+    assert second["day_count"] + first["day_count"] == len(values)
+    assert second["shift_kwh"] == second["mean_kwh"] - first["mean_kwh"]
+    assert second["shift_kwh"] > 5
@@ -0,0 +1,82 @@
+import pandas as pd
+
+from services.ingestion.dimensions import DimensionCache
+
+
+class FakeConn:
+    """
+    Stands in for the ingest connection: `committed` holds the dimension
+    rows other transactions have committed, {table: {string id: key}}.
+    """
+
+    def __init__(self, committed=None):
+        self.committed = committed or {"devices": {}, "departments": {}}
+        self.next_key = 100
+        self.statements = []
+
+    def execute(self, statement, params):
+        sql = str(statement)
+        table = "devices" if "INTO devices" in sql or "FROM devices" in sql else "departments"
+        self.statements.append((sql.split()[0], table, list(params["ids"])))
+
+        rows = self.committed[table]
+        if sql.lstrip().startswith("INSERT"):
+            created = []
+            for i in params["ids"]:
+                if i not in rows:
+                    self.next_key += 1
+                    created.append((self.next_key, i))
+            return created
+        return [(rows[i], i) for i in params["ids"] if i in rows]
+
+
+def test_resolve_registers_new_ids_without_sharing_them():
+    cache = DimensionCache()
+    conn = FakeConn()
+
+    keys = cache.for_load(conn).resolve("devices", ["m1", "m2"])
+
+    assert set(keys) == {"m1", "m2"}
+    # Not committed yet, so another load must not see them
+    assert cache.lookup("devices", ["m1", "m2"]) == {}
+
+
+def test_committed_ids_are_cached_for_later_loads():
+    cache = DimensionCache()
+    conn = FakeConn({"devices": {"m1": 7}, "departments": {}})
+
+    assert cache.for_load(conn).resolve("devices", ["m1"]) == {"m1": 7}
+    assert cache.lookup("devices", ["m1"]) == {"m1": 7}
+
+    conn.statements.clear()
+    assert cache.for_load(conn).resolve("devices", ["m1"]) == {"m1": 7}
+    assert conn.statements == []
+
+
+def test_a_load_reuses_keys_it_created():
+    cache = DimensionCache()
+    conn = FakeConn()
+    keys = cache.for_load(conn)
+
+    first = keys.resolve("devices", ["m1"])
+    conn.statements.clear()
+
+    assert keys.resolve("devices", ["m1", None]) == first
+    assert conn.statements == []
+
+
+def test_add_to_frame_maps_keys_per_row():
+    cache = DimensionCache()
+    conn = FakeConn({"devices": {"m1": 1, "m2": 2}, "departments": {"D1": 5}})
+
+    df = pd.DataFrame({
+        "device_id": ["m1", "m2", "m1"],
+        "department_id": ["D1", "D1", "D1"],
+        "kwh": [1.0, 2.0, 3.0],
+    })
+    keyed = cache.for_load(conn).add_to_frame(df)
+
+    assert keyed["device_key"].tolist() == [1, 2, 1]
+    assert keyed["department_key"].tolist() == [5, 5, 5]
+    assert str(keyed["device_key"].dtype) == "Int64"
+    assert "device_key" not in df.columns
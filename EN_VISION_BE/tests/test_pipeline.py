@@ -0,0 +1,103 @@
+import pytest
+
+from services.analytics.pipeline import (
+    PIPELINE,
+    RAW_EVENTS,
+    STAGES_BY_NAME,
+    Stage,
+    fuse_stages,
+    select_stages,
+)
+
+
+def test_dag_lists_stages_after_their_inputs():
+    seen = set()
+    for stage in PIPELINE:
+        assert set(stage.upstream) <= seen, stage.name
+        seen.add(stage.name)
+
+
+def test_select_stages_defaults_to_every_default_stage():
+    names = select_stages()
+
+    assert names == [stage.name for stage in PIPELINE if stage.default]
+    assert "summary_baseline_deviation" not in names
+    assert "forecast_lstm" not in names
+
+
+def test_select_stages_keeps_dag_order():
+    assert select_stages(["rollups", "daily_summary"]) == ["daily_summary", "rollups"]
+
+
+def test_select_stages_upstream_follows_default_dependencies():
+    assert select_stages(["deviation"], upstream=True) == [
+        "daily_summary", "baseline", "deviation",
+    ]
+    # forecast_lstm is on request only, so carbon doesn't pull it in
+    assert select_stages(["carbon"], upstream=True) == [
+        "daily_summary", "forecast_xgboost", "carbon",
+    ]
+
+
+def test_select_stages_downstream_follows_dependents_transitively():
+    assert select_stages(["rollups"], downstream=True) == ["rollups", "baseline_profile"]
+    assert select_stages(["baseline"], downstream=True) == [
+        "baseline", "deviation", "rollups", "baseline_profile",
+    ]
+
+
+def test_select_stages_rejects_unknown_names():
+    with pytest.raises(ValueError, match="nope"):
+        select_stages(["baseline", "nope"])
+
+
+def test_fuse_stages_swaps_covered_stages_for_the_fused_one():
+    names, aliases = fuse_stages(
+        ["daily_summary", "baseline", "deviation", "anomaly", "rollups"]
+    )
+
+    assert names == ["summary_baseline_deviation", "anomaly", "rollups"]
+    assert aliases == {
+        "daily_summary": "summary_baseline_deviation",
+        "baseline": "summary_baseline_deviation",
+        "deviation": "summary_baseline_deviation",
+    }
+
+
+def test_fuse_stages_puts_the_fused_stage_where_the_first_covered_one_was():
+    names, _ = fuse_stages(["anomaly", "baseline", "rollups", "deviation"])
+    assert names == ["anomaly", "summary_baseline_deviation", "rollups"]
+
+
+def test_fuse_stages_leaves_uncovered_runs_alone():
+    names, aliases = fuse_stages(["rollups", "baseline_profile"])
+
+    assert names == ["rollups", "baseline_profile"]
+    assert aliases == {}
+
+
+def test_stage_call_passes_what_the_mode_takes(monkeypatch):
+    calls = []
+
+    def target(**kwargs):
+        calls.append(kwargs)
+
+    module = type("module", (), {"target": staticmethod(target)})
+    monkeypatch.setattr("services.analytics.pipeline.import_module", lambda name: module)
+
+    Stage("a", "m:target", [RAW_EVENTS], mode="incremental").call(batch_ids=["b1"])
+    Stage("b", "m:target", [RAW_EVENTS], mode="batches").call(batch_ids=["b1"])
+    Stage("c", "m:target", [RAW_EVENTS]).call(batch_ids=["b1"])
+    Stage("d", "m:target", [RAW_EVENTS], mode="incremental").call(batch_ids=["b1"], full=True)
+
+    assert calls == [
+        {"batch_ids": ["b1"], "incremental": True},
+        {"batch_ids": ["b1"]},
+        {},
+        {},
+    ]
+
+
+def test_fused_stages_cover_existing_stages():
+    for stage in PIPELINE:
+        assert all(name in STAGES_BY_NAME for name in stage.covers)
@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from services.analytics.resample import (
+    ALIGNED_COLUMNS,
+    _nan_run_lengths,
+    align_readings,
+    device_chunks,
+    run_interval_resample,
+)
+
+
+def readings(rows):
+    return pd.DataFrame(rows, columns=["timestamp", "device_id", "department_id", "kwh"])
+
+
+def test_nan_run_lengths_measures_each_missing_run_per_column():
+    missing = np.array([
+        [False, True],
+        [True, True],
+        [True, False],
+        [False, True],
+        [True, True],
+    ])
+
+    assert _nan_run_lengths(missing).tolist() == [
+        [0, 2],
+        [2, 2],
+        [2, 0],
+        [0, 2],
+        [1, 2],
+    ]
+
+
+def test_nan_run_lengths_of_a_full_column():
+    missing = np.ones((3, 1), dtype=bool)
+    assert _nan_run_lengths(missing).ravel().tolist() == [3, 3, 3]
+
+
+def test_align_readings_sums_readings_within_a_slot():
+    df = readings([
+        ["2024-01-01 00:00", "m1", "d1", 1.0],
+        ["2024-01-01 00:10", "m1", "d1", 2.0],
+        ["2024-01-01 00:30", "m1", "d1", 4.0],
+    ])
+
+    aligned = align_readings(df, 30)
+
+    assert list(aligned.columns) == ALIGNED_COLUMNS
+    assert aligned["kwh"].tolist() == [3.0, 4.0]
+    assert aligned["quality"].tolist() == ["observed", "observed"]
+    assert (aligned["interval_minutes"] == 30).all()
+
+
+def test_align_readings_interpolates_short_gaps_and_flags_long_ones():
+    df = readings([
+        ["2024-01-01 00:00", "m1", "d1", 1.0],
+        ["2024-01-01 01:00", "m1", "d1", 3.0],
+        ["2024-01-01 04:00", "m1", "d1", 5.0],
+    ])
+
+    aligned = align_readings(df, 30, max_gap=2)
+
+    assert aligned["quality"].tolist() == [
+        "observed", "interpolated", "observed",
+        "gap", "gap", "gap", "gap", "gap",
+        "observed",
+    ]
+    assert aligned["kwh"].iloc[1] == pytest.approx(2.0)
+    assert aligned["kwh"].iloc[3:8].isna().all()
+
+
+def test_align_readings_keeps_each_device_to_its_own_span():
+    df = readings([
+        ["2024-01-01 00:00", "m1", "d1", 1.0],
+        ["2024-01-01 00:30", "m1", "d1", 1.0],
+        ["2024-01-01 01:00", "m2", "d2", 2.0],
+        ["2024-01-01 02:00", "m2", "d2", 2.0],
+    ])
+
+    aligned = align_readings(df, 30)
+
+    m1 = aligned[aligned["device_id"] == "m1"]
+    m2 = aligned[aligned["device_id"] == "m2"]
+    assert m1["slot_start"].tolist() == list(pd.date_range("2024-01-01 00:00", periods=2, freq="30min"))
+    assert m2["slot_start"].tolist() == list(pd.date_range("2024-01-01 01:00", periods=3, freq="30min"))
+    assert m2["department_id"].unique().tolist() == ["d2"]
+    assert m2["quality"].tolist() == ["observed", "interpolated", "observed"]
+
+
+def test_device_chunks_stay_under_the_cell_budget():
+    spans = pd.DataFrame({
+        "device_id": ["a", "b", "c"],
+        "first_ts": pd.to_datetime(["2024-01-01", "2024-01-01", "2024-01-02"]),
+        "last_ts": pd.to_datetime(["2024-01-01 23:30", "2024-01-01 23:30", "2024-01-02 23:30"]),
+    })
+
+    # One day is 48 half-hour slots
+    assert list(device_chunks(spans, 30, max_cells=96)) == [["a", "b"], ["c"]]
+    assert list(device_chunks(spans, 30, max_cells=48)) == [["a"], ["b"], ["c"]]
+
+
+def test_finer_than_reading_interval_is_rejected():
+    with pytest.raises(ValueError):
+        run_interval_resample(15)
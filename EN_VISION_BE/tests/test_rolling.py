@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from services.analytics.rolling import MAD_SCALE, MIN_HISTORY_DAYS, _window_stats
+
+
+def series(values, device="m1", department="d1", start="2024-01-01"):
+    return pd.DataFrame({
+        "date": pd.date_range(start, periods=len(values), freq="D"),
+        "department_id": department,
+        "device_id": device,
+        "total_kwh": values,
+    })
+
+
+def test_days_without_enough_history_are_not_scored():
+    out = _window_stats(series([1.0, 2.0, 3.0, 10.0]), days=7)
+
+    assert out["mean_kwh"].iloc[:MIN_HISTORY_DAYS].isna().all()
+    assert out["z_score"].iloc[:MIN_HISTORY_DAYS].isna().all()
+    assert out["ewma_kwh"].iloc[:MIN_HISTORY_DAYS].isna().all()
+
+
+def test_scores_against_the_trailing_window():
+    out = _window_stats(series([1.0, 2.0, 3.0, 10.0]), days=7).iloc[3]
+
+    assert out["mean_kwh"] == pytest.approx(2.0)
+    assert out["stddev_kwh"] == pytest.approx(1.0)
+    assert out["median_kwh"] == pytest.approx(2.0)
+    assert out["mad_kwh"] == pytest.approx(1.0)
+    assert out["z_score"] == pytest.approx(8.0)
+    assert out["robust_score"] == pytest.approx(8.0 / MAD_SCALE)
+    assert out["window_days"] == 7
+
+
+def test_window_only_reaches_back_its_length():
+    out = _window_stats(series([100.0, 100.0, 1.0, 2.0, 3.0, 5.0]), days=3).iloc[5]
+
+    assert out["mean_kwh"] == pytest.approx(2.0)
+    assert out["median_kwh"] == pytest.approx(2.0)
+
+
+def test_missing_days_take_up_window_slots():
+    # Calendar days with no summary row (NaN) still count towards the
+    # window length, so only one real day is left inside it
+    out = _window_stats(series([1.0, 2.0, 3.0, np.nan, np.nan, 4.0]), days=3)
+
+    assert np.isnan(out["mean_kwh"].iloc[5])
+
+
+def test_devices_do_not_share_history():
+    df = pd.concat(
+        [series([1.0, 2.0, 3.0, 4.0]), series([50.0, 60.0, 70.0, 80.0], device="m2")],
+        ignore_index=True,
+    )
+
+    out = _window_stats(df, days=7)
+
+    assert out["mean_kwh"].iloc[3] == pytest.approx(2.0)
+    assert out["mean_kwh"].iloc[4:7].isna().all()
+    assert out["mean_kwh"].iloc[7] == pytest.approx(60.0)
+
+
+def test_flat_history_gives_no_scores():
+    out = _window_stats(series([5.0, 5.0, 5.0, 9.0]), days=7).iloc[3]
+
+    assert out["stddev_kwh"] == 0
+    assert out["mad_kwh"] == 0
+    assert np.isnan(out["z_score"])
+    assert np.isnan(out["robust_score"])
+
+
+def test_ewma_covers_the_days_before_each_day():
+    values = [1.0, 2.0, 3.0, 4.0, 8.0]
+    out = _window_stats(series(values), days=7)
+
+    expected = (
+        pd.Series(values).shift(1)
+        .ewm(span=7, min_periods=MIN_HISTORY_DAYS).mean()
+    )
+    np.testing.assert_allclose(out["ewma_kwh"], expected, equal_nan=True)
@@ -0,0 +1,82 @@
+import math
+from collections import Counter, namedtuple
+
+import numpy as np
+import pytest
+
+from services.analytics.sketch import (
+    GAMMA,
+    RELATIVE_ACCURACY,
+    ZERO_BUCKET,
+    merge_sketches,
+    quantiles,
+)
+
+QS = (0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99)
+
+
+def sketch(values):
+    """Python twin of sketch_bucket_sql: bucket counts for `values`."""
+    return dict(Counter(
+        str(math.ceil(math.log(v) / math.log(GAMMA))) if v > 0 else ZERO_BUCKET
+        for v in values
+    ))
+
+
+def exact(values, q):
+    # The reading quantiles() targets: rank q * (n - 1), rounded down
+    ordered = sorted(values)
+    return ordered[int(q * (len(ordered) - 1))]
+
+
+def assert_within_bound(estimates, values):
+    for q in QS:
+        true = exact(values, q)
+        assert estimates[q] == pytest.approx(true, rel=RELATIVE_ACCURACY), q
+
+
+def test_quantiles_are_within_relative_accuracy():
+    values = np.random.default_rng(7).lognormal(mean=1.0, sigma=1.5, size=20_000)
+
+    assert_within_bound(quantiles(sketch(values), QS), values)
+
+
+def test_merged_sketches_keep_the_bound():
+    rng = np.random.default_rng(11)
+    days = [rng.gamma(shape=2.0, scale=scale, size=1_000) for scale in (0.5, 3.0, 40.0)]
+
+    merged = Counter()
+    for day in days:
+        merged.update(sketch(day))
+
+    assert_within_bound(quantiles(dict(merged), QS), np.concatenate(days))
+
+
+def test_zero_readings_and_empty_sketch():
+    values = [0.0] * 10 + [5.0] * 10
+
+    result = quantiles(sketch(values), (0.25, 0.75))
+    assert result[0.25] == 0.0
+    assert result[0.75] == pytest.approx(5.0, rel=RELATIVE_ACCURACY)
+
+    assert quantiles({}, (0.5,)) == {0.5: None}
+
+
+def test_merge_sketches_returns_integer_counts_per_bucket():
+    Row = namedtuple("Row", "bucket readings")
+
+    class FakeResult:
+        def fetchall(self):
+            return [Row("12", 3), Row(ZERO_BUCKET, 2)]
+
+    class FakeConn:
+        def execute(self, statement, params):
+            self.sql, self.params = str(statement), params
+            return FakeResult()
+
+    conn = FakeConn()
+    merged = merge_sketches(conn, "WHERE d.device_id = :device_id", {"device_id": "m1"})
+
+    assert merged == {"12": 3, ZERO_BUCKET: 2}
+    assert "WHERE d.device_id = :device_id" in conn.sql
+    assert conn.params == {"device_id": "m1"}
@@ -0,0 +1,157 @@
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from services.ingestion import validation
+from services.ingestion.schemas import DEFAULT_SOURCE_TYPE, parse_reading
+from services.ingestion.validation import validate_chunk
+
+
+def chunk(rows):
+    return pd.DataFrame(rows, columns=validation.RAW_COLUMNS)
+
+
+def test_validate_chunk_tags_each_row_with_its_first_failing_check():
+    df = chunk([
+        ["2024-01-01T00:00:00", "m1", "d1", "1.5", "iot"],
+        ["not a date", "m1", "d1", "1.0", "iot"],
+        ["2024-01-01T00:30:00", "", "d1", "1.0", "iot"],
+        ["2024-01-01T00:30:00", "   ", "d1", "1.0", "iot"],
+        ["2024-01-01T00:30:00", "m1", None, "1.0", "iot"],
+        ["2024-01-01T00:30:00", "m1", "d1", "abc", "iot"],
+        ["2024-01-01T00:30:00", "m1", "d1", "inf", "iot"],
+        ["2024-01-01T00:30:00", "m1", "d1", "-2", "iot"],
+        # Bad timestamp wins over the missing device
+        ["nope", "", "d1", "1.0", "iot"],
+    ])
+
+    valid, rejects = validate_chunk(df)
+
+    assert len(valid) == 1
+    assert valid["kwh"].tolist() == [1.5]
+    assert valid["timestamp"].tolist() == [pd.Timestamp("2024-01-01")]
+
+    assert rejects["reason"].tolist() == [
+        validation.INVALID_TIMESTAMP,
+        validation.MISSING_DEVICE_ID,
+        validation.MISSING_DEVICE_ID,
+        validation.MISSING_DEPARTMENT_ID,
+        validation.INVALID_KWH,
+        validation.INVALID_KWH,
+        validation.NEGATIVE_KWH,
+        validation.INVALID_TIMESTAMP,
+    ]
+    assert rejects["row_number"].tolist() == [2, 3, 4, 5, 6, 7, 8, 9]
+
+
+def test_validate_chunk_row_numbers_follow_the_chunk_index():
+    df = chunk([
+        ["2024-01-01T00:00:00", "m1", "d1", "1", "iot"],
+        ["2024-01-01T00:00:00", "m1", "d1", "-1", "iot"],
+    ])
+    df.index = pd.RangeIndex(500, 502)
+
+    _, rejects = validate_chunk(df)
+
+    assert rejects["row_number"].tolist() == [502]
+
+
+def test_validate_chunk_normalises_offsets_to_naive_utc():
+    df = chunk([
+        ["2024-01-01T02:00:00+02:00", "m1", "d1", "1", "iot"],
+        ["2024-01-01T00:30:00Z", "m1", "d1", "1", "iot"],
+    ])
+
+    valid, rejects = validate_chunk(df)
+
+    assert rejects.empty
+    assert valid["timestamp"].tolist() == [
+        pd.Timestamp("2024-01-01 00:00"),
+        pd.Timestamp("2024-01-01 00:30"),
+    ]
+
+
+def test_validate_chunk_rejects_unknown_devices_only_when_given_a_registry():
+    df = chunk([
+        ["2024-01-01T00:00:00", "m1", "d1", "1", "iot"],
+        ["2024-01-01T00:00:00", "m9", "d1", "1", "iot"],
+    ])
+
+    valid, rejects = validate_chunk(df)
+    assert len(valid) == 2
+
+    valid, rejects = validate_chunk(df, known_devices={"m1"})
+    assert valid["device_id"].tolist() == ["m1"]
+    assert rejects["reason"].tolist() == [validation.UNKNOWN_DEVICE]
+
+
+def test_validate_chunk_accepts_numeric_id_columns():
+    df = pd.DataFrame({
+        "timestamp": ["2024-01-01T00:00:00", "2024-01-01T00:30:00"],
+        "device_id": [101, None],
+        "department_id": [7, 7],
+        "kwh": [1.0, 2.0],
+        "source_type": ["iot", "iot"],
+    })
+
+    valid, rejects = validate_chunk(df)
+
+    assert len(valid) == 1
+    assert rejects["reason"].tolist() == [validation.MISSING_DEVICE_ID]
+
+
+def reading(**overrides):
+    obj = {
+        "timestamp": "2024-01-01T00:00:00",
+        "device_id": "m1",
+        "department_id": "d1",
+        "kwh": 1.25,
+        "source_type": "meter",
+    }
+    obj.update(overrides)
+    return obj
+
+
+def test_parse_reading_returns_a_stream_row():
+    assert parse_reading(reading()) == (
+        datetime(2024, 1, 1), "m1", "d1", 1.25, "meter",
+    )
+
+
+def test_parse_reading_converts_timestamps_to_naive_utc():
+    row = parse_reading(reading(timestamp="2024-01-01T02:00:00+02:00"))
+    assert row[0] == datetime(2024, 1, 1)
+
+    row = parse_reading(reading(timestamp=1704067200))
+    assert row[0] == datetime(2024, 1, 1)
+
+
+def test_parse_reading_defaults_source_type_and_coerces_int_kwh():
+    obj = reading(kwh=2)
+    del obj["source_type"]
+
+    row = parse_reading(obj)
+
+    assert row[3] == 2.0 and isinstance(row[3], float)
+    assert row[4] == DEFAULT_SOURCE_TYPE
+
+
+@pytest.mark.parametrize("obj, message", [
+    (["not", "an", "object"], "JSON object"),
+    ({"timestamp": "2024-01-01T00:00:00", "device_id": "m1", "kwh": 1},
+     "missing field department_id"),
+    (reading(device_id=""), "device_id"),
+    (reading(device_id="  "), "device_id"),
+    (reading(department_id=3), "department_id"),
+    (reading(kwh="1.0"), "kwh must be numeric"),
+    (reading(kwh=True), "kwh must be numeric"),
+    (reading(kwh=float("nan")), "kwh must be finite"),
+    (reading(kwh=-0.5), "kwh must not be negative"),
+    (reading(timestamp=None), "timestamp"),
+    (reading(timestamp="yesterday"), "Invalid isoformat"),
+    (reading(source_type=5), "source_type"),
+])
+def test_parse_reading_rejects(obj, message):
+    with pytest.raises(ValueError, match=message):
+        parse_reading(obj)
@@ -0,0 +1,23 @@
+import os
+
+# Deployment settings; each can be overridden with an environment variable
+
+# How often meters report, in minutes. Readings are interval energy, so
+# this is also the finest grid they can be aligned to.
+READING_INTERVAL_MINUTES = int(os.getenv("ENVISION_READING_INTERVAL_MINUTES", "30"))
+
+# Flat commercial tariff used for rollup costs, currency units per kWh
+TARIFF_PER_KWH = float(os.getenv("ENVISION_TARIFF_PER_KWH", "8.0"))
+
+# Largest single file upload accepted by /ingest (413 above this). Also
+# the share of the in-flight byte budget reserved for an upload sent
+# without Content-Length, whose size is only known once it has arrived
+MAX_UPLOAD_BYTES = int(os.getenv("ENVISION_MAX_UPLOAD_BYTES", str(256 * 1024 ** 2)))
+
+# Streamed readings the buffer gives up writing are spilled here as
+# CSV, for replay with scripts.run_backfill
+DEAD_LETTER_DIR = os.getenv("ENVISION_DEAD_LETTER_DIR", "dead_letter")
+
+# Post-ingest runs retrain the XGBoost forecast at most this often;
+# uploads in between keep the previous forecast
+FORECAST_RETRAIN_MINUTES = int(os.getenv("ENVISION_FORECAST_RETRAIN_MINUTES", "360"))